@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+账户验证 - 按凭证指纹缓存验证结果，并发执行 test_connection
+"""
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+VALIDATION_TTL = 3600  # 验证结果有效期（秒）
+MAX_VALIDATION_WORKERS = 64  # 并发验证的最大线程数
+
+
+def credential_fingerprint(exchange, api_key, secret_key, passphrase=None, testnet=False):
+    """生成凭证指纹（只保存哈希，不保存密钥本身）"""
+    raw = '\0'.join([
+        exchange,
+        api_key or '',
+        secret_key or '',
+        passphrase or '',
+        'testnet' if testnet else 'mainnet'
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ValidationCache:
+    """验证结果缓存，只缓存验证成功的凭证"""
+
+    def __init__(self, ttl=VALIDATION_TTL):
+        self.ttl = ttl
+        self._validated = {}  # {fingerprint: validated_at}
+        self._lock = threading.Lock()
+
+    def is_valid(self, fingerprint):
+        validated_at = self._validated.get(fingerprint)
+        return validated_at is not None and time.time() - validated_at < self.ttl
+
+    def mark_valid(self, fingerprint):
+        with self._lock:
+            self._validated[fingerprint] = time.time()
+
+    def invalidate(self, fingerprint):
+        with self._lock:
+            self._validated.pop(fingerprint, None)
+
+
+# 进程级验证缓存
+validation_cache = ValidationCache()
+
+
+def validate_exporter(exporter, fingerprint, cache=None):
+    """验证单个账户，命中缓存时不发送请求"""
+    cache = cache or validation_cache
+    if cache.is_valid(fingerprint):
+        return True
+
+    success = exporter.test_connection()
+    if success:
+        cache.mark_valid(fingerprint)
+    return success
+
+
+def validate_concurrently(items, cache=None, max_workers=MAX_VALIDATION_WORKERS):
+    """
+    并发验证多个账户
+    items: {key: (exporter, fingerprint)}
+    返回: {key: True/False}，验证过程抛出的异常原样作为值返回
+    """
+    if not items:
+        return {}
+
+    results = {}
+    workers = min(max_workers, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            key: executor.submit(validate_exporter, exporter, fingerprint, cache)
+            for key, (exporter, fingerprint) in items.items()
+        }
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = e
+    return results
@@ -3,184 +3,394 @@
 多交易所多账户交易分析网站 - 支持 Binance、OKX 和 Bybit
 """
 
-from flask import Flask, render_template, request, jsonify, session, send_file, flash, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, send_file, flash, redirect, url_for, g, Response
+from flask.json.provider import DefaultJSONProvider
 import os
 import json
 import csv
 import tempfile
 from datetime import datetime, timedelta
-from binance_exporter import BinanceTradeExporter
-from okx_exporter import OKXTradeExporter
-from bybit_exporter import BybitTradeExporter
+from exchange_registry import create_exporter, get_plugin
+from account_validation import credential_fingerprint, validation_cache, validate_concurrently, validate_exporter
+from lot_matching import FIFO, METHODS as COST_METHODS, LotMatcher
+from markets import DEFAULT_MARKETS, MARKET_SEPARATOR, market_label, parse_markets, split_market_symbol
+from daily_snapshots import get_snapshot_store
+from shared_store import get_shared_store
+from sync_scheduler import MAX_SYNC_DAYS, scheduler_clients, start_sync_scheduler
+from trade_cache import get_trade_cache
+from trade_selection import SelectionError, get_trade_index
+from http_caching import cached_json, not_modified
+from session_registry import AnalyzerRegistry, MAX_ACCOUNTS_PER_SESSION
+from trade_dedup import new_dedup_index
+from trade_merge import flatten, merge_trade_streams, prefetch, trade_time
+import json_backend
+import prometheus_metrics
+import secrets
+import threading
+import time
 import traceback
+import uuid
+import tracing
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify 和请求解析使用 json_backend（orjson 可用时）
+    
+    解析后的内容与 Flask 默认的 JSON 响应相同：非 ASCII 字符按 ensure_ascii 转义，NaN / Infinity 原样输出；
+    但不保证逐字节一致，例如 orjson 把 1e-07 写成 1e-7，紧凑输出不带空格"""
+    
+    def dumps(self, obj, **kwargs):
+        indent = kwargs.pop('indent', None)
+        sort_keys = kwargs.pop('sort_keys', self.sort_keys)
+        default = kwargs.pop('default', self.default)
+        ensure_ascii = kwargs.pop('ensure_ascii', self.ensure_ascii)
+        # json_backend 只支持紧凑输出和 2 空格缩进，其他缩进和参数（例如 separators）交给标准库
+        if kwargs or indent not in (None, 2):
+            return super().dumps(obj, indent=indent, sort_keys=sort_keys, default=default,
+                                 ensure_ascii=ensure_ascii, **kwargs)
+        return json_backend.dumps(obj, indent=indent == 2, sort_keys=sort_keys, default=default,
+                                  ensure_ascii=ensure_ascii)
+    
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_backend.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = json_backend.dumps_bytes(obj, indent=indent, sort_keys=self.sort_keys, default=self.default,
+                                        ensure_ascii=self.ensure_ascii)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'  # 在生产环境中应该使用随机密钥
+app.json = FastJSONProvider(app)
+# 多个 worker 必须使用相同的密钥，生产环境必须通过 TRADE_SECRET_KEY 设置（wsgi.py 在未设置时拒绝启动）；
+# 单进程的开发服务器未设置时使用进程内的随机密钥，重启后会话失效
+app.secret_key = os.environ.get('TRADE_SECRET_KEY') or secrets.token_hex(32)
+
+# Web 服务默认静默，导出器的逐日日志只记录到查询追踪中（TRADE_QUIET=0 可恢复输出）
+tracing.set_quiet(os.environ.get('TRADE_QUIET', '1') == '1')
+
+# 查询到的成交是否物化到每日快照（TRADE_SNAPSHOTS=0 关闭）
+SNAPSHOTS_ENABLED = os.environ.get('TRADE_SNAPSHOTS', '1') == '1'
+# 所有交易所请求改发到指定主机（如本地模拟交易所，用于压测），由运维配置而非用户输入
+API_HOST = os.environ.get('TRADE_API_HOST') or None
+
+
+def exchange_label(exchange):
+    plugin = get_plugin(exchange)
+    return plugin.label if plugin else exchange
 
 class MultiExchangeTradeAnalyzer:
     """多交易所多账户交易分析器"""
     
-    def __init__(self):
-        self.accounts = {}  # {account_name: {'exporter': exporter, 'exchange': 'binance'/'okx'/'bybit'}}
+    def __init__(self, max_accounts=MAX_ACCOUNTS_PER_SESSION):
+        self.accounts = {}  # {account_name: {'exporter': exporter, 'exchange': 'binance'/'okx'/'bybit', 'status': ...}}
+        self.max_accounts = max_accounts
+        self.store_version = 0  # 已同步的共享存储账户版本
         self.all_trades = []
     
-    def add_binance_account(self, account_name, api_key, secret_key, testnet=False):
-        """添加 Binance 账户"""
-        try:
-            exporter = BinanceTradeExporter(api_key, secret_key, testnet)
-            if exporter.test_connection():
-                self.accounts[account_name] = {
-                    'exporter': exporter,
-                    'exchange': 'binance',
-                    'testnet': testnet
-                }
-                return True, "Binance 账户连接成功"
+    def add_accounts(self, account_configs, defer_validation=False):
+        """
+        批量添加账户，并发验证
+        account_configs: [{'account_name', 'exchange', 'api_key', 'secret_key', 'passphrase', 'testnet'}]
+        defer_validation: 为 True 时不验证，账户立即可用，出现认证错误时再重新检查
+        返回: {account_name: (success, message)}
+        """
+        results = {}
+        candidates = {}
+        
+        for config in account_configs:
+            account_name = config['account_name']
+            exchange = config.get('exchange', 'binance')
+            label = exchange_label(exchange)
+            testnet = config.get('testnet', False)
+            if account_name not in self.accounts and len(self.accounts) + len(candidates) >= self.max_accounts:
+                results[account_name] = (False, f"账户数量已达上限 ({self.max_accounts})")
+                continue
+            try:
+                # 导出器模块在该交易所的第一个账户添加时才导入
+                exporter = create_exporter(exchange, config['api_key'], config['secret_key'],
+                                           config.get('passphrase'), testnet, api_host=API_HOST)
+            except Exception as e:
+                results[account_name] = (False, f"{label} 账户连接错误: {str(e)}")
+                continue
+            
+            fingerprint = credential_fingerprint(exchange, config['api_key'], config['secret_key'],
+                                                 config.get('passphrase'), testnet)
+            candidates[account_name] = (exporter, fingerprint, exchange, testnet)
+        
+        if defer_validation:
+            statuses = {name: validation_cache.is_valid(fingerprint) or None
+                        for name, (_, fingerprint, _, _) in candidates.items()}
+        else:
+            statuses = validate_concurrently({name: (exporter, fingerprint)
+                                              for name, (exporter, fingerprint, _, _) in candidates.items()})
+        
+        for account_name, (exporter, fingerprint, exchange, testnet) in candidates.items():
+            plugin = get_plugin(exchange)
+            status = statuses[account_name]
+            
+            if isinstance(status, Exception):
+                results[account_name] = (False, f"{plugin.label} 账户连接错误: {str(status)}")
+                continue
+            if status is False:
+                results[account_name] = (False, f"{plugin.label} 账户连接失败，{plugin.validation_hint}")
+                continue
+            
+            exporter.auth_error_callback = lambda name=account_name: self._on_auth_error(name)
+            self.accounts[account_name] = {
+                'exporter': exporter,
+                'exchange': exchange,
+                'testnet': testnet,
+                'fingerprint': fingerprint,
+                'status': 'valid' if status else 'unverified'
+            }
+            if status:
+                results[account_name] = (True, f"{label} 账户连接成功")
             else:
-                return False, "Binance 账户连接失败，请检查API密钥"
-        except Exception as e:
-            return False, f"Binance 账户连接错误: {str(e)}"
+                results[account_name] = (True, f"{label} 账户已添加，将在出现认证错误时重新验证")
+        
+        return results
+    
+    def sync_accounts(self, account_configs):
+        """按共享存储中的账户配置重建账户（其他 worker 添加、替换或清除的账户），不重新验证"""
+        fingerprints = {
+            config['account_name']: credential_fingerprint(config['exchange'], config['api_key'], config['secret_key'],
+                                                           config.get('passphrase'), config.get('testnet', False))
+            for config in account_configs
+        }
+        for account_name in list(self.accounts):
+            if self.accounts[account_name]['fingerprint'] != fingerprints.get(account_name):
+                del self.accounts[account_name]
+        missing = [config for config in account_configs if config['account_name'] not in self.accounts]
+        if missing:
+            self.add_accounts(missing, defer_validation=True)
+    
+    def _on_auth_error(self, account_name):
+        """导出器遇到认证错误时调用：清除验证缓存并在后台重新验证"""
+        account_info = self.accounts.get(account_name)
+        if not account_info or account_info['status'] == 'checking':
+            return
+        
+        validation_cache.invalidate(account_info['fingerprint'])
+        account_info['status'] = 'checking'
+        
+        def revalidate():
+            try:
+                success = validate_exporter(account_info['exporter'], account_info['fingerprint'])
+            except Exception:
+                success = False
+            account_info['status'] = 'valid' if success else 'invalid'
+        
+        threading.Thread(target=revalidate, daemon=True).start()
+    
+    def add_binance_account(self, account_name, api_key, secret_key, testnet=False, defer_validation=False):
+        """添加 Binance 账户"""
+        return self.add_accounts([{
+            'account_name': account_name, 'exchange': 'binance',
+            'api_key': api_key, 'secret_key': secret_key, 'testnet': testnet
+        }], defer_validation)[account_name]
     
-    def add_okx_account(self, account_name, api_key, secret_key, passphrase, testnet=False):
+    def add_okx_account(self, account_name, api_key, secret_key, passphrase, testnet=False, defer_validation=False):
         """添加 OKX 账户"""
-        try:
-            exporter = OKXTradeExporter(api_key, secret_key, passphrase, testnet)
-            if exporter.test_connection():
-                self.accounts[account_name] = {
-                    'exporter': exporter,
-                    'exchange': 'okx',
-                    'testnet': testnet
-                }
-                return True, "OKX 账户连接成功"
-            else:
-                return False, "OKX 账户连接失败，请检查API密钥和密码"
-        except Exception as e:
-            return False, f"OKX 账户连接错误: {str(e)}"
+        return self.add_accounts([{
+            'account_name': account_name, 'exchange': 'okx',
+            'api_key': api_key, 'secret_key': secret_key, 'passphrase': passphrase, 'testnet': testnet
+        }], defer_validation)[account_name]
     
-    def add_bybit_account(self, account_name, api_key, secret_key, testnet=False):
+    def add_bybit_account(self, account_name, api_key, secret_key, testnet=False, defer_validation=False):
         """添加 Bybit 账户"""
+        return self.add_accounts([{
+            'account_name': account_name, 'exchange': 'bybit',
+            'api_key': api_key, 'secret_key': secret_key, 'testnet': testnet
+        }], defer_validation)[account_name]
+    
+    def _account_batches(self, account_name, account_info, symbol, start_date, end_date, market):
+        """单个账户某个市场按天产出的成交批次，附带账户和交易所信息（在预取线程中运行）"""
+        exchange = account_info['exchange']
+        count = 0
+        cache_stats = {}
+        with tracing.span('account', account=account_name, exchange=exchange, market=market) as account_span:
+            # 后台同步或之前的查询已获取的日期直接从缓存读取
+            batches = get_trade_cache().day_batches(account_info['exporter'], account_info['fingerprint'],
+                                                    symbol, start_date, end_date, cache_stats, market)
+            for batch in batches:
+                # 为每条交易添加账户信息和交易所信息
+                for trade in batch:
+                    trade['account_name'] = account_name
+                    trade['exchange'] = exchange
+                count += len(batch)
+                prometheus_metrics.TRADES_FETCHED.inc(len(batch), exchange=exchange)
+                yield batch
+            account_span.set(trades=count, **cache_stats)
+            prometheus_metrics.TRADE_CACHE_DAYS.inc(cache_stats['cached_days'], exchange=exchange, outcome='hit')
+            prometheus_metrics.TRADE_CACHE_DAYS.inc(cache_stats['fetched_days'], exchange=exchange, outcome='miss')
+    
+    def _account_stream(self, account_name, account_info, symbol, start_date, end_date, account_stats,
+                        markets=DEFAULT_MARKETS):
+        """单个账户的有序成交流，结束时把统计写入 account_stats
+        
+        每个市场在各自的预取线程中获取（各用自己的客户端和限频器），归并为一个流；
+        预取线程在调用时就启动，不等到归并第一次读取这个流，各账户、各市场因此同时开始获取。
+        交易所不支持的市场跳过并记录在统计中"""
+        supported = [market for market in markets if market in account_info['exporter'].markets]
+        unsupported = [market for market in markets if market not in supported]
+        streams = [flatten(prefetch(self._account_batches(account_name, account_info, symbol,
+                                                          start_date, end_date, market)))
+                   for market in supported]
+        return self._iter_account_stream(account_name, account_info, streams, supported, unsupported,
+                                         account_stats)
+    
+    def _iter_account_stream(self, account_name, account_info, streams, supported, unsupported, account_stats):
+        count = 0
+        market_counts = dict.fromkeys(supported, 0)
+        # 相邻日窗口首尾重叠，重试也可能重复返回，按 (交易所, 账户, 交易对, 市场, 交易ID) 去重
+        seen = new_dedup_index()
         try:
-            exporter = BybitTradeExporter(api_key, secret_key, testnet)
-            if exporter.test_connection():
-                self.accounts[account_name] = {
-                    'exporter': exporter,
-                    'exchange': 'bybit',
-                    'testnet': testnet
-                }
-                return True, "Bybit 账户连接成功"
-            else:
-                return False, "Bybit 账户连接失败，请检查API密钥"
+            if not supported:
+                raise ValueError(f"{exchange_label(account_info['exchange'])} 不支持所选市场: "
+                                 f"{', '.join(market_label(market) for market in unsupported)}")
+            for trade in seen.filter_ordered(merge_trade_streams(streams)):
+                count += 1
+                market_counts[trade['market']] += 1
+                yield trade
+            account_stats[account_name] = {
+                'count': count,
+                'success': account_info['status'] not in ('checking', 'invalid'),
+                'exchange': account_info['exchange'],
+                'status': account_info['status'],
+                'markets': market_counts,
+                'unsupported_markets': unsupported
+            }
         except Exception as e:
-            return False, f"Bybit 账户连接错误: {str(e)}"
+            account_stats[account_name] = {
+                'count': count,
+                'success': False,
+                'error': str(e),
+                'exchange': account_info['exchange'],
+                'markets': market_counts,
+                'unsupported_markets': unsupported
+            }
     
-    def get_trades_from_all_accounts(self, symbol, start_date, end_date, exchange_filter=None):
-        """从所有账户获取交易记录"""
-        all_trades = []
-        account_stats = {}
-        
-        for account_name, account_info in self.accounts.items():
+    def iter_trades_from_all_accounts(self, symbol, start_date, end_date, exchange_filter=None, account_stats=None,
+                                      markets=DEFAULT_MARKETS):
+        """所有账户、所有市场的成交按时间归并后的惰性流；各账户的各个市场在后台并发获取，
+        account_stats 在每个账户的流结束时填充"""
+        account_stats = {} if account_stats is None else account_stats
+        streams = []
+        for account_name, account_info in list(self.accounts.items()):
             # 如果指定了交易所过滤器，只查询指定交易所的账户
             if exchange_filter and account_info['exchange'] != exchange_filter:
                 continue
-                
-            try:
-                exporter = account_info['exporter']
-                trades = exporter.get_all_trades_in_period(symbol, start_date, end_date)
-                
-                # 为每条交易添加账户信息和交易所信息
-                for trade in trades:
-                    trade['account_name'] = account_name
-                    trade['exchange'] = account_info['exchange']
-                
-                all_trades.extend(trades)
-                account_stats[account_name] = {
-                    'count': len(trades),
-                    'success': True,
-                    'exchange': account_info['exchange']
-                }
-                
-            except Exception as e:
-                account_stats[account_name] = {
-                    'count': 0,
-                    'success': False,
-                    'error': str(e),
-                    'exchange': account_info['exchange']
-                }
-        
-        # 按时间排序
-        all_trades.sort(key=lambda x: int(x['time']))
+            streams.append(self._account_stream(account_name, account_info, symbol, start_date, end_date,
+                                                account_stats, markets))
+        return merge_trade_streams(streams)
+    
+    def get_trades_from_all_accounts(self, symbol, start_date, end_date, exchange_filter=None,
+                                     markets=DEFAULT_MARKETS):
+        """从所有账户的指定市场获取交易记录（按时间排序）"""
+        account_stats = {}
+        with tracing.span('merge') as merge_span:
+            all_trades = list(self.iter_trades_from_all_accounts(symbol, start_date, end_date,
+                                                                 exchange_filter, account_stats, markets))
+            merge_span.set(rows=len(all_trades))
+        
+        # 增量更新每日持仓/盈亏快照，失败不影响本次查询
+        if SNAPSHOTS_ENABLED and all_trades:
+            with tracing.span('materialize', rows=len(all_trades)) as materialize_span:
+                try:
+                    account_keys = {name: info['fingerprint'] for name, info in self.accounts.items()}
+                    materialize_span.set(new=get_snapshot_store().update(all_trades, account_keys))
+                except Exception as e:
+                    tracing.log(f"⚠️ 更新每日快照失败: {e}")
         
         return all_trades, account_stats
     
-    def analyze_trades(self, selected_trades):
-        """分析选中的交易"""
-        if not selected_trades:
+    def analyze_trades(self, selected_trades, cost_method=FIFO, normalize_fees=False):
+        """分析选中的交易，cost_method 为已实现盈亏的成本计算方法 (fifo/lifo/average)，
+        normalize_fees 为 True 时按历史 K 线把手续费折算为计价货币
+        
+        selected_trades 可以是列表，也可以是按时间排序的成交生成器（如 iter_trades），
+        后者只遍历一遍，不在内存中保留成交"""
+        fee_summary = None
+        if normalize_fees:
+            # 折算需要先收集全部成交以批量获取 K 线
+            selected_trades = list(selected_trades)
+            if not selected_trades:
+                return None
+            with tracing.span('fee_normalization', rows=len(selected_trades)) as fee_span:
+                from fee_normalization import FeeNormalizer  # 只在折算手续费时加载
+                normalizer = FeeNormalizer()
+                fee_summary = normalizer.normalize(selected_trades)
+                fee_span.set(requests=normalizer.requests_made)
+        
+        with tracing.span('analysis') as analysis_span:
+            analysis = self._analyze_trades(selected_trades, cost_method)
+            analysis_span.set(rows=analysis['total_count'] if analysis else 0)
+        if analysis is None:
             return None
+        if fee_summary is not None:
+            analysis['total_commission_quote'] = fee_summary['by_quote']
+            analysis['unconverted_commission'] = fee_summary['unconverted']
+        return analysis
+    
+    def _analyze_trades(self, selected_trades, cost_method=FIFO):
+        """一次遍历完成买卖统计、手续费汇总和逐笔持仓匹配，没有成交时返回 None"""
+        if isinstance(selected_trades, list):
+            selected_trades = sorted(selected_trades, key=trade_time)
         
-        buy_trades = [t for t in selected_trades if t['isBuyer']]
-        sell_trades = [t for t in selected_trades if not t['isBuyer']]
-        
-        # 统计涉及的交易所
-        exchanges = list(set(t.get('exchange', 'unknown') for t in selected_trades))
-        
-        analysis = {
-            'total_count': len(selected_trades),
-            'buy_count': len(buy_trades),
-            'sell_count': len(sell_trades),
-            'accounts': list(set(t['account_name'] for t in selected_trades)),
-            'exchanges': exchanges
-        }
-        
-        # 买入分析
-        if buy_trades:
-            total_buy_qty = sum(float(t['qty']) for t in buy_trades)
-            weighted_buy_price = sum(float(t['price']) * float(t['qty']) for t in buy_trades) / total_buy_qty
-            total_buy_amount = sum(float(t['quoteQty']) for t in buy_trades)
-            
-            buy_commission_by_asset = {}
-            for trade in buy_trades:
-                asset = trade['commissionAsset']
-                commission = float(trade['commission'])
-                buy_commission_by_asset[asset] = buy_commission_by_asset.get(asset, 0) + commission
-            
-            analysis['buy_stats'] = {
-                'avg_price': weighted_buy_price,
-                'total_qty': total_buy_qty,
-                'total_amount': total_buy_amount,
-                'commission_by_asset': buy_commission_by_asset
-            }
-        
-        # 卖出分析
-        if sell_trades:
-            total_sell_qty = sum(float(t['qty']) for t in sell_trades)
-            weighted_sell_price = sum(float(t['price']) * float(t['qty']) for t in sell_trades) / total_sell_qty
-            total_sell_amount = sum(float(t['quoteQty']) for t in sell_trades)
-            
-            sell_commission_by_asset = {}
-            for trade in sell_trades:
-                asset = trade['commissionAsset']
-                commission = float(trade['commission'])
-                sell_commission_by_asset[asset] = sell_commission_by_asset.get(asset, 0) + commission
-            
-            analysis['sell_stats'] = {
-                'avg_price': weighted_sell_price,
-                'total_qty': total_sell_qty,
-                'total_amount': total_sell_amount,
-                'commission_by_asset': sell_commission_by_asset
-            }
-        
-        # 总手续费统计
+        matcher = LotMatcher(cost_method)
+        sides = {True: [0, 0.0, 0.0, 0.0, {}], False: [0, 0.0, 0.0, 0.0, {}]}  # 笔数, 数量, 价格*数量, 金额, 手续费
         total_commission_by_asset = {}
+        accounts = set()
+        exchanges = set()
+        
         for trade in selected_trades:
+            side = sides[bool(trade['isBuyer'])]
+            qty = float(trade['qty'])
+            side[0] += 1
+            side[1] += qty
+            side[2] += float(trade['price']) * qty
+            side[3] += float(trade['quoteQty'])
             asset = trade['commissionAsset']
             commission = float(trade['commission'])
+            side[4][asset] = side[4].get(asset, 0) + commission
             total_commission_by_asset[asset] = total_commission_by_asset.get(asset, 0) + commission
+            accounts.add(trade.get('account_name', ''))
+            exchanges.add(trade.get('exchange', 'unknown'))
+            # 逐笔持仓匹配的已实现盈亏（含手续费）
+            matcher.process(trade)
+        
+        buy_count = sides[True][0]
+        sell_count = sides[False][0]
+        if not buy_count and not sell_count:
+            return None
+        
+        analysis = {
+            'total_count': buy_count + sell_count,
+            'buy_count': buy_count,
+            'sell_count': sell_count,
+            'accounts': list(accounts),
+            'exchanges': list(exchanges)
+        }
+        
+        # 买入 / 卖出分析
+        for is_buyer, key in ((True, 'buy_stats'), (False, 'sell_stats')):
+            count, total_qty, weighted_sum, total_amount, commission_by_asset = sides[is_buyer]
+            if count:
+                analysis[key] = {
+                    'avg_price': weighted_sum / total_qty,
+                    'total_qty': total_qty,
+                    'total_amount': total_amount,
+                    'commission_by_asset': commission_by_asset
+                }
         
         analysis['total_commission_by_asset'] = total_commission_by_asset
         
         # 盈亏分析
-        if buy_trades and sell_trades:
-            min_qty = min(sum(float(t['qty']) for t in buy_trades), 
-                         sum(float(t['qty']) for t in sell_trades))
+        if buy_count and sell_count:
+            min_qty = min(analysis['buy_stats']['total_qty'], analysis['sell_stats']['total_qty'])
             profit_per_unit = analysis['sell_stats']['avg_price'] - analysis['buy_stats']['avg_price']
             total_profit = profit_per_unit * min_qty
             profit_percentage = (profit_per_unit / analysis['buy_stats']['avg_price']) * 100
@@ -192,10 +402,128 @@ class MultiExchangeTradeAnalyzer:
                 'min_qty': min_qty
             }
         
+        analysis['realized_pnl'] = matcher.summary()
         return analysis
 
-# 全局分析器实例
-analyzer = MultiExchangeTradeAnalyzer()
+def format_trades_for_display(trades):
+    """格式化交易数据用于前端显示"""
+    formatted_trades = []
+    for i, trade in enumerate(trades):
+        formatted_trades.append({
+            'index': i,
+            'id': trade['id'],
+            'account': trade['account_name'],
+            'exchange': trade.get('exchange', 'unknown'),
+            'market': market_label(trade.get('market', 'spot')),
+            'time': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+            'direction': '买入' if trade['isBuyer'] else '卖出',
+            'price': float(trade['price']),
+            'qty': float(trade['qty']),
+            'amount': float(trade['quoteQty']),
+            'commission': float(trade['commission']),
+            'commission_asset': trade['commissionAsset'],
+            'raw_data': trade
+        })
+    return formatted_trades
+
+# 每个浏览器会话一个分析器，空闲或超出上限的会话被清理
+analyzers = AnalyzerRegistry(
+    MultiExchangeTradeAnalyzer,
+    on_evict=lambda reason, count: prometheus_metrics.SESSIONS_EVICTED.inc(count, reason=reason),
+    # 后台同步的导出器与会话共用连接池和限频器，清理会话时不能释放
+    external_clients=scheduler_clients)
+
+def session_id():
+    """当前浏览器会话的 ID（cookie 中只保存这个 ID，账户和结果在共享存储中）"""
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def current_analyzer():
+    """当前浏览器会话的分析器；账户在其他 worker 上变化过时从共享存储重建"""
+    sid = session_id()
+    analyzer = analyzers.get(sid)
+    store = get_shared_store()
+    if analyzer.store_version != store.version(sid):
+        version, configs = store.load_accounts(sid)
+        analyzer.sync_accounts(configs)
+        analyzer.store_version = version
+    store.maybe_purge()
+    return analyzer
+
+def save_accounts(analyzer, configs):
+    """把新添加成功的账户写入共享存储"""
+    if not configs:
+        return
+    version = get_shared_store().save_accounts(session_id(), configs)
+    if version == analyzer.store_version + 1:
+        # 期间没有其他 worker 修改过，本地分析器已是最新
+        analyzer.store_version = version
+
+def remember_trace(trace):
+    """把查询追踪保存到共享存储，任何 worker 都可以通过 /traces/<trace_id> 查看（只能查看本会话的追踪）"""
+    get_shared_store().put_trace(session_id(), trace)
+
+# 需要记录延迟和响应大小的路由
+METRIC_ROUTES = {'/query_trades', '/get_trades_data', '/analyze_trades', '/export_csv'}
+
+@app.before_request
+def start_route_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_route_metrics(response):
+    rule = request.url_rule.rule if request.url_rule else None
+    if rule in METRIC_ROUTES and 'request_started' in g:
+        prometheus_metrics.ROUTE_SECONDS.observe(time.perf_counter() - g.request_started,
+                                                 route=rule, method=request.method, status=response.status_code)
+        if response.content_length is not None:
+            prometheus_metrics.ROUTE_RESPONSE_BYTES.observe(response.content_length, route=rule)
+    return response
+
+@app.route('/traces/<trace_id>')
+def get_trace(trace_id):
+    """查看某次查询的追踪时间线"""
+    sid = session.get('sid')
+    trace = get_shared_store().get_trace(sid, trace_id) if sid else None
+    if trace is None:
+        return jsonify({'success': False, 'message': '没有找到该追踪'}), 404
+    return jsonify({'success': True, 'trace': trace})
+
+@app.route('/snapshots')
+def get_snapshots():
+    """按 (账户, 交易对, 市场, 日期) 查询每日持仓和已实现盈亏快照，只返回本会话中的账户
+    
+    symbol 不区分大小写，也可以写成 BTCUSDT@usdm；market 可以是逗号分隔的多个市场，不指定时返回全部市场"""
+    account_filter = request.args.get('account')
+    raw_symbol = request.args.get('symbol', '').strip()
+    symbol, symbol_market = split_market_symbol(raw_symbol)
+    market_arg = request.args.get('market') or (symbol_market if MARKET_SEPARATOR in raw_symbol else '')
+    try:
+        markets = parse_markets(market_arg) if market_arg else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    # 快照按凭证指纹保存，换回本会话中的账户名
+    names = {}
+    for account_name, account_info in current_analyzer().accounts.items():
+        if not account_filter or account_name == account_filter:
+            names.setdefault(account_info['fingerprint'], account_name)
+    snapshots = get_snapshot_store().query(
+        accounts=list(names),
+        symbol=symbol.upper() or None,
+        exchange=request.args.get('exchange'),
+        start_day=request.args.get('start_date'),
+        end_day=request.args.get('end_date'),
+        markets=markets
+    )
+    for snapshot in snapshots:
+        snapshot['account'] = names[snapshot['account']]
+    return jsonify({'success': True, 'snapshots': snapshots})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标"""
+    return Response(prometheus_metrics.registry.expose(), mimetype=prometheus_metrics.CONTENT_TYPE)
 
 @app.route('/')
 def index():
@@ -212,26 +540,26 @@ def add_account():
         api_key = data.get('api_key')
         secret_key = data.get('secret_key')
         testnet = data.get('testnet', False)
+        defer_validation = data.get('defer_validation', False)
         
         if not account_name or not api_key or not secret_key:
             return jsonify({'success': False, 'message': '请填写完整的账户信息'})
         
-        success = False
-        message = ""
-        
-        if exchange == 'binance':
-            success, message = analyzer.add_binance_account(account_name, api_key, secret_key, testnet)
-        elif exchange == 'okx':
-            passphrase = data.get('passphrase')
-            if not passphrase:
-                return jsonify({'success': False, 'message': 'OKX 账户需要提供 API 密码'})
-            success, message = analyzer.add_okx_account(account_name, api_key, secret_key, passphrase, testnet)
-        elif exchange == 'bybit':
-            success, message = analyzer.add_bybit_account(account_name, api_key, secret_key, testnet)
-        else:
+        plugin = get_plugin(exchange)
+        if plugin is None:
             return jsonify({'success': False, 'message': '不支持的交易所'})
+        if plugin.requires_passphrase and not data.get('passphrase'):
+            return jsonify({'success': False, 'message': f'{plugin.label} 账户需要提供 API 密码'})
+        
+        config = {
+            'account_name': account_name, 'exchange': exchange, 'api_key': api_key,
+            'secret_key': secret_key, 'passphrase': data.get('passphrase'), 'testnet': testnet
+        }
+        analyzer = current_analyzer()
+        success, message = analyzer.add_accounts([config], defer_validation)[account_name]
         
         if success:
+            save_accounts(analyzer, [config])
             # 保存账户列表到session
             if 'accounts' not in session:
                 session['accounts'] = []
@@ -248,7 +576,60 @@ def add_account():
     except Exception as e:
         return jsonify({'success': False, 'message': f'添加账户失败: {str(e)}'})
 
+@app.route('/add_accounts', methods=['POST'])
+def add_accounts():
+    """批量添加账户（并发验证）"""
+    try:
+        data = request.get_json()
+        accounts = data.get('accounts', [])
+        defer_validation = data.get('defer_validation', False)
+        
+        if not accounts:
+            return jsonify({'success': False, 'message': '请提供账户列表'})
+        
+        results = {}
+        valid_configs = []
+        for config in accounts:
+            account_name = config.get('account_name')
+            exchange = config.get('exchange', 'binance')
+            plugin = get_plugin(exchange)
+            if not account_name or not config.get('api_key') or not config.get('secret_key'):
+                results[account_name or ''] = {'success': False, 'message': '请填写完整的账户信息'}
+            elif plugin is None:
+                results[account_name] = {'success': False, 'message': '不支持的交易所'}
+            elif plugin.requires_passphrase and not config.get('passphrase'):
+                results[account_name] = {'success': False, 'message': f'{plugin.label} 账户需要提供 API 密码'}
+            else:
+                valid_configs.append(dict(config, exchange=exchange))
+        
+        analyzer = current_analyzer()
+        for account_name, (success, message) in analyzer.add_accounts(valid_configs, defer_validation).items():
+            results[account_name] = {'success': success, 'message': message}
+        
+        save_accounts(analyzer, [config for config in valid_configs if results[config['account_name']]['success']])
+        if 'accounts' not in session:
+            session['accounts'] = []
+        for config in valid_configs:
+            if results[config['account_name']]['success']:
+                session['accounts'].append({
+                    'name': config['account_name'],
+                    'exchange': config['exchange'],
+                    'testnet': config.get('testnet', False)
+                })
+        session.modified = True
+        
+        success_count = sum(1 for r in results.values() if r['success'])
+        return jsonify({
+            'success': success_count > 0,
+            'message': f'成功添加 {success_count}/{len(accounts)} 个账户',
+            'results': results
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'添加账户失败: {str(e)}'})
+
 @app.route('/query_trades', methods=['POST'])
+@cached_json
 def query_trades():
     """查询交易记录"""
     try:
@@ -260,42 +641,41 @@ def query_trades():
         
         if not start_date or not end_date:
             return jsonify({'success': False, 'message': '请选择查询时间范围'})
+        try:
+            # 可选的市场列表（现货 / 杠杆 / U本位 / 币本位），默认只查现货
+            markets = parse_markets(data.get('markets'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
+        analyzer = current_analyzer()
         if not analyzer.accounts:
             return jsonify({'success': False, 'message': '请先添加至少一个账户'})
         
-        trades, account_stats = analyzer.get_trades_from_all_accounts(symbol, start_date, end_date, exchange_filter)
-        
-        # 格式化交易数据用于前端显示
-        formatted_trades = []
-        for i, trade in enumerate(trades):
-            formatted_trades.append({
-                'index': i,
-                'id': trade['id'],
-                'account': trade['account_name'],
-                'exchange': trade.get('exchange', 'unknown'),
-                'time': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                'direction': '买入' if trade['isBuyer'] else '卖出',
-                'price': float(trade['price']),
-                'qty': float(trade['qty']),
-                'amount': float(trade['quoteQty']),
-                'commission': float(trade['commission']),
-                'commission_asset': trade['commissionAsset'],
-                'raw_data': trade
-            })
+        with tracing.start_trace('query_trades', symbol=symbol, start_date=start_date, end_date=end_date,
+                                 exchange_filter=exchange_filter, markets=','.join(markets)) as trace:
+            trades, account_stats = analyzer.get_trades_from_all_accounts(symbol, start_date, end_date,
+                                                                          exchange_filter, markets)
+            
+            # 格式化交易数据用于前端显示
+            with tracing.span('format', rows=len(trades)):
+                formatted_trades = format_trades_for_display(trades)
+        remember_trace(trace)
         
-        # 将数据保存到session
-        session['trades'] = trades
-        session['symbol'] = symbol
-        session['exchange_filter'] = exchange_filter
-        session.modified = True
+        # 保存到共享存储，任何 worker 都能继续处理后续的分析和导出
+        get_shared_store().put_results(session_id(), trades=trades, symbol=symbol,
+                                       exchange_filter=exchange_filter)
         
-        return jsonify({
+        result = {
             'success': True,
             'trades': formatted_trades,
             'account_stats': account_stats,
-            'total_count': len(trades)
-        })
+            'total_count': len(trades),
+            'markets': list(markets),
+            'trace_id': trace.trace_id
+        }
+        if data.get('trace'):
+            result['trace'] = trace.to_dict()
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'查询失败: {str(e)}'})
@@ -303,72 +683,89 @@ def query_trades():
 @app.route('/trades')
 def trades_page():
     """交易记录页面"""
-    if 'trades' not in session:
+    if not get_shared_store().has_result(session_id(), 'trades'):
         flash('请先查询交易记录', 'error')
         return redirect(url_for('index'))
     
     return render_template('trades.html')
 
 @app.route('/get_trades_data')
+@cached_json
 def get_trades_data():
-    """获取当前session中的交易数据"""
-    if 'trades' not in session:
-        return jsonify({'success': False, 'message': '没有找到交易数据'})
+    """获取当前会话的交易数据；内容未变时按存储的摘要直接返回 304"""
+    store = get_shared_store()
+    etag = store.result_digest(session_id(), 'trades', 'symbol')
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
     
-    all_trades = session['trades']
+    all_trades = store.get_result(session_id(), 'trades')
+    if all_trades is None:
+        return jsonify({'success': False, 'message': '没有找到交易数据'})
     
     # 格式化交易数据用于前端显示
-    formatted_trades = []
-    for i, trade in enumerate(all_trades):
-        formatted_trades.append({
-            'index': i,
-            'id': trade['id'],
-            'account': trade['account_name'],
-            'exchange': trade.get('exchange', 'unknown'),
-            'time': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-            'direction': '买入' if trade['isBuyer'] else '卖出',
-            'price': float(trade['price']),
-            'qty': float(trade['qty']),
-            'amount': float(trade['quoteQty']),
-            'commission': float(trade['commission']),
-            'commission_asset': trade['commissionAsset'],
-            'raw_data': trade
-        })
+    formatted_trades = format_trades_for_display(all_trades)
     
-    return jsonify({
+    response = jsonify({
         'success': True,
         'trades': formatted_trades,
-        'symbol': session.get('symbol', 'UNKNOWN'),
+        'symbol': store.get_result(session_id(), 'symbol', 'UNKNOWN'),
         'total_count': len(formatted_trades)
     })
+    response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/analyze_trades', methods=['POST'])
+@cached_json
 def analyze_trades():
-    """分析选中的交易"""
+    """分析选中的交易
+    
+    selection 为选择表达式（见 trade_selection.py），在服务端按列索引求值；
+    仍兼容旧的 selected_indices 下标列表"""
     try:
         data = request.get_json()
-        selected_indices = data.get('selected_indices', [])
-        
-        if not selected_indices:
-            return jsonify({'success': False, 'message': '请选择要分析的交易'})
-        
-        if 'trades' not in session:
+        selection = data.get('selection')
+        if selection is None:
+            selected_indices = data.get('selected_indices', [])
+            if not selected_indices:
+                return jsonify({'success': False, 'message': '请选择要分析的交易'})
+            selection = {'index': selected_indices}
+        
+        cost_method = data.get('cost_method', FIFO)
+        if cost_method not in COST_METHODS:
+            return jsonify({'success': False, 'message': f'不支持的成本计算方法: {cost_method}'})
+        
+        store = get_shared_store()
+        sid = session_id()
+        digest = store.result_digest(sid, 'trades')
+        all_trades, trade_index = (None, None) if digest is None else get_trade_index(
+            digest, lambda: store.get_result(sid, 'trades'))
+        if all_trades is None:
             return jsonify({'success': False, 'message': '没有找到交易数据'})
         
-        all_trades = session['trades']
-        selected_trades = [all_trades[i] for i in selected_indices if i < len(all_trades)]
+        try:
+            selected = trade_index.select(selection)
+        except SelectionError as e:
+            return jsonify({'success': False, 'message': f'选择条件无效: {e}'})
+        if not selected:
+            return jsonify({'success': False, 'message': '没有符合选择条件的交易'})
         
-        if not selected_trades:
-            return jsonify({'success': False, 'message': '选中的交易无效'})
+        normalize_fees = bool(data.get('normalize_fees'))
+        # 索引缓存中的成交被多次分析共用，折算手续费会写入字段，需要先复制
+        selected_trades = [dict(all_trades[i]) if normalize_fees else all_trades[i] for i in selected]
         
-        analysis = analyzer.analyze_trades(selected_trades)
+        with tracing.start_trace('analyze_trades', selected=len(selected_trades)) as trace:
+            analysis = current_analyzer().analyze_trades(selected_trades, cost_method,
+                                                         normalize_fees=normalize_fees)
+        remember_trace(trace)
         
-        # 保存分析结果到session
-        session['analysis'] = analysis
-        session['selected_trades'] = selected_trades
-        session.modified = True
+        # 保存分析结果，供导出使用
+        get_shared_store().put_results(session_id(), analysis=analysis, selected_trades=selected_trades)
         
-        return jsonify({'success': True, 'analysis': analysis})
+        result = {'success': True, 'analysis': analysis, 'trace_id': trace.trace_id}
+        if data.get('trace'):
+            result['trace'] = trace.to_dict()
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'分析失败: {str(e)}'})
@@ -377,13 +774,13 @@ def analyze_trades():
 def export_csv():
     """导出分析报告为CSV"""
     try:
-        if 'analysis' not in session or 'selected_trades' not in session:
+        store = get_shared_store()
+        analysis = store.get_result(session_id(), 'analysis')
+        selected_trades = store.get_result(session_id(), 'selected_trades')
+        if analysis is None or selected_trades is None:
             flash('没有找到分析数据', 'error')
             return redirect(url_for('index'))
-        
-        analysis = session['analysis']
-        selected_trades = session['selected_trades']
-        symbol = session.get('symbol', 'UNKNOWN')
+        symbol = store.get_result(session_id(), 'symbol', 'UNKNOWN')
         
         # 创建临时文件
         temp_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', encoding='utf-8-sig')
@@ -439,10 +836,28 @@ def export_csv():
             writer.writerow(['最小交易量:', f"{profit_stats['min_qty']:.6f}"])
             writer.writerow([''])
         
+        # 已实现盈亏（逐笔持仓匹配）
+        if 'realized_pnl' in analysis:
+            pnl = analysis['realized_pnl']
+            writer.writerow([f"=== 已实现盈亏 ({pnl['method'].upper()}) ==="])
+            writer.writerow(['账户', '交易所', '交易对', '已实现盈亏', '手续费', '剩余持仓', '持仓均价'])
+            for position in pnl['positions']:
+                writer.writerow([position['account'], position['exchange'], position['symbol'],
+                                 f"{position['realized_pnl']:.2f}", f"{position['fees']:.8f}",
+                                 f"{position['open_qty']:.8f}", f"{position['avg_cost']:.6f}"])
+            writer.writerow(['合计:', f"{pnl['realized_pnl']:.2f}"])
+            for asset, amount in pnl['unconverted_fees'].items():
+                writer.writerow(['未折算手续费:', f"{amount:.8f} {asset}"])
+            writer.writerow([''])
+        
         # 总手续费统计
         writer.writerow(['=== 总手续费统计 ==='])
         for asset, commission in analysis['total_commission_by_asset'].items():
             writer.writerow([f'总手续费 ({asset}):', f"{commission:.8f}"])
+        for quote, commission in analysis.get('total_commission_quote', {}).items():
+            writer.writerow([f'折算手续费 ({quote}):', f"{commission:.8f}"])
+        for asset, commission in analysis.get('unconverted_commission', {}).items():
+            writer.writerow([f'未能折算 ({asset}):', f"{commission:.8f}"])
         writer.writerow([''])
         
         # 详细交易记录
@@ -478,16 +893,65 @@ def export_csv():
         flash(f'导出失败: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/sync_targets', methods=['GET', 'POST', 'DELETE'])
+def sync_targets():
+    """查看 / 添加 / 删除当前会话的后台同步目标 {'account_name', 'symbol', 'days', 'markets'}"""
+    store = get_shared_store()
+    sid = session_id()
+    if request.method == 'GET':
+        targets = [{key: target[key] for key in ('account_name', 'symbol', 'days', 'markets')}
+                   for target in store.sync_targets(sid)]
+        return jsonify({'success': True, 'targets': targets})
+    
+    data = request.get_json() or {}
+    account_name = data.get('account_name')
+    symbol = (data.get('symbol') or '').upper()
+    if not account_name or not symbol:
+        return jsonify({'success': False, 'message': '请提供账户名和交易对'})
+    if request.method == 'DELETE':
+        store.remove_sync_target(sid, account_name, symbol)
+        return jsonify({'success': True, 'message': f'已停止同步 {account_name} {symbol}'})
+    
+    account_info = current_analyzer().accounts.get(account_name)
+    if account_info is None:
+        return jsonify({'success': False, 'message': f'账户 {account_name} 不存在'})
+    try:
+        days = int(data.get('days', 7))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': '天数必须是整数'})
+    if not 1 <= days <= MAX_SYNC_DAYS:
+        return jsonify({'success': False, 'message': f'天数必须在 1 到 {MAX_SYNC_DAYS} 之间'})
+    try:
+        markets = parse_markets(data.get('markets'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    unsupported = [market for market in markets if market not in account_info['exporter'].markets]
+    if unsupported:
+        return jsonify({'success': False, 'message': f"{exchange_label(account_info['exchange'])} 不支持所选市场: "
+                                                     f"{', '.join(market_label(market) for market in unsupported)}"})
+    store.set_sync_target(sid, account_name, symbol, days, markets)
+    return jsonify({'success': True, 'message': f'将在后台同步 {account_name} 最近 {days} 天的 {symbol} 成交'})
+
+def start_background_sync():
+    """启动后台同步线程（wsgi.py / run.py 调用，导入 app 时不启动）"""
+    return start_sync_scheduler(get_shared_store(), get_trade_cache(), lambda config: (
+        create_exporter(config['exchange'], config['api_key'], config['secret_key'],
+                        config.get('passphrase'), config.get('testnet', False), api_host=API_HOST)))
+
 @app.route('/clear_accounts', methods=['POST'])
 def clear_accounts():
-    """清除所有账户"""
-    analyzer.accounts.clear()
+    """清除当前会话的所有账户"""
+    if 'sid' in session:
+        get_shared_store().clear_session(session['sid'])
+        analyzers.remove(session['sid'])
     session.pop('accounts', None)
-    session.pop('trades', None)
-    session.pop('analysis', None)
-    session.pop('selected_trades', None)
     session.modified = True
     return jsonify({'success': True, 'message': '已清除所有账户'})
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    # 开发服务器；生产环境请使用 wsgi.py（gunicorn 多进程）
+    debug = os.environ.get('TRADE_DEBUG', '1') == '1'
+    # 调试模式下 reloader 的父进程只负责监视文件，后台同步只在实际处理请求的子进程中启动
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_sync()
+    app.run(debug=debug, host='0.0.0.0', port=5000) 
\ No newline at end of file
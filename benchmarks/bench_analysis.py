@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+分析与格式化微基准测试 - 在 1万 / 10万 / 100万 条合成成交上测量各阶段耗时和峰值内存
+覆盖 analyze_trades、calculate_average_prices、generate_analysis_report、
+逐笔持仓匹配 (realized_pnl)、路由格式化 (format_trades_for_display) 和 export_to_csv
+
+用法:
+    python -m benchmarks.bench_analysis
+    python -m benchmarks.bench_analysis --sizes 10000,100000 --output results.json --label v1.2
+    python -m benchmarks.bench_analysis --sizes 10000,100000 --baseline results.json
+"""
+
+import argparse
+import builtins
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('TRADE_CACHE_DIR', tempfile.mkdtemp(prefix='bench_cache_'))
+
+import app as web_app  # noqa: E402
+import binance_exporter  # noqa: E402
+import lot_matching  # noqa: E402
+
+EXCHANGE_COMMISSION_ASSETS = {
+    'binance': ['BNB', 'USDT', 'BTC'],
+    'okx': ['OKB', 'USDT', 'BTC'],
+    'bybit': ['USDT', 'BTC'],
+}
+
+
+def generate_trades(count, accounts=5, symbol='BTCUSDT', seed=42):
+    """生成 Binance 兼容格式的合成成交（多账户、多交易所、多种手续费资产）"""
+    rng = random.Random(seed)
+    exchanges = list(EXCHANGE_COMMISSION_ASSETS)
+    account_names = [f"account_{i}" for i in range(accounts)]
+    start_ms = int(datetime(2024, 1, 1).timestamp() * 1000)
+    step_ms = max(1, 365 * 24 * 3600 * 1000 // max(count, 1))
+
+    trades = []
+    price = 40000.0
+    for i in range(count):
+        account = account_names[i % accounts]
+        exchange = exchanges[i % accounts % len(exchanges)]
+        price = max(1.0, price * (1 + rng.gauss(0, 0.001)))
+        qty = round(rng.uniform(0.0001, 0.5), 6)
+        trades.append({
+            'id': i,
+            'orderId': i // 3,
+            'symbol': symbol,
+            'time': start_ms + i * step_ms,
+            'isBuyer': rng.random() < 0.5,
+            'isMaker': rng.random() < 0.3,
+            'price': f"{price:.2f}",
+            'qty': f"{qty:.6f}",
+            'quoteQty': f"{price * qty:.8f}",
+            'commission': f"{qty * 0.001:.8f}",
+            'commissionAsset': rng.choice(EXCHANGE_COMMISSION_ASSETS[exchange]),
+            'account_name': account,
+            'exchange': exchange
+        })
+    return trades
+
+
+def _report_stats(analysis, side):
+    """把 analyze_trades 的结果转换为 generate_analysis_report 需要的格式"""
+    stats = analysis.get(f'{side}_stats')
+    if not stats:
+        return None
+    return dict(stats, count=analysis[f'{side}_count'])
+
+
+def build_stages(trades, workdir):
+    """返回 [(阶段名, 无参函数)]"""
+    analyzer = web_app.MultiExchangeTradeAnalyzer()
+    exporter = binance_exporter.BinanceTradeExporter('bench-key', 'bench-secret')
+    analysis = analyzer.analyze_trades(trades)
+
+    def calculate_average_prices():
+        # 跳过交互式的"是否生成报告"询问
+        original_input = builtins.input
+        builtins.input = lambda prompt='': 'n'
+        try:
+            binance_exporter.calculate_average_prices(trades)
+        finally:
+            builtins.input = original_input
+
+    def generate_analysis_report():
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            binance_exporter.generate_analysis_report(
+                trades, _report_stats(analysis, 'buy'), _report_stats(analysis, 'sell'),
+                analysis.get('profit_stats'))
+        finally:
+            os.chdir(cwd)
+
+    return [
+        ('analyze_trades', lambda: analyzer.analyze_trades(trades)),
+        ('calculate_average_prices', calculate_average_prices),
+        ('generate_analysis_report', generate_analysis_report),
+        ('realized_pnl_fifo', lambda: lot_matching.realized_pnl(trades, lot_matching.FIFO)),
+        ('format_trades_for_display', lambda: web_app.format_trades_for_display(trades)),
+        ('export_to_csv', lambda: exporter.export_to_csv(trades, os.path.join(workdir, 'trades.csv'))),
+    ]
+
+
+def measure(func, repeat, track_memory):
+    """返回 (最短耗时, 峰值内存增量字节)"""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        timings.append(time.perf_counter() - started)
+
+    peak = None
+    if track_memory:
+        gc.collect()
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return min(timings), peak
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results, baseline_file, tolerance):
+    """与历史结果对比，返回耗时或峰值内存出现回退的用例"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['stage'], r['size']): r for r in baseline.get('results', [])}
+
+    regressions = []
+    for result in results:
+        old = previous.get((result['stage'], result['size']))
+        if not old or not old['seconds']:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        memory_grew = (result['peak_memory_bytes'] and old['peak_memory_bytes']
+                       and result['peak_memory_bytes'] > old['peak_memory_bytes'] * (1 + tolerance))
+        if ratio > 1 + tolerance or memory_grew:
+            regressions.append((result, old, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='分析与格式化微基准测试')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='成交条数，逗号分隔')
+    parser.add_argument('--accounts', type=int, default=5, help='合成数据的账户数')
+    parser.add_argument('--repeat', type=int, default=1, help='每个阶段重复次数（取最短耗时）')
+    parser.add_argument('--no-memory', action='store_true', help='不统计峰值内存（更快）')
+    parser.add_argument('--stages', help='只运行指定阶段，逗号分隔')
+    parser.add_argument('--label', help='结果标签，例如版本号')
+    parser.add_argument('--output', help='结果保存为 JSON 文件')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的耗时/内存增长比例')
+    args = parser.parse_args(argv)
+
+    selected = set(args.stages.split(',')) if args.stages else None
+    results = []
+
+    print(f"{'阶段':<26} {'条数':>9} {'耗时(s)':>10} {'条/秒':>12} {'峰值内存(MB)':>14}")
+    print('-' * 78)
+    with tempfile.TemporaryDirectory(prefix='bench_analysis_') as workdir:
+        for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            trades = generate_trades(size, accounts=args.accounts)
+            for stage, func in build_stages(trades, workdir):
+                if selected and stage not in selected:
+                    continue
+                seconds, peak = measure(func, args.repeat, not args.no_memory)
+                results.append({
+                    'stage': stage,
+                    'size': size,
+                    'seconds': round(seconds, 6),
+                    'rows_per_second': round(size / seconds, 1) if seconds else None,
+                    'peak_memory_bytes': peak
+                })
+                peak_text = f"{peak / 1024 / 1024:.1f}" if peak is not None else '-'
+                print(f"{stage:<28} {size:>9} {seconds:>10.3f} {size / seconds:>12.0f} {peak_text:>14}")
+            del trades
+            gc.collect()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'label': args.label,
+                'revision': git_revision(),
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'results': results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ 结果已保存到: {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 个性能回退:")
+            for result, old, ratio in regressions:
+                old_mb = (old['peak_memory_bytes'] or 0) / 1024 / 1024
+                new_mb = (result['peak_memory_bytes'] or 0) / 1024 / 1024
+                print(f"   {result['stage']} x {result['size']}: {old['seconds']:.3f}s -> {result['seconds']:.3f}s "
+                      f"({ratio:.2f}x), 峰值内存 {old_mb:.1f} -> {new_mb:.1f} MB")
+            return 1
+        print("\n✅ 未发现性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
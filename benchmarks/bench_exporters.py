@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+导出器吞吐量基准测试 - 在本地模拟交易所上测量 get_all_trades_in_period
+无需真实 API 密钥，输出每个交易所在不同时间跨度和成交密度下的
+请求数、耗时和每秒成交数，并可与历史结果对比以发现性能回退
+
+用法:
+    python -m benchmarks.bench_exporters
+    python -m benchmarks.bench_exporters --days 1,7,30 --density 10,1000 --latency 0.02
+    python -m benchmarks.bench_exporters --output bench.json --baseline last_bench.json
+    python -m benchmarks.bench_exporters --markets spot,margin,usdm,coinm   # 多个市场并发获取
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 元数据缓存写到临时目录，避免污染用户缓存
+os.environ.setdefault('TRADE_CACHE_DIR', tempfile.mkdtemp(prefix='bench_cache_'))
+
+from benchmarks.mock_exchange import MockExchangeConfig, MockExchangeServer, expected_fill_count  # noqa: E402
+from binance_exporter import BinanceTradeExporter  # noqa: E402
+from bybit_exporter import BybitTradeExporter  # noqa: E402
+from markets import parse_markets  # noqa: E402
+from okx_exporter import OKXTradeExporter  # noqa: E402
+
+EXCHANGES = {
+    'binance': lambda host: BinanceTradeExporter('bench-key', 'bench-secret', api_host=host),
+    'okx': lambda host: OKXTradeExporter('bench-key', 'bench-secret', 'bench-pass', api_host=host),
+    'bybit': lambda host: BybitTradeExporter('bench-key', 'bench-secret', api_host=host),
+}
+
+
+def _parse_list(value, cast):
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+
+def run_case(exchange, days, density, args):
+    """在一个全新的模拟交易所上跑一次 get_all_trades_in_period"""
+    config = MockExchangeConfig(
+        latency=args.latency,
+        fills_per_day=density,
+        page_limit=args.page_limit,
+        rate_limit=args.rate_limit,
+        error_rate_429=args.inject_429,
+        seed=args.seed
+    )
+    end_date = datetime.now().date() - timedelta(days=1)
+    start_date = end_date - timedelta(days=days - 1)
+    start_ms = int(datetime.combine(start_date, datetime.min.time()).timestamp() * 1000)
+    end_ms = int(datetime.combine(end_date + timedelta(days=1), datetime.min.time()).timestamp() * 1000) - 1
+
+    with MockExchangeServer(config) as server:
+        exporter = EXCHANGES[exchange](server.url)
+        markets = [market for market in args.markets if market in exporter.markets]
+        output = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(output if not args.verbose else sys.stdout):
+            # 单个市场沿用原来的逐天获取，多个市场并发获取后归并
+            trades = exporter.get_all_trades_in_period(
+                'BTCUSDT', start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'),
+                markets[0] if len(markets) == 1 else markets)
+        wall = time.perf_counter() - started
+        requests_made = server.request_count(exchange)
+        throttled = server.throttled_count(exchange)
+
+    expected = expected_fill_count(start_ms, end_ms, density) * len(markets)
+    return {
+        'exchange': exchange,
+        'markets': ','.join(markets),
+        'days': days,
+        'density': density,
+        'requests': requests_made,
+        'throttled': throttled,
+        'wall_seconds': round(wall, 4),
+        'trades': len(trades),
+        'expected_trades': expected,
+        'missing_trades': expected - len(trades),
+        'trades_per_second': round(len(trades) / wall, 2) if wall > 0 else 0.0,
+    }
+
+
+def compare_with_baseline(results, baseline_file, tolerance):
+    """与历史结果对比，返回出现回退的用例"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    def case(r):
+        return r['exchange'], r.get('markets', 'spot'), r['days'], r['density']
+
+    previous = {case(r): r for r in baseline.get('results', [])}
+
+    regressions = []
+    for result in results:
+        old = previous.get(case(result))
+        if not old or not old['trades_per_second']:
+            continue
+        ratio = result['trades_per_second'] / old['trades_per_second']
+        if ratio < 1 - tolerance or result['missing_trades'] > old['missing_trades']:
+            regressions.append((result, old, ratio))
+    return regressions
+
+
+def print_table(results):
+    header = f"{'交易所':<8} {'天数':>5} {'每日成交':>8} {'请求数':>7} {'429':>5} {'耗时(s)':>9} {'成交数':>8} {'缺失':>7} {'成交/秒':>10}"
+    print(header)
+    print('-' * 96)
+    for r in results:
+        print(f"{r['exchange']:<10} {r['days']:>6} {r['density']:>10} {r['requests']:>9} {r['throttled']:>5} "
+              f"{r['wall_seconds']:>10.3f} {r['trades']:>10} {r['missing_trades']:>8} {r['trades_per_second']:>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='导出器吞吐量基准测试（本地模拟交易所）')
+    parser.add_argument('--exchanges', default='binance,okx,bybit', help='要测试的交易所，逗号分隔')
+    parser.add_argument('--days', default='1,7,30', help='时间跨度（天），逗号分隔')
+    parser.add_argument('--density', default='10,500', help='每天成交数，逗号分隔')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟网络延迟（秒）')
+    parser.add_argument('--page-limit', type=int, default=None, help='单页返回条数上限')
+    parser.add_argument('--rate-limit', type=int, default=None, help='模拟交易所每秒允许的请求数')
+    parser.add_argument('--inject-429', type=float, default=0.0, help='随机返回 429 的概率 (0-1)')
+    parser.add_argument('--markets', type=parse_markets, default=parse_markets('spot'),
+                        help='获取的市场，逗号分隔: spot,margin,usdm,coinm（交易所不支持的市场跳过）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='结果保存为 JSON 文件')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的吞吐量下降比例')
+    parser.add_argument('--verbose', action='store_true', help='显示导出器的输出')
+    args = parser.parse_args(argv)
+
+    results = []
+    for exchange in _parse_list(args.exchanges, str):
+        for days in _parse_list(args.days, int):
+            for density in _parse_list(args.density, int):
+                results.append(run_case(exchange, days, density, args))
+
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+                'results': results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ 结果已保存到: {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 个性能回退:")
+            for result, old, ratio in regressions:
+                print(f"   {result['exchange']} {result['days']}天 x {result['density']}/天: "
+                      f"{old['trades_per_second']:.1f} -> {result['trades_per_second']:.1f} 成交/秒 ({ratio:.0%}), "
+                      f"缺失 {old['missing_trades']} -> {result['missing_trades']}")
+            return 1
+        print("\n✅ 未发现性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
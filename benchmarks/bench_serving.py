@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+服务吞吐量基准测试 - 用 gunicorn 启动网站（wsgi.py），交易所请求全部发往本地模拟交易所，
+多个客户端会话并发调用 /query_trades，输出每种 worker / 线程配置下的请求数/秒和延迟分位数
+
+每个客户端是一个独立的浏览器会话：先批量添加账户（不验证），然后循环查询。
+请求由 gunicorn 分配到任意 worker，账户从共享存储重建，因此也能验证多进程下的会话一致性
+
+用法:
+    python -m benchmarks.bench_serving
+    python -m benchmarks.bench_serving --workers 1,2,4 --threads 8 --clients 16 --requests 20
+    python -m benchmarks.bench_serving --output serving.json --baseline last_serving.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_exchange import MockExchangeConfig, MockExchangeServer  # noqa: E402
+
+EXCHANGES = ['binance', 'okx', 'bybit']
+
+
+def _parse_list(value, cast):
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def start_server(workers, threads, api_host, cache_dir):
+    """启动 gunicorn，返回 (进程, 地址)；等待端口可用"""
+    port = _free_port()
+    env = dict(os.environ,
+               TRADE_BIND=f'127.0.0.1:{port}',
+               TRADE_WORKERS=str(workers),
+               TRADE_THREADS=str(threads),
+               TRADE_API_HOST=api_host,
+               TRADE_CACHE_DIR=cache_dir,
+               TRADE_ACCESS_LOG='',
+               TRADE_SNAPSHOTS='0',
+               TRADE_SECRET_KEY='bench-secret')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn 启动失败')
+        try:
+            requests.get(url + '/', timeout=5)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn 启动超时')
+
+
+def run_client(url, client_id, args, query):
+    """一个浏览器会话：添加账户后循环查询，返回 (延迟列表, 失败数)"""
+    http = requests.Session()
+    accounts = [{'account_name': f'c{client_id}_{i}', 'exchange': EXCHANGES[i % len(EXCHANGES)],
+                 'api_key': f'key-{client_id}-{i}', 'secret_key': 'bench-secret', 'passphrase': 'bench-pass'}
+                for i in range(args.accounts)]
+    response = http.post(url + '/add_accounts', json={'accounts': accounts, 'defer_validation': True}, timeout=60)
+    if not response.json().get('success'):
+        return [], args.requests
+
+    latencies = []
+    failures = 0
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        try:
+            response = http.post(url + '/query_trades', json=query, timeout=120)
+            body = response.json()
+            ok = body.get('success') and body.get('total_count') == args.density * args.days * args.accounts
+        except (requests.RequestException, ValueError):
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        failures += not ok
+    return latencies, failures
+
+
+def run_case(workers, threads, args):
+    """在一个 gunicorn 配置下跑一轮并发查询"""
+    end_date = datetime.now().date() - timedelta(days=1)
+    start_date = end_date - timedelta(days=args.days - 1)
+    query = {'symbol': 'BTCUSDT', 'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()}
+    config = MockExchangeConfig(latency=args.latency, fills_per_day=args.density, seed=args.seed)
+
+    with MockExchangeServer(config) as exchange, tempfile.TemporaryDirectory(prefix='bench_serving_') as cache_dir:
+        process, url = start_server(workers, threads, exchange.url, cache_dir)
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                outcomes = list(pool.map(lambda i: run_client(url, i, args, query), range(args.clients)))
+            wall = time.perf_counter() - started
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    latencies = [latency for client_latencies, _ in outcomes for latency in client_latencies]
+    return {
+        'workers': workers,
+        'threads': threads,
+        'clients': args.clients,
+        'requests': len(latencies),
+        'failures': sum(failures for _, failures in outcomes),
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+    }
+
+
+def compare_with_baseline(results, baseline_file, tolerance):
+    """与历史结果对比，返回出现回退的配置"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['workers'], r['threads'], r['clients']): r for r in baseline.get('results', [])}
+
+    regressions = []
+    for result in results:
+        old = previous.get((result['workers'], result['threads'], result['clients']))
+        if not old or not old['requests_per_second']:
+            continue
+        ratio = result['requests_per_second'] / old['requests_per_second']
+        if ratio < 1 - tolerance or result['failures'] > old['failures']:
+            regressions.append((result, old, ratio))
+    return regressions
+
+
+def print_table(results):
+    header = f"{'进程':>4} {'线程':>4} {'客户端':>6} {'请求数':>7} {'失败':>5} {'耗时(s)':>9} {'请求/秒':>9} {'p50(ms)':>9} {'p95(ms)':>9}"
+    print(header)
+    print('-' * 84)
+    for r in results:
+        print(f"{r['workers']:>6} {r['threads']:>6} {r['clients']:>9} {r['requests']:>9} {r['failures']:>7} "
+              f"{r['wall_seconds']:>10.3f} {r['requests_per_second']:>11.1f} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='服务吞吐量基准测试（gunicorn + 本地模拟交易所）')
+    parser.add_argument('--workers', default='1,2', help='gunicorn worker 进程数，逗号分隔')
+    parser.add_argument('--threads', default='8', help='每个 worker 的线程数，逗号分隔')
+    parser.add_argument('--clients', type=int, default=8, help='并发客户端（浏览器会话）数')
+    parser.add_argument('--requests', type=int, default=10, help='每个客户端的查询次数')
+    parser.add_argument('--accounts', type=int, default=3, help='每个会话的账户数（轮流使用三个交易所）')
+    parser.add_argument('--days', type=int, default=1, help='每次查询的天数')
+    parser.add_argument('--density', type=int, default=200, help='每天成交数')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟网络延迟（秒）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='结果保存为 JSON 文件')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的吞吐量下降比例')
+    args = parser.parse_args(argv)
+
+    results = []
+    for workers in _parse_list(args.workers, int):
+        for threads in _parse_list(args.threads, int):
+            results.append(run_case(workers, threads, args))
+
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+                'results': results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ 结果已保存到: {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 个性能回退:")
+            for result, old, ratio in regressions:
+                print(f"   {result['workers']} 进程 x {result['threads']} 线程: "
+                      f"{old['requests_per_second']:.1f} -> {result['requests_per_second']:.1f} 请求/秒 ({ratio:.0%}), "
+                      f"失败 {old['failures']} -> {result['failures']}")
+            return 1
+        print("\n✅ 未发现性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
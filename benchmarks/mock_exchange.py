@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+本地模拟交易所 - 在一个 HTTP 服务中同时模拟 Binance、OKX 和 Bybit 的接口
+按固定间隔生成确定性的成交记录，可配置延迟、单页条数上限、限频和 429 注入
+
+现货、杠杆和合约市场（Binance /sapi、/fapi、/dapi，OKX instType，Bybit category）返回相同序号的成交，
+字段按各市场的接口格式生成；合约面值: U本位 0.01 币 / 张，币本位 100 美元 / 张
+"""
+
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DAY_MS = 24 * 3600 * 1000
+
+# 模拟的现货交易对: (base, quote)
+MOCK_SYMBOLS = [('BTC', 'USDT'), ('ETH', 'USDT'), ('PNUT', 'USDT'), ('WIF', 'USDC')]
+LINEAR_CONTRACT_SIZE = 0.01  # U本位合约每张的币数量（OKX ctVal）
+INVERSE_CONTRACT_SIZE = 100  # 币本位合约每张的美元面值
+
+
+class MockExchangeConfig:
+    """模拟交易所的行为配置"""
+
+    def __init__(self, latency=0.0, fills_per_day=100, page_limit=None, rate_limit=None,
+                 error_rate_429=0.0, seed=42):
+        self.latency = latency                # 每个请求的固定延迟（秒）
+        self.fills_per_day = fills_per_day    # 每天的成交数（均匀分布）
+        self.page_limit = page_limit          # 单页返回条数上限，None 表示按交易所默认
+        self.rate_limit = rate_limit          # 每个交易所每秒允许的请求数，None 表示不限
+        self.error_rate_429 = error_rate_429  # 随机返回 429 的概率
+        self.seed = seed
+
+
+def fill_ids_in_window(start_ms, end_ms, fills_per_day):
+    """返回 [start_ms, end_ms] 内的成交序号范围，成交时间为 k * interval + interval // 2"""
+    if fills_per_day <= 0 or end_ms < start_ms:
+        return range(0)
+    interval = DAY_MS // fills_per_day
+    offset = interval // 2
+    first = max(0, -(-(start_ms - offset) // interval))
+    last = (end_ms - offset) // interval
+    return range(first, last + 1)
+
+
+def fill_time(k, fills_per_day):
+    interval = DAY_MS // fills_per_day
+    return k * interval + interval // 2
+
+
+def expected_fill_count(start_ms, end_ms, fills_per_day):
+    """时间范围内应有的成交数，用于检查导出器是否漏数据"""
+    return len(fill_ids_in_window(start_ms, end_ms, fills_per_day))
+
+
+def _fill_fields(k):
+    is_buy = (k * 2654435761) % 7 < 4
+    price = 100 + (k % 1000) / 100
+    qty = 0.1 + (k % 7) / 10
+    return is_buy, price, qty
+
+
+def _kline_close(t):
+    """模拟的手续费资产价格（随时间缓慢变化）"""
+    return 300 + (t // 3600000) % 100
+
+
+def _kline_times(query, start_key, end_key, interval_ms, limit):
+    start_ms = -(-int(query[start_key]) // interval_ms) * interval_ms
+    return list(range(start_ms, int(query[end_key]) + 1, interval_ms))[:limit]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server.mock
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        path = parsed.path
+
+        if path.startswith(('/api/v3/', '/sapi/', '/fapi/', '/dapi/')):
+            exchange = 'binance'
+        elif path.startswith('/api/v5/'):
+            exchange = 'okx'
+        else:
+            exchange = 'bybit'
+
+        if server.config.latency:
+            time.sleep(server.config.latency)
+
+        if server.should_throttle(exchange, path):
+            status, body = server.throttled_response(exchange)
+        else:
+            status, body = server.route(exchange, path, query)
+        server.record(exchange, path, status)
+        self._send(status, body)
+
+
+class MockExchangeServer:
+    """本地模拟交易所服务器，可作为上下文管理器使用"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or MockExchangeConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._recent = defaultdict(deque)  # {exchange: 最近一秒内的请求时间}
+        self.stats = defaultdict(int)      # {(exchange, path, status): 次数}
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+            self._recent.clear()
+
+    def request_count(self, exchange=None):
+        with self._lock:
+            return sum(n for (ex, _, _), n in self.stats.items() if exchange is None or ex == exchange)
+
+    def throttled_count(self, exchange=None):
+        with self._lock:
+            return sum(n for (ex, _, status), n in self.stats.items()
+                       if status == 429 and (exchange is None or ex == exchange))
+
+    def record(self, exchange, path, status):
+        with self._lock:
+            self.stats[(exchange, path, status)] += 1
+
+    # ---------- 限频 ----------
+
+    def should_throttle(self, exchange, path):
+        if '/time' in path:
+            return False
+        with self._lock:
+            if self.config.error_rate_429 and self._random.random() < self.config.error_rate_429:
+                return True
+            if self.config.rate_limit:
+                now = time.monotonic()
+                recent = self._recent[exchange]
+                while recent and now - recent[0] > 1:
+                    recent.popleft()
+                if len(recent) >= self.config.rate_limit:
+                    return True
+                recent.append(now)
+        return False
+
+    @staticmethod
+    def throttled_response(exchange):
+        if exchange == 'binance':
+            return 429, {'code': -1003, 'msg': 'Too many requests.'}
+        if exchange == 'okx':
+            return 429, {'code': '50011', 'msg': 'Too Many Requests', 'data': []}
+        return 200, {'retCode': 10006, 'retMsg': 'Too many visits!', 'result': {}}
+
+    # ---------- 路由 ----------
+
+    def route(self, exchange, path, query):
+        handler = getattr(self, f"_{exchange}_{path.strip('/').replace('/', '_').replace('-', '_')}", None)
+        if handler is None:
+            return 404, {'code': -1, 'msg': f'unknown path {path}'}
+        return handler(query)
+
+    def _page_size(self, requested, default, maximum):
+        size = min(int(requested or default), maximum)
+        if self.config.page_limit:
+            size = min(size, self.config.page_limit)
+        return size
+
+    def _window(self, query, start_key, end_key):
+        now = int(time.time() * 1000)
+        end_ms = int(query.get(end_key) or now)
+        start_ms = int(query.get(start_key) or end_ms - 7 * DAY_MS)
+        return start_ms, end_ms
+
+    # Binance
+
+    def _binance_api_v3_time(self, query):
+        return 200, {'serverTime': int(time.time() * 1000)}
+
+    def _binance_api_v3_exchangeInfo(self, query):
+        return 200, {'symbols': [{
+            'symbol': base + quote, 'baseAsset': base, 'quoteAsset': quote, 'status': 'TRADING',
+            'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.01'},
+                        {'filterType': 'LOT_SIZE', 'stepSize': '0.001'}]
+        } for base, quote in MOCK_SYMBOLS]}
+
+    def _binance_api_v3_account(self, query):
+        return 200, {'accountType': 'SPOT', 'canTrade': True, 'balances': []}
+
+    def _binance_fill_ids(self, query):
+        """myTrades / userTrades 共用的分页：时间窗口或 fromId，最早的在前"""
+        if query.get('fromId') and not query.get('startTime'):
+            # 只带 fromId 时不限时间窗口，返回该 ID 之后到当前为止的成交
+            ids = fill_ids_in_window(0, int(time.time() * 1000), self.config.fills_per_day)
+        else:
+            start_ms, end_ms = self._window(query, 'startTime', 'endTime')
+            ids = fill_ids_in_window(start_ms, end_ms, self.config.fills_per_day)
+        if query.get('fromId'):
+            ids = range(max(ids.start, int(query['fromId'])), ids.stop)
+        return ids[:self._page_size(query.get('limit'), 500, 1000)]
+
+    def _binance_api_v3_myTrades(self, query):
+        symbol = query.get('symbol', 'BTCUSDT')
+        trades = []
+        for k in self._binance_fill_ids(query):
+            is_buy, price, qty = _fill_fields(k)
+            trades.append({
+                'symbol': symbol, 'id': k, 'orderId': k // 3, 'orderListId': -1,
+                'price': f"{price:.2f}", 'qty': f"{qty:.3f}", 'quoteQty': f"{price * qty:.6f}",
+                'commission': f"{qty * 0.001:.8f}", 'commissionAsset': 'BNB',
+                'time': fill_time(k, self.config.fills_per_day),
+                'isBuyer': is_buy, 'isMaker': k % 3 == 0, 'isBestMatch': True
+            })
+        return 200, trades
+
+    def _binance_sapi_v1_margin_myTrades(self, query):
+        status, trades = self._binance_api_v3_myTrades(query)
+        for trade in trades:
+            del trade['orderListId']
+            trade['isIsolated'] = query.get('isIsolated') == 'TRUE'
+        return status, trades
+
+    def _binance_fapi_v1_time(self, query):
+        return self._binance_api_v3_time(query)
+
+    def _binance_dapi_v1_time(self, query):
+        return self._binance_api_v3_time(query)
+
+    def _binance_futures_trades(self, query, coin_margined):
+        symbol = query.get('symbol', 'BTCUSDT')
+        trades = []
+        for k in self._binance_fill_ids(query):
+            is_buy, price, qty = _fill_fields(k)
+            trade = {
+                'symbol': symbol, 'id': k, 'orderId': k // 3, 'side': 'BUY' if is_buy else 'SELL',
+                'price': f"{price:.2f}", 'qty': f"{qty:.3f}", 'realizedPnl': '0',
+                'commission': f"{qty * 0.0004:.8f}", 'commissionAsset': 'USDT',
+                'time': fill_time(k, self.config.fills_per_day), 'positionSide': 'BOTH',
+                'buyer': is_buy, 'maker': k % 3 == 0
+            }
+            if coin_margined:
+                # qty 为张数，baseQty 为对应的币数量
+                contracts = int(qty * 10)
+                base_qty = contracts * INVERSE_CONTRACT_SIZE / price
+                trade.update(qty=str(contracts), baseQty=f"{base_qty:.8f}", marginAsset=symbol[:-8],
+                             commission=f"{base_qty * 0.0005:.8f}", commissionAsset=symbol[:-8])
+            else:
+                trade.update(quoteQty=f"{price * qty:.6f}", marginAsset='USDT')
+            trades.append(trade)
+        return 200, trades
+
+    def _binance_fapi_v1_userTrades(self, query):
+        return self._binance_futures_trades(query, coin_margined=False)
+
+    def _binance_dapi_v1_userTrades(self, query):
+        return self._binance_futures_trades(query, coin_margined=True)
+
+    def _binance_api_v3_klines(self, query):
+        interval_ms = {'1m': 60000, '1h': 3600000}[query.get('interval', '1h')]
+        return 200, [[t, '0', '0', '0', f"{_kline_close(t):.4f}", '0', t + interval_ms - 1]
+                     for t in _kline_times(query, 'startTime', 'endTime', interval_ms, 1000)]
+
+    # OKX
+
+    def _okx_api_v5_public_time(self, query):
+        return 200, {'code': '0', 'msg': '', 'data': [{'ts': str(int(time.time() * 1000))}]}
+
+    def _okx_api_v5_public_instruments(self, query):
+        if query.get('instType') == 'SWAP':
+            swaps = [{'instId': f"{base}-{quote}-SWAP", 'ctVal': str(LINEAR_CONTRACT_SIZE), 'ctValCcy': base,
+                      'settleCcy': quote} for base, quote in MOCK_SYMBOLS]
+            swaps += [{'instId': f"{base}-USD-SWAP", 'ctVal': str(INVERSE_CONTRACT_SIZE), 'ctValCcy': 'USD',
+                       'settleCcy': base} for base, _ in MOCK_SYMBOLS]
+            for swap in swaps:
+                swap.update(tickSz='0.1', lotSz='1', state='live')
+            return 200, {'code': '0', 'msg': '', 'data': swaps}
+        return 200, {'code': '0', 'msg': '', 'data': [{
+            'instId': f"{base}-{quote}", 'baseCcy': base, 'quoteCcy': quote,
+            'tickSz': '0.01', 'lotSz': '0.001', 'state': 'live'
+        } for base, quote in MOCK_SYMBOLS]}
+
+    def _okx_api_v5_account_balance(self, query):
+        return 200, {'code': '0', 'msg': '', 'data': [{'details': []}]}
+
+    def _okx_api_v5_trade_fills(self, query):
+        inst_id = query.get('instId', 'BTC-USDT')
+        inst_type = query.get('instType', 'SPOT')
+        start_ms, end_ms = self._window(query, 'begin', 'end')
+        ids = fill_ids_in_window(start_ms, end_ms, self.config.fills_per_day)
+        if query.get('after'):
+            # after: 返回比该 billId 更早的记录
+            ids = range(ids.start, min(ids.stop, int(query['after'])))
+        ids = ids[::-1][:self._page_size(query.get('limit'), 100, 100)]  # 最新的在前
+
+        fee_ccy = inst_id.split('-')[0]
+        fills = []
+        for k in ids:
+            is_buy, price, qty = _fill_fields(k)
+            # 永续合约的 fillSz 为张数
+            size = f"{qty:.3f}" if inst_type != 'SWAP' else str(int(qty * 10))
+            fills.append({
+                'instType': inst_type, 'instId': inst_id, 'tradeId': str(k), 'ordId': str(k // 3),
+                'billId': str(k), 'fillPx': f"{price:.2f}", 'fillSz': size, 'fillPnl': '0',
+                'side': 'buy' if is_buy else 'sell', 'execType': 'M' if k % 3 == 0 else 'T',
+                'fee': f"{-qty * 0.001:.8f}", 'feeCcy': fee_ccy,
+                'ts': str(fill_time(k, self.config.fills_per_day))
+            })
+        return 200, {'code': '0', 'msg': '', 'data': fills}
+
+    def _okx_api_v5_market_history_candles(self, query):
+        interval_ms = {'1m': 60000, '1H': 3600000}[query.get('bar', '1H')]
+        bounds = {'begin': int(query['before']) + 1, 'end': int(query['after']) - 1}
+        times = _kline_times(bounds, 'begin', 'end', interval_ms, 100)
+        return 200, {'code': '0', 'msg': '', 'data': [[str(t), '0', '0', '0', f"{_kline_close(t):.4f}"]
+                                                     for t in reversed(times)]}
+
+    # Bybit
+
+    def _bybit_v5_market_time(self, query):
+        now = time.time()
+        return 200, {'retCode': 0, 'retMsg': 'OK', 'result': {
+            'timeSecond': str(int(now)), 'timeNano': str(int(now * 1e9))}}
+
+    def _bybit_v5_market_instruments_info(self, query):
+        return 200, {'retCode': 0, 'retMsg': 'OK', 'result': {'category': 'spot', 'list': [{
+            'symbol': base + quote, 'baseCoin': base, 'quoteCoin': quote, 'status': 'Trading',
+            'priceFilter': {'tickSize': '0.01'}, 'lotSizeFilter': {'basePrecision': '0.001'}
+        } for base, quote in MOCK_SYMBOLS], 'nextPageCursor': ''}}
+
+    def _bybit_v5_asset_transfer_query_account_coins_balance(self, query):
+        return 200, {'retCode': 0, 'retMsg': 'OK', 'result': {'balance': []}}
+
+    def _bybit_v5_execution_list(self, query):
+        symbol = query.get('symbol', 'BTCUSDT')
+        category = query.get('category', 'spot')
+        start_ms, end_ms = self._window(query, 'startTime', 'endTime')
+        ids = fill_ids_in_window(start_ms, end_ms, self.config.fills_per_day)
+        if query.get('cursor'):
+            ids = range(ids.start, min(ids.stop, int(query['cursor'])))
+        page_size = self._page_size(query.get('limit'), 50, 100)
+        page = ids[::-1][:page_size]  # 最新的在前
+        next_cursor = str(page[-1]) if len(page) == page_size and page[-1] > ids.start else ''
+
+        executions = []
+        for k in page:
+            is_buy, price, qty = _fill_fields(k)
+            execution = {
+                'symbol': symbol, 'execId': str(k), 'orderId': str(k // 3),
+                'side': 'Buy' if is_buy else 'Sell', 'execType': 'Trade',
+                'execPrice': f"{price:.2f}", 'execQty': f"{qty:.3f}", 'execValue': f"{price * qty:.6f}",
+                'execFee': f"{qty * 0.001:.8f}", 'feeCurrency': symbol[:-4] or 'USDT',
+                'isMaker': k % 3 == 0,
+                'execTime': str(fill_time(k, self.config.fills_per_day))
+            }
+            if category == 'inverse':
+                # 反向合约: execQty 为美元面值，execValue 为币数量
+                contracts = int(qty * 10) * INVERSE_CONTRACT_SIZE
+                execution.update(execQty=str(contracts), execValue=f"{contracts / price:.8f}",
+                                 feeCurrency=symbol[:-3])
+            executions.append(execution)
+        return 200, {'retCode': 0, 'retMsg': 'OK', 'result': {
+            'category': category, 'list': executions, 'nextPageCursor': next_cursor}}
+
+    def _bybit_v5_market_kline(self, query):
+        interval_ms = {'1': 60000, '60': 3600000}[query.get('interval', '60')]
+        times = _kline_times(query, 'start', 'end', interval_ms, 1000)
+        return 200, {'retCode': 0, 'retMsg': 'OK', 'result': {
+            'category': 'spot', 'symbol': query.get('symbol'),
+            'list': [[str(t), '0', '0', '0', f"{_kline_close(t):.4f}", '0', '0'] for t in reversed(times)]}}
@@ -4,16 +4,22 @@ Binance 交易记录导出器 - 完整版本
 包含网络重试机制和交互式导出功能
 """
 
-import requests
 import hmac
 import hashlib
-import time
-import json
 import csv
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from exchange_client import (ExchangeClient, Decoded, OK, AUTH_ERROR, TIMESTAMP_ERROR, FAILED,
+                             decoded_http_status, get_rate_limiter)
+from instrument_cache import get_instrument_cache
+from json_backend import response_json
+from markets import (SPOT, MARGIN, USDM, COINM, DEFAULT_MARKETS, MarketClients, inverse_base, market_label,
+                     parse_markets)
+from trade_export import format_trades_for_csv, write_csv_rows
+from trade_dedup import DedupIndex, new_dedup_index
+from trade_merge import day_window, iter_market_trades, iter_period_days
+import trade_export
+import tracing
 
 # 默认配置，替代config模块
 DEFAULT_CONFIG = {
@@ -25,105 +31,121 @@ DEFAULT_CONFIG = {
     'EXPORT_FORMAT': 'both'
 }
 
-class BinanceTradeExporter:
-    """Binance 交易记录导出器"""
-    
-    def __init__(self, api_key=None, secret_key=None, testnet=None):
-        self.api_key = api_key or DEFAULT_CONFIG['API_KEY']
-        self.secret_key = secret_key or DEFAULT_CONFIG['SECRET_KEY']
-        testnet = testnet if testnet is not None else DEFAULT_CONFIG['TESTNET']
-        self.base_url = "https://testnet.binance.vision/api/v3" if testnet else "https://api.binance.com/api/v3"
-        
-        # 创建带重试机制的session
-        self.session = self._create_retry_session()
-        
-    def _create_retry_session(self):
-        """创建带重试机制的requests session"""
-        session = requests.Session()
-        
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=5,  # 总重试次数
-            backoff_factor=1,  # 退避因子，重试间隔会递增
-            status_forcelist=[429, 500, 502, 503, 504],  # 需要重试的HTTP状态码
-            allowed_methods=["HEAD", "GET", "OPTIONS"]  # 允许重试的HTTP方法
-        )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        
-        # 增加超时设置
-        session.timeout = 30
-        
-        return session
-    
-    def _make_request(self, endpoint, params=None, max_retries=3):
-        """发送带重试机制的请求"""
-        if params is None:
-            params = {}
-            
-        # 添加时间戳
-        params['timestamp'] = int(time.time() * 1000)
-        
-        # 生成签名
-        query_string = urlencode(params)
+BINANCE_REQUESTS_PER_SECOND = 10  # 每秒请求数（按 IP 共享）
+PAGE_LIMIT = 1000  # myTrades / userTrades 单次返回的最大条数
+
+# 各市场的 (主机, 接口前缀, 成交接口, 每秒请求数)
+# 合约在独立的主机上按各自的权重限频：userTrades 权重 5（U本位）/ 20（币本位），每分钟 2400
+BINANCE_MARKETS = {
+    SPOT: ('api', '/api/v3', 'myTrades', BINANCE_REQUESTS_PER_SECOND),
+    MARGIN: ('api', '/sapi/v1', 'margin/myTrades', BINANCE_REQUESTS_PER_SECOND),
+    USDM: ('fapi', '/fapi/v1', 'userTrades', 8),
+    COINM: ('dapi', '/dapi/v1', 'userTrades', 2),
+}
+BINANCE_HOSTS = {
+    'api': 'https://api.binance.com',
+    'fapi': 'https://fapi.binance.com',
+    'dapi': 'https://dapi.binance.com',
+}
+# 测试网没有杠杆接口
+BINANCE_TESTNET_HOSTS = {
+    'api': 'https://testnet.binance.vision',
+    'fapi': 'https://testnet.binancefuture.com',
+    'dapi': 'https://testnet.binancefuture.com',
+}
+
+class BinanceSigner:
+    """Binance HMAC-SHA256 签名"""
+    
+    def __init__(self, api_key, secret_key):
+        self.api_key = api_key
+        self.secret_key = secret_key
+    
+    def sign(self, method, endpoint, params, timestamp_ms):
+        """返回 (请求路径, 请求头)"""
+        signed_params = dict(params)
+        signed_params['timestamp'] = timestamp_ms
+        query_string = urlencode(signed_params)
         signature = hmac.new(
             self.secret_key.encode('utf-8'),
             query_string.encode('utf-8'),
             hashlib.sha256
         ).hexdigest()
-        params['signature'] = signature
         
         headers = {
             'X-MBX-APIKEY': self.api_key,
             'User-Agent': 'Mozilla/5.0 (compatible; BinanceTradeExporter/1.0)'
         }
+        return f"/{endpoint}?{query_string}&signature={signature}", headers
+
+def decode_binance_response(response):
+    """解析 Binance 响应"""
+    if response.status_code == 200:
+        return Decoded(OK, response_json(response), None)
+    
+    try:
+        error = response_json(response)
+    except ValueError:
+        error = {}
+    code = error.get('code') if isinstance(error, dict) else None
+    
+    if code == -1021:
+        # 时间戳超出 recvWindow
+        return Decoded(TIMESTAMP_ERROR, None, error.get('msg'))
+    if code in (-2014, -2015):
+        # API key 格式错误 / 无效、IP 或权限不符
+        return Decoded(AUTH_ERROR, None, error.get('msg'))
+    if code is not None and response.status_code not in (418, 429) and response.status_code < 500:
+        return Decoded(FAILED, None, f"API 错误 {code}: {error.get('msg')}")
+    return decoded_http_status(response)
+
+class BinanceTradeExporter:
+    """Binance 交易记录导出器"""
+    
+    EXCHANGE = 'binance'
+    
+    def __init__(self, api_key=None, secret_key=None, testnet=None, api_host=None):
+        self.api_key = api_key or DEFAULT_CONFIG['API_KEY']
+        self.secret_key = secret_key or DEFAULT_CONFIG['SECRET_KEY']
+        testnet = testnet if testnet is not None else DEFAULT_CONFIG['TESTNET']
+        self.hosts = BINANCE_TESTNET_HOSTS if testnet else BINANCE_HOSTS
+        if api_host:
+            # 自定义 API 主机（例如代理或本地模拟服务器）
+            self.hosts = dict.fromkeys(BINANCE_HOSTS, api_host.rstrip('/'))
+        self.markets = tuple(market for market in BINANCE_MARKETS if not (testnet and market == MARGIN))
+        self.auth_error_callback = None  # 认证失败时的回调，由账户管理设置
+        
+        # 通用请求层：连接池、时间同步、限频和重试均由 ExchangeClient 负责，每个市场一个客户端
+        self.market_clients = MarketClients('Binance', self.markets, self._create_client)
+        self.client = self.market_clients.get(SPOT)
+        self.base_url = self.client.base_url
+        self.instruments = get_instrument_cache('binance', self.base_url)
+        self.session = self.client.session
+        self.clock = self.client.clock
+    
+    def _create_client(self, market):
+        host, prefix, _, requests_per_second = BINANCE_MARKETS[market]
+        base_url = f"{self.hosts[host]}{prefix}"
+        return ExchangeClient(
+            'binance', base_url,
+            signer=BinanceSigner(self.api_key, self.secret_key),
+            decoder=decode_binance_response,
+            # Binance 的请求权重按 IP 计算，同一接口前缀的所有账户共享限频器
+            rate_limiter=get_rate_limiter(('binance', base_url), requests_per_second),
+            on_auth_error=self._report_auth_error,
+            # /sapi 没有时间接口，与现货使用同一个服务器时钟
+            clock=self.client.clock if market == MARGIN else None
+        )
         
-        url = f"{self.base_url}/{endpoint}"
-        
-        # 重试机制
-        for attempt in range(max_retries + 1):
-            try:
-                response = self.session.get(url, params=params, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 429:
-                    # 频率限制，等待更长时间
-                    wait_time = 2 ** attempt
-                    print(f"  ⏳ 请求频率限制，等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    response.raise_for_status()
-                    
-            except (requests.exceptions.SSLError, 
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.Timeout) as e:
-                
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt  # 指数退避
-                    print(f"  ⚠️  网络错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
-                    print(f"  ⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"❌ 网络请求错误: {e}")
-                    return None
-                    
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt
-                    print(f"  ⚠️  请求错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
-                    print(f"  ⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"❌ 请求错误: {e}")
-                    return None
-        
-        return None
+    def _report_auth_error(self):
+        """通知账户管理方认证失败（API密钥失效或权限不足）"""
+        print("❌ API 认证失败，请检查API密钥和权限")
+        if self.auth_error_callback:
+            self.auth_error_callback()
+    
+    def _make_request(self, endpoint, params=None, max_retries=3):
+        """发送带重试机制的请求"""
+        return self.client.request(endpoint, params, max_retries)
     
     def test_connection(self):
         """测试API连接和权限"""
@@ -135,7 +157,7 @@ class BinanceTradeExporter:
             response = self.session.get(url, timeout=30)
             
             if response.status_code == 200:
-                server_time = response.json()
+                server_time = response_json(response)
                 server_timestamp = server_time['serverTime']
                 server_datetime = datetime.fromtimestamp(server_timestamp / 1000)
                 print(f"✅ 服务器连接正常，服务器时间: {server_datetime}")
@@ -161,66 +183,132 @@ class BinanceTradeExporter:
             print(f"❌ API权限测试失败: {e}")
             return False
     
-    def get_trades_for_day(self, symbol, date_str):
-        """获取指定日期的交易记录"""
+    def get_symbol_info(self, symbol):
+        """获取交易对元数据（基础/计价货币、价格和数量精度），找不到时返回 None"""
+        return self.instruments.get(symbol, self.session)
+    
+    @staticmethod
+    def _market_symbol(symbol, market):
+        """交易对在各市场的写法：币本位合约为永续合约 BTCUSD_PERP，其他市场与现货相同"""
+        if market == COINM:
+            base = inverse_base(symbol)
+            return f"{base}USD_PERP" if base else symbol
+        return symbol
+    
+    def iter_trade_pages(self, symbol, date_str, market=SPOT, before_request=None):
+        """逐页获取指定日期、指定市场的交易记录，每页一个列表（按时间升序）
+        
+        第一页按时间窗口查询；返回满 1000 条时用 fromId 继续翻页，直到超出当天。
+        四个市场的成交接口翻页方式相同，只是路径和返回字段不同
+        
+        before_request() 在实际发出每一页的请求之前调用（后台同步用于全局限频）
+        """
+        client = self.market_clients.get(market)
+        endpoint = BINANCE_MARKETS[market][2]
+        instrument = self._market_symbol(symbol, market)
+        start_time, end_time = day_window(date_str)
+        
+        params = {
+            'symbol': instrument,
+            'startTime': start_time,
+            'endTime': end_time,
+            'limit': PAGE_LIMIT
+        }
+        page_number = 0
+        while True:
+            if before_request is not None:
+                before_request()
+            page_number += 1
+            with tracing.span('window', exchange='binance', market=market, symbol=symbol, date=date_str,
+                              page=page_number) as window:
+                if page_number == 1:
+                    tracing.log(f"正在获取 {date_str} 00:00 到次日 00:00 的{market_label(market)}交易记录...")
+                trades = client.request_or_raise(endpoint, params)
+                page = [self._convert_trade(t, symbol, market) for t in trades if int(t['time']) <= end_time]
+                window.set(trades=len(page))
+            if page:
+                yield page
+            if len(trades) < PAGE_LIMIT or len(page) < len(trades):
+                return
+            # fromId 不能与时间窗口同时使用，翻页时只按 ID 继续
+            params = {'symbol': instrument, 'fromId': int(trades[-1]['id']) + 1, 'limit': PAGE_LIMIT}
+    
+    @staticmethod
+    def _convert_trade(trade, symbol, market):
+        """现货和杠杆成交已是标准格式，只标记市场；合约成交转换字段名，币本位的张数换算为币的数量"""
+        if market in (SPOT, MARGIN):
+            trade['market'] = market
+            return trade
+        converted = {
+            'id': trade['id'],
+            'orderId': trade['orderId'],
+            'symbol': symbol,
+            'instrument': trade['symbol'],
+            'market': market,
+            'time': trade['time'],
+            'isBuyer': trade['buyer'],
+            'isMaker': trade['maker'],
+            'price': trade['price'],
+            'qty': trade['qty'],
+            'quoteQty': trade.get('quoteQty', '0'),
+            'commission': trade['commission'],
+            'commissionAsset': trade['commissionAsset'],
+            'realizedPnl': trade.get('realizedPnl', '0'),
+            'positionSide': trade.get('positionSide', 'BOTH')
+        }
+        if market == COINM:
+            # 币本位的 qty 是合约张数，baseQty 是对应的币数量
+            converted['contracts'] = trade['qty']
+            converted['qty'] = trade['baseQty']
+            converted['quoteQty'] = str(float(trade['baseQty']) * float(trade['price']))
+        return converted
+    
+    def get_trades_for_day(self, symbol, date_str, market=SPOT):
+        """获取指定日期、指定市场的交易记录"""
+        trades = []
         try:
-            # 计算时间戳
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            start_time = int(date_obj.timestamp() * 1000)
-            end_time = int((date_obj + timedelta(days=1) - timedelta(seconds=1)).timestamp() * 1000)
-            
-            params = {
-                'symbol': symbol,
-                'startTime': start_time,
-                'endTime': end_time,
-                'limit': 1000
-            }
-            
-            print(f"正在获取 {date_str} 00:00 到 {date_str} 23:59 的交易记录...")
-            
-            trades = self._make_request("myTrades", params)
-            
-            if trades is None:
-                print("  这个时间段没有交易记录")
-                return []
-            elif len(trades) == 0:
-                print("  这个时间段没有交易记录")
-                return []
-            else:
-                print(f"  获取到 {len(trades)} 条记录，累计 {len(trades)} 条")
-                return trades
-                
+            # 重试或翻页边界可能返回重复的成交
+            seen = DedupIndex()
+            for page in self.iter_trade_pages(symbol, date_str, market):
+                trades.extend(seen.filter(page, self.EXCHANGE))
         except Exception as e:
-            print(f"  获取 {date_str} 数据时出错: {e}")
-            return []
-    
-    def get_all_trades_in_period(self, symbol, start_date, end_date):
-        """获取指定时间段内的所有交易记录"""
-        print(f"开始获取 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
+            tracing.log(f"  获取 {date_str} 数据时出错: {e}")
+            return trades
         
-        all_trades = []
-        current_date = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+        if trades:
+            tracing.log(f"  获取到 {len(trades)} 条记录")
+        else:
+            tracing.log("  这个时间段没有交易记录")
+        return trades
+    
+    def iter_trades(self, symbol, start_date, end_date, market=SPOT):
+        """生成器：按时间顺序逐条产出指定时间段内、指定市场的交易记录，每次只在内存中保留一页
         
-        total_trades = 0
+        market 也可以是市场列表，各市场并发获取后按时间归并为一个流（见 iter_market_trades）"""
+        if not isinstance(market, str):
+            yield from iter_market_trades(self, symbol, start_date, end_date, market)
+            return
+        # 相邻日窗口首尾重叠，跨天的重复成交在这里过滤
+        seen = new_dedup_index()
+        for date_str in iter_period_days(start_date, end_date):
+            try:
+                for page in self.iter_trade_pages(symbol, date_str, market):
+                    yield from seen.filter(page, self.EXCHANGE)
+            except Exception as e:
+                tracing.log(f"  获取 {date_str} 数据时出错: {e}")
+            # 只有相邻两天之间会有重复，更早的键不再需要
+            seen.next_window()
+    
+    def get_all_trades_in_period(self, symbol, start_date, end_date, market=SPOT):
+        """获取指定时间段内的所有交易记录"""
+        tracing.log(f"开始获取 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
         
-        while current_date <= end_date_obj:
-            date_str = current_date.strftime('%Y-%m-%d')
-            day_trades = self.get_trades_for_day(symbol, date_str)
-            
-            if day_trades:
-                all_trades.extend(day_trades)
-                total_trades += len(day_trades)
-                print(f"  获取到 {len(day_trades)} 条记录，累计 {total_trades} 条")
-            
-            current_date += timedelta(days=1)
-            
-            # 添加延迟避免频率限制
-            time.sleep(0.1)
+        all_trades = list(self.iter_trades(symbol, start_date, end_date, market))
         
-        print(f"\n总共获取到 {len(all_trades)} 条交易记录")
+        tracing.log(f"\n总共获取到 {len(all_trades)} 条交易记录")
         
-        if all_trades:
+        # 静默模式下跳过统计输出，避免在服务端热路径上额外遍历一遍数据
+        if all_trades and not tracing.is_quiet():
             self._print_trade_summary(all_trades)
         
         return all_trades
@@ -247,54 +335,12 @@ class BinanceTradeExporter:
         print(f"交易时间范围: {start_time.strftime('%Y-%m-%d %H:%M:%S')} 至 {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     def export_to_csv(self, trades, filename):
-        """导出交易记录到CSV文件"""
-        if not trades:
-            print("没有交易记录可导出")
-            return
-        
-        # 转换数据格式
-        formatted_trades = []
-        for trade in trades:
-            formatted_trade = {
-                '交易ID': trade['id'],
-                '订单ID': trade['orderId'],
-                '交易对': trade['symbol'],
-                '交易时间': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                '买卖方向': '买入' if trade['isBuyer'] else '卖出',
-                '价格': float(trade['price']),
-                '数量': float(trade['qty']),
-                '金额': float(trade['quoteQty']),
-                '手续费': float(trade['commission']),
-                '手续费资产': trade['commissionAsset'],
-                '是否maker': '是' if trade['isMaker'] else '否',
-                '原始时间戳': trade['time']
-            }
-            formatted_trades.append(formatted_trade)
-        
-        # 按时间排序
-        formatted_trades.sort(key=lambda x: x['原始时间戳'])
-        
-        # 写入CSV文件
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            fieldnames = list(formatted_trades[0].keys())
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            writer.writeheader()
-            for trade in formatted_trades:
-                writer.writerow(trade)
-        
-        print(f"✅ 交易记录已成功导出到: {filename}")
+        """导出交易记录到CSV文件，trades 可以是 iter_trades 返回的生成器"""
+        return trade_export.export_to_csv(trades, filename)
     
     def export_to_json(self, trades, filename):
-        """导出交易记录到JSON文件"""
-        if not trades:
-            print("没有交易记录可导出")
-            return
-        
-        with open(filename, 'w', encoding='utf-8') as jsonfile:
-            json.dump(trades, jsonfile, indent=2, ensure_ascii=False)
-        
-        print(f"✅ 交易记录已成功导出到: {filename}")
+        """导出交易记录到JSON文件，trades 可以是 iter_trades 返回的生成器"""
+        return trade_export.export_to_json(trades, filename)
 
 def display_trades_for_selection(trades):
     """显示交易列表供用户选择"""
@@ -373,11 +419,11 @@ def select_trades_for_analysis(trades):
             print(f"❌ 输入格式错误: {e}")
             print("请重新输入")
 
-def calculate_average_prices(selected_trades):
-    """计算选中交易的平均价格"""
+def calculate_average_prices(selected_trades, ask_report=True):
+    """计算选中交易的平均价格，返回 (buy_stats, sell_stats, profit_stats)"""
     if not selected_trades:
         print("没有选中的交易")
-        return
+        return None, None, None
     
     buy_trades = [t for t in selected_trades if t['isBuyer']]
     sell_trades = [t for t in selected_trades if not t['isBuyer']]
@@ -490,10 +536,13 @@ def calculate_average_prices(selected_trades):
         print(f"   注意: 手续费涉及多种资产，请单独考虑手续费成本")
     
     # 询问是否生成CSV报告
-    print("\n是否生成分析报告CSV文件？")
-    choice = input("输入 'y' 生成报告，其他任意键跳过: ").strip().lower()
-    if choice == 'y':
-        generate_analysis_report(selected_trades, buy_stats, sell_stats, profit_stats)
+    if ask_report:
+        print("\n是否生成分析报告CSV文件？")
+        choice = input("输入 'y' 生成报告，其他任意键跳过: ").strip().lower()
+        if choice == 'y':
+            generate_analysis_report(selected_trades, buy_stats, sell_stats, profit_stats)
+    
+    return buy_stats, sell_stats, profit_stats
 
 def generate_analysis_report(selected_trades, buy_stats, sell_stats, profit_stats):
     """生成分析报告CSV文件"""
@@ -712,8 +761,133 @@ def export_custom_period():
     except Exception as e:
         print(f"❌ 导出失败: {e}")
 
-def main():
+def profile_export(symbol, start_date, end_date, mode='cprofile', interval=0.01,
+                   output_prefix=None, api_host=None):
+    """非交互地执行一次 获取 -> 转换 -> 分析 -> 导出，并按阶段输出性能剖析"""
+    from profiler import PhaseProfiler
+    
+    output_prefix = output_prefix or f"profile_{symbol}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    exporter = BinanceTradeExporter(api_host=api_host)
+    profiler = PhaseProfiler(mode, interval)
+    
+    print(f"🔬 剖析 {symbol} 从 {start_date} 到 {end_date} 的导出 (模式: {mode})")
+    # 剖析期间关闭逐条日志，避免 print 本身成为热点
+    was_quiet = tracing.is_quiet()
+    tracing.set_quiet(True)
+    profiler.start()
+    try:
+        with profiler.phase('fetch'):
+            trades = exporter.get_all_trades_in_period(symbol, start_date, end_date)
+        if not trades:
+            print("❌ 没有找到交易记录")
+            return None
+        with profiler.phase('convert'):
+            rows = format_trades_for_csv(trades)
+        with profiler.phase('analyse'):
+            calculate_average_prices(trades, ask_report=False)
+        with profiler.phase('export'):
+            write_csv_rows(rows, f"{output_prefix}.csv")
+            exporter.export_to_json(trades, f"{output_prefix}_trades.json")
+    finally:
+        profiler.stop()
+        tracing.set_quiet(was_quiet)
+    
+    print(f"\n共 {len(trades)} 条交易记录")
+    profiler.print_summary()
+    for filename in profiler.dump(output_prefix):
+        print(f"✅ 剖析结果已保存到: {filename}")
+    return profiler
+
+def stream_export(symbol, start_date, end_date, output_prefix=None, api_host=None, export_format=None,
+                  markets=DEFAULT_MARKETS):
+    """非交互导出：边获取边写入 CSV / JSON，内存占用与时间范围无关，返回导出的成交数"""
+    export_format = export_format or DEFAULT_CONFIG['EXPORT_FORMAT']
+    output_prefix = output_prefix or f"{symbol}_{start_date}_to_{end_date}"
+    csv_filename = f"{output_prefix}.csv" if export_format in ("csv", "both") else None
+    json_filename = f"{output_prefix}.json" if export_format in ("json", "both") else None
+    
+    exporter = BinanceTradeExporter(api_host=api_host)
+    print(f"📤 流式导出 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
+    count = trade_export.export_trades(exporter.iter_trades(symbol, start_date, end_date, markets),
+                                       csv_filename, json_filename)
+    if not count:
+        print("❌ 没有找到交易记录")
+        return 0
+    for filename in (csv_filename, json_filename):
+        if filename:
+            print(f"✅ 交易记录已成功导出到: {filename}")
+    print(f"共 {count} 条交易记录")
+    return count
+
+def export_realized_pnl(symbol, start_date, end_date, method='fifo', output=None, api_host=None,
+                        normalize_fees=False, markets=DEFAULT_MARKETS):
+    """获取交易记录，按持仓匹配计算逐笔已实现盈亏并导出为 CSV"""
+    from lot_matching import LotMatcher, print_summary, write_fills_csv
+    
+    exporter = BinanceTradeExporter(api_host=api_host)
+    # 不折算手续费时逐条流式匹配；折算需要先收集全部成交以批量获取K线
+    empty, trades = trade_export.peek(exporter.iter_trades(symbol, start_date, end_date, markets))
+    if empty:
+        print("❌ 没有找到交易记录")
+        return None
+    
+    if normalize_fees:
+        from fee_normalization import FeeNormalizer
+        trades = list(trades)
+        base_urls = {'binance': exporter.base_url} if api_host else None
+        normalizer = FeeNormalizer(base_urls=base_urls)
+        fees = normalizer.normalize(trades)
+        print(f"💱 手续费已折算 ({normalizer.requests_made} 次K线请求): "
+              + ', '.join(f"{amount:.4f} {quote}" for quote, amount in fees['by_quote'].items()))
+    
+    output = output or f"{symbol}_{start_date}_to_{end_date}_pnl_{method}.csv"
+    matcher = LotMatcher(method)
+    count = write_fills_csv(matcher.match(trades), output)
+    print(f"✅ {count} 条逐笔盈亏已导出到: {output}")
+    summary = matcher.summary()
+    print_summary(summary)
+    return summary
+
+def main(argv=None):
     """主程序"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Binance 交易记录导出工具')
+    parser.add_argument('--profile', action='store_true', help='非交互导出并按阶段输出性能剖析')
+    parser.add_argument('--profile-mode', choices=['cprofile', 'sample'], default='cprofile',
+                        help='cprofile: 确定性剖析; sample: 低开销调用栈采样，适合长时间范围')
+    parser.add_argument('--sample-interval', type=float, default=0.01, help='采样间隔（秒）')
+    parser.add_argument('--export', choices=['csv', 'json', 'both'],
+                        help='非交互流式导出，边获取边写入文件，适合多年的历史')
+    parser.add_argument('--pnl', choices=['fifo', 'lifo', 'average'],
+                        help='非交互导出并按 FIFO/LIFO/平均成本计算逐笔已实现盈亏')
+    parser.add_argument('--normalize-fees', action='store_true',
+                        help='计算盈亏前按历史K线把 BNB 等手续费折算为计价货币')
+    parser.add_argument('--symbol', default=DEFAULT_CONFIG['DEFAULT_SYMBOL'])
+    parser.add_argument('--days', type=int, default=DEFAULT_CONFIG['DEFAULT_DAYS'])
+    parser.add_argument('--start', help='开始日期 YYYY-MM-DD（默认为 --days 天前）')
+    parser.add_argument('--end', help='结束日期 YYYY-MM-DD（默认为今天）')
+    parser.add_argument('--output', help='导出 / 剖析结果文件名前缀，或逐笔盈亏 CSV 文件名')
+    parser.add_argument('--api-host', help='API 主机（例如本地模拟交易所）')
+    parser.add_argument('--markets', type=parse_markets, default=DEFAULT_MARKETS,
+                        help='逗号分隔的市场: spot,margin,usdm,coinm（默认 spot），多个市场并发获取后合并导出')
+    args = parser.parse_args(argv)
+    
+    end_date = args.end or datetime.now().strftime('%Y-%m-%d')
+    start_date = args.start or (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=args.days)).strftime('%Y-%m-%d')
+    if args.export:
+        stream_export(args.symbol.upper(), start_date, end_date, args.output, args.api_host, args.export,
+                      args.markets)
+        return
+    if args.pnl:
+        export_realized_pnl(args.symbol.upper(), start_date, end_date, args.pnl, args.output, args.api_host,
+                            args.normalize_fees, args.markets)
+        return
+    if args.profile:
+        profile_export(args.symbol.upper(), start_date, end_date, args.profile_mode,
+                       args.sample_interval, args.output, args.api_host)
+        return
+    
     print("=== Binance 交易记录导出工具 ===\n")
     print(f"当前配置:")
     print(f"  默认交易对: {DEFAULT_CONFIG['DEFAULT_SYMBOL']}")
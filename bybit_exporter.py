@@ -4,73 +4,40 @@ Bybit 交易记录导出器 - 对应 Binance 和 OKX 版本
 包含网络重试机制和交互式导出功能
 """
 
-import requests
 import hmac
 import hashlib
-import time
-import json
-import csv
-from datetime import datetime, timedelta
+from datetime import datetime
 from urllib.parse import urlencode
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from exchange_client import (ExchangeClient, Decoded, OK, AUTH_ERROR, TIMESTAMP_ERROR, RATE_LIMITED, FAILED,
+                             decoded_http_status, get_rate_limiter)
+from instrument_cache import get_instrument_cache
+from json_backend import response_json
+from markets import SPOT, USDM, COINM, MarketClients, inverse_base, market_label
+from trade_dedup import DedupIndex, new_dedup_index
+from trade_merge import day_window, iter_market_trades, iter_period_days, trade_time
+import trade_export
+import tracing
 
-class BybitTradeExporter:
-    """Bybit 交易记录导出器"""
+BYBIT_REQUESTS_PER_SECOND = 5  # 每秒请求数（按账户）
+PAGE_LIMIT = 100  # execution/list 单次返回的最大条数
+# 10003: API key 无效, 10004: 签名错误, 10005: 权限不足
+BYBIT_AUTH_ERROR_CODES = (10003, 10004, 10005)
+BYBIT_RATE_LIMIT_CODES = (10006, 10018)
+
+# 各市场在 execution/list 中的 category；统一账户的杠杆成交包含在 spot 中，不单独查询
+BYBIT_CATEGORIES = {
+    SPOT: 'spot',
+    USDM: 'linear',
+    COINM: 'inverse',
+}
+
+class BybitSigner:
+    """Bybit HMAC-SHA256 签名"""
     
-    def __init__(self, api_key=None, secret_key=None, testnet=None):
+    def __init__(self, api_key, secret_key, recv_window):
         self.api_key = api_key
         self.secret_key = secret_key
-        testnet = testnet if testnet is not None else False
-        self.base_url = "https://api-testnet.bybit.com" if testnet else "https://api.bybit.com"
-        self.recv_window = 20000  # 20秒接收窗口
-        self._server_time_offset = 0
-        
-        # 创建带重试机制的session
-        self.session = self._create_retry_session()
-        self._sync_server_time()
-    
-    def _create_retry_session(self):
-        """创建带重试机制的requests session"""
-        session = requests.Session()
-        
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=5,  # 总重试次数
-            backoff_factor=1,  # 退避因子，重试间隔会递增
-            status_forcelist=[429, 500, 502, 503, 504],  # 需要重试的HTTP状态码
-            allowed_methods=["HEAD", "GET", "OPTIONS"]  # 允许重试的HTTP方法
-        )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        
-        # 增加超时设置
-        session.timeout = 30
-        
-        return session
-    
-    def _sync_server_time(self):
-        """同步服务器时间"""
-        try:
-            response = self.session.get(f"{self.base_url}/v5/market/time")
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('retCode') == 0:
-                    server_time = int(result['result']['timeSecond']) * 1000
-                    local_time = int(time.time() * 1000)
-                    self._server_time_offset = server_time - local_time
-                else:
-                    print("⚠️ 无法获取服务器时间，使用本地时间")
-            else:
-                print("⚠️ 无法连接服务器获取时间，使用本地时间")
-        except Exception as e:
-            print(f"⚠️ 时间同步失败: {e}，使用本地时间")
-    
-    def _get_timestamp(self):
-        """获取同步后的时间戳"""
-        return str(int(time.time() * 1000) + self._server_time_offset)
+        self.recv_window = recv_window
     
     def _generate_signature(self, timestamp, params_str):
         """生成Bybit API签名"""
@@ -82,76 +49,87 @@ class BybitTradeExporter:
         ).hexdigest()
         return signature
     
-    def _make_request(self, endpoint, params=None, max_retries=3):
-        """发送带重试机制的请求"""
-        timestamp = self._get_timestamp()
-        
-        if params is None:
-            params = {}
-        
+    def sign(self, method, endpoint, params, timestamp_ms):
+        """返回 (请求路径, 请求头)"""
         params_str = urlencode(sorted(params.items())) if params else ""
-        url = f"{self.base_url}/{endpoint}"
+        path = f"/{endpoint}"
         if params_str:
-            url += f"?{params_str}"
-        
-        signature = self._generate_signature(timestamp, params_str)
+            path += f"?{params_str}"
         
+        timestamp = str(timestamp_ms)
         headers = {
             'X-BAPI-API-KEY': self.api_key,
-            'X-BAPI-SIGN': signature,
+            'X-BAPI-SIGN': self._generate_signature(timestamp, params_str),
             'X-BAPI-TIMESTAMP': timestamp,
             'X-BAPI-RECV-WINDOW': str(self.recv_window),
             'Content-Type': 'application/json'
         }
+        return path, headers
+
+def decode_bybit_response(response):
+    """解析 Bybit 响应"""
+    try:
+        result = response_json(response)
+    except ValueError:
+        result = {}
+    code = result.get('retCode') if isinstance(result, dict) else None
+    
+    if code == 0 and response.status_code == 200:
+        return Decoded(OK, result.get('result', {}), None)
+    if code == 10002:
+        # 时间戳超出 recv_window
+        return Decoded(TIMESTAMP_ERROR, None, result.get('retMsg'))
+    if code in BYBIT_AUTH_ERROR_CODES:
+        return Decoded(AUTH_ERROR, None, result.get('retMsg'))
+    if code in BYBIT_RATE_LIMIT_CODES:
+        return Decoded(RATE_LIMITED, None, result.get('retMsg'))
+    if response.status_code == 200:
+        return Decoded(FAILED, None, f"API错误: {result.get('retMsg')}")
+    return decoded_http_status(response)
+
+class BybitTradeExporter:
+    """Bybit 交易记录导出器"""
+    
+    EXCHANGE = 'bybit'
+    
+    def __init__(self, api_key=None, secret_key=None, testnet=None, api_host=None):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        testnet = testnet if testnet is not None else False
+        self.base_url = "https://api-testnet.bybit.com" if testnet else "https://api.bybit.com"
+        if api_host:
+            # 自定义 API 主机（例如代理或本地模拟服务器）
+            self.base_url = api_host.rstrip('/')
+        self.instruments = get_instrument_cache('bybit', self.base_url)
+        self.auth_error_callback = None  # 认证失败时的回调，由账户管理设置
+        self.recv_window = 20000  # 20秒接收窗口
+        self.markets = tuple(BYBIT_CATEGORIES)
         
-        # 重试机制
-        for attempt in range(max_retries + 1):
-            try:
-                response = self.session.get(url, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get('retCode') == 0:
-                        return result.get('result', {})
-                    else:
-                        print(f"API错误: {result.get('retMsg')}")
-                        return None
-                elif response.status_code == 429:
-                    # 频率限制，等待更长时间
-                    wait_time = 2 ** attempt
-                    print(f"  ⏳ 请求频率限制，等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"HTTP错误: {response.status_code}")
-                    return None
-                    
-            except (requests.exceptions.SSLError, 
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.Timeout) as e:
-                
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt  # 指数退避
-                    print(f"  ⚠️  网络错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
-                    print(f"  ⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"❌ 网络请求错误: {e}")
-                    return None
-                    
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt
-                    print(f"  ⚠️  请求错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
-                    print(f"  ⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"❌ 请求错误: {e}")
-                    return None
-        
-        return None
+        # 通用请求层：连接池、时间同步、限频和重试均由 ExchangeClient 负责，每个市场一个客户端
+        self.market_clients = MarketClients('Bybit', self.markets, self._create_client)
+        self.client = self.market_clients.get(SPOT)
+        self.session = self.client.session
+        self.clock = self.client.clock
+    
+    def _create_client(self, market):
+        return ExchangeClient(
+            'bybit', self.base_url,
+            signer=BybitSigner(self.api_key, self.secret_key, self.recv_window),
+            decoder=decode_bybit_response,
+            # Bybit 的私有接口按账户限频，每个 API key 的每个市场单独一个限频器
+            rate_limiter=get_rate_limiter(('bybit', self.api_key, market), BYBIT_REQUESTS_PER_SECOND),
+            on_auth_error=self._report_auth_error
+        )
+    
+    def _report_auth_error(self):
+        """通知账户管理方认证失败（API密钥失效或权限不足）"""
+        print("❌ API 认证失败，请检查API密钥和权限")
+        if self.auth_error_callback:
+            self.auth_error_callback()
+    
+    def _make_request(self, endpoint, params=None, max_retries=3):
+        """发送带重试机制的请求"""
+        return self.client.request(endpoint, params, max_retries)
     
     def test_connection(self):
         """测试API连接和权限"""
@@ -174,45 +152,78 @@ class BybitTradeExporter:
             print(f"❌ Bybit API 权限测试失败: {e}")
             return False
     
-    def get_trades_for_day(self, symbol, date_str):
-        """获取指定日期的交易记录"""
-        try:
-            # 计算时间戳
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            start_time = int(date_obj.timestamp() * 1000)
-            end_time = int((date_obj + timedelta(days=1) - timedelta(seconds=1)).timestamp() * 1000)
-            
-            params = {
-                'category': 'spot',
-                'symbol': symbol.upper(),
-                'startTime': str(start_time),
-                'endTime': str(end_time),
-                'limit': '100'
-            }
-            
-            print(f"正在获取 {date_str} 00:00 到 {date_str} 23:59 的交易记录...")
-            
-            result = self._make_request("v5/execution/list", params)
-            
-            if result is None:
-                print("  这个时间段没有交易记录")
-                return []
-            
-            executions = result.get('list', [])
+    def get_symbol_info(self, symbol):
+        """获取交易对元数据（基础/计价货币、价格和数量精度），找不到时返回 None"""
+        return self.instruments.get(symbol, self.session)
+    
+    @staticmethod
+    def _market_symbol(symbol, market):
+        """交易对在各市场的写法：反向合约为 BTCUSD，其他市场与现货相同"""
+        if market == COINM:
+            base = inverse_base(symbol)
+            return f"{base}USD" if base else symbol.upper()
+        return symbol.upper()
+    
+    def iter_trade_pages(self, symbol, date_str, market=SPOT, before_request=None):
+        """逐页获取指定日期、指定市场的交易记录，每页一个已转换的列表（Bybit 按时间倒序返回）
+        
+        有 nextPageCursor 时用 cursor 继续翻页
+        
+        before_request() 在实际发出每一页的请求之前调用（后台同步用于全局限频）
+        """
+        client = self.market_clients.get(market)
+        start_time, end_time = day_window(date_str)
+        
+        params = {
+            'category': BYBIT_CATEGORIES[market],
+            'symbol': self._market_symbol(symbol, market),
+            'startTime': str(start_time),
+            'endTime': str(end_time),
+            'limit': str(PAGE_LIMIT)
+        }
+        page_number = 0
+        while True:
+            if before_request is not None:
+                before_request()
+            page_number += 1
+            with tracing.span('window', exchange='bybit', market=market, symbol=symbol, date=date_str,
+                              page=page_number) as window:
+                if page_number == 1:
+                    tracing.log(f"正在获取 {date_str} 00:00 到次日 00:00 的{market_label(market)}交易记录...")
+                result = client.request_or_raise("v5/execution/list", params)
+                executions = result.get('list') or []
+                if executions:
+                    # 转换为 Binance 兼容格式
+                    with tracing.span('convert', exchange='bybit', rows=len(executions)):
+                        converted_trades = self._convert_trades_to_binance_format(executions, symbol, market)
+                    window.set(trades=len(converted_trades))
             if not executions:
-                print("  这个时间段没有交易记录")
-                return []
-            
-            # 转换为 Binance 兼容格式
-            converted_trades = self._convert_trades_to_binance_format(executions, symbol)
-            print(f"  获取到 {len(converted_trades)} 条记录")
-            return converted_trades
-                
+                return
+            yield converted_trades
+            cursor = result.get('nextPageCursor')
+            if not cursor:
+                return
+            params = dict(params, cursor=cursor)
+    
+    def get_trades_for_day(self, symbol, date_str, market=SPOT):
+        """获取指定日期、指定市场的交易记录（按时间升序）"""
+        trades = []
+        try:
+            # 重试或翻页边界可能返回重复的成交
+            seen = DedupIndex()
+            for page in self.iter_trade_pages(symbol, date_str, market):
+                trades.extend(seen.filter(page, self.EXCHANGE))
         except Exception as e:
-            print(f"  获取 {date_str} 数据时出错: {e}")
-            return []
+            tracing.log(f"  获取 {date_str} 数据时出错: {e}")
+        
+        if trades:
+            trades.sort(key=trade_time)
+            tracing.log(f"  获取到 {len(trades)} 条记录")
+        else:
+            tracing.log("  这个时间段没有交易记录")
+        return trades
     
-    def _convert_trades_to_binance_format(self, bybit_trades, original_symbol):
+    def _convert_trades_to_binance_format(self, bybit_trades, original_symbol, market=SPOT):
         """将 Bybit 交易格式转换为 Binance 兼容格式"""
         converted_trades = []
         
@@ -222,6 +233,7 @@ class BybitTradeExporter:
                 'id': trade.get('execId', ''),
                 'orderId': trade.get('orderId', ''),
                 'symbol': original_symbol,
+                'market': market,
                 'time': trade.get('execTime', ''),
                 'isBuyer': trade.get('side', '').lower() == 'buy',
                 'isMaker': trade.get('execType', '') == 'Trade',  # Bybit uses 'Trade' for taker, 'AdlTrade'等 for maker
@@ -231,37 +243,41 @@ class BybitTradeExporter:
                 'commission': trade.get('execFee', '0'),
                 'commissionAsset': trade.get('feeCurrency', 'USDT')
             }
+            if market != SPOT:
+                converted_trade['instrument'] = trade.get('symbol', '')
+            if market == COINM:
+                # 反向合约的 execQty 是合约面值（美元），execValue 是对应的币数量
+                converted_trade['contracts'] = trade.get('execQty', '0')
+                converted_trade['qty'] = trade.get('execValue', '0')
+                converted_trade['quoteQty'] = trade.get('execQty', '0')
             converted_trades.append(converted_trade)
         
         return converted_trades
     
-    def get_all_trades_in_period(self, symbol, start_date, end_date):
-        """获取指定时间段内的所有交易记录"""
-        print(f"开始获取 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
-        
-        all_trades = []
-        current_date = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+    def iter_trades(self, symbol, start_date, end_date, market=SPOT):
+        """生成器：按时间顺序逐条产出指定时间段内、指定市场的交易记录，每次只在内存中保留一天
         
-        total_trades = 0
+        market 也可以是市场列表，各市场并发获取后按时间归并为一个流"""
+        if not isinstance(market, str):
+            yield from iter_market_trades(self, symbol, start_date, end_date, market)
+            return
+        # 相邻日窗口首尾重叠，跨天的重复成交在这里过滤
+        seen = new_dedup_index()
+        for date_str in iter_period_days(start_date, end_date):
+            yield from seen.filter(self.get_trades_for_day(symbol, date_str, market), self.EXCHANGE)
+            # 只有相邻两天之间会有重复，更早的键不再需要
+            seen.next_window()
+    
+    def get_all_trades_in_period(self, symbol, start_date, end_date, market=SPOT):
+        """获取指定时间段内的所有交易记录"""
+        tracing.log(f"开始获取 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
         
-        while current_date <= end_date_obj:
-            date_str = current_date.strftime('%Y-%m-%d')
-            day_trades = self.get_trades_for_day(symbol, date_str)
-            
-            if day_trades:
-                all_trades.extend(day_trades)
-                total_trades += len(day_trades)
-                print(f"  获取到 {len(day_trades)} 条记录，累计 {total_trades} 条")
-            
-            current_date += timedelta(days=1)
-            
-            # 添加延迟避免频率限制
-            time.sleep(0.2)
+        all_trades = list(self.iter_trades(symbol, start_date, end_date, market))
         
-        print(f"\n总共获取到 {len(all_trades)} 条交易记录")
+        tracing.log(f"\n总共获取到 {len(all_trades)} 条交易记录")
         
-        if all_trades:
+        # 静默模式下跳过统计输出，避免在服务端热路径上额外遍历一遍数据
+        if all_trades and not tracing.is_quiet():
             self._print_trade_summary(all_trades)
         
         return all_trades
@@ -288,51 +304,9 @@ class BybitTradeExporter:
         print(f"交易时间范围: {start_time.strftime('%Y-%m-%d %H:%M:%S')} 至 {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     def export_to_csv(self, trades, filename):
-        """导出交易记录到CSV文件"""
-        if not trades:
-            print("没有交易记录可导出")
-            return
-        
-        # 转换数据格式
-        formatted_trades = []
-        for trade in trades:
-            formatted_trade = {
-                '交易ID': trade['id'],
-                '订单ID': trade['orderId'],
-                '交易对': trade['symbol'],
-                '交易时间': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                '买卖方向': '买入' if trade['isBuyer'] else '卖出',
-                '价格': float(trade['price']),
-                '数量': float(trade['qty']),
-                '金额': float(trade['quoteQty']),
-                '手续费': float(trade['commission']),
-                '手续费资产': trade['commissionAsset'],
-                '是否maker': '是' if trade['isMaker'] else '否',
-                '原始时间戳': trade['time']
-            }
-            formatted_trades.append(formatted_trade)
-        
-        # 按时间排序
-        formatted_trades.sort(key=lambda x: x['原始时间戳'])
-        
-        # 写入CSV文件
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            fieldnames = list(formatted_trades[0].keys())
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            writer.writeheader()
-            for trade in formatted_trades:
-                writer.writerow(trade)
-        
-        print(f"✅ 交易记录已成功导出到: {filename}")
+        """导出交易记录到CSV文件，trades 可以是 iter_trades 返回的生成器"""
+        return trade_export.export_to_csv(trades, filename)
     
     def export_to_json(self, trades, filename):
-        """导出交易记录到JSON文件"""
-        if not trades:
-            print("没有交易记录可导出")
-            return
-        
-        with open(filename, 'w', encoding='utf-8') as jsonfile:
-            json.dump(trades, jsonfile, indent=2, ensure_ascii=False)
-        
-        print(f"✅ 交易记录已成功导出到: {filename}") 
\ No newline at end of file
+        """导出交易记录到JSON文件，trades 可以是 iter_trades 返回的生成器"""
+        return trade_export.export_to_json(trades, filename)
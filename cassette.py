@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+HTTP 录制/回放 (cassette) - 把交易所的真实响应录制到文件，之后离线回放
+用于离线、可重复地分析和回归测试 get_all_trades_in_period 及 Flask 路由
+
+录制时去掉签名、时间戳等易变参数，不保存请求头（API Key、签名都在请求头里），
+并把响应中出现的密钥替换为占位符。回放时按 (方法, 路径, 参数) 匹配，
+可以按原始耗时回放，也可以按倍速压缩或不等待
+
+使用方式:
+    # 环境变量（对整个进程生效）
+    TRADE_CASSETTE=slow_query.json TRADE_CASSETTE_MODE=record python app.py
+    TRADE_CASSETTE=slow_query.json TRADE_CASSETTE_MODE=replay TRADE_CASSETTE_SPEED=0 python app.py
+
+    # 代码中
+    with use_cassette('slow_query.json', mode='replay', speed=10):
+        exporter.get_all_trades_in_period(...)
+"""
+
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CASSETTE_VERSION = 1
+
+# 每次请求都会变化或含有密钥的查询参数，不参与匹配也不写入文件
+VOLATILE_PARAMS = ('signature', 'timestamp', 'recvWindow', 'sign')
+
+# 需要保留的响应头（限频相关），其余响应头不录制
+KEPT_RESPONSE_HEADERS = ('content-type', 'retry-after')
+KEPT_RESPONSE_HEADER_PREFIXES = ('x-mbx-used-weight', 'x-bapi-limit', 'x-ratelimit')
+
+SCRUBBED = '***'
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+
+class CassetteMiss(Exception):
+    """回放模式下找不到匹配的录制请求"""
+
+
+def normalize_url(url, params=None):
+    """去掉主机和易变参数，返回用于匹配的 '路径?排序后的参数'"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query.extend((k, str(v)) for k, v in params.items())
+    query = sorted((k, v) for k, v in query if k not in VOLATILE_PARAMS)
+    return f"{parts.path}?{urlencode(query)}" if query else parts.path
+
+
+class Cassette:
+    """一组录制的请求/响应"""
+
+    def __init__(self, path, mode=REPLAY, speed=1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"未知的 cassette 模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed  # 回放倍速: 1 为原始耗时，0 为不等待
+        self.interactions = []
+        self._secrets = set()
+        self._pending = defaultdict(deque)  # 回放: {(方法, 归一化URL): 未使用的录制}
+        self._lock = threading.Lock()
+        if mode == REPLAY:
+            self.load()
+
+    def add_secrets(self, *values):
+        """登记需要从录制内容中去除的值（API Key、Secret、Passphrase）"""
+        with self._lock:
+            self._secrets.update(v for v in values if v)
+
+    def _scrub(self, text):
+        for secret in self._secrets:
+            text = text.replace(secret, SCRUBBED)
+        return text
+
+    def _open(self, mode):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode + 't', encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    def load(self):
+        with self._open('r') as f:
+            data = json.load(f)
+        if data.get('version') != CASSETTE_VERSION:
+            raise ValueError(f"不支持的 cassette 版本: {data.get('version')}")
+        self.interactions = data['interactions']
+        self._pending.clear()
+        for interaction in self.interactions:
+            self._pending[(interaction['method'], interaction['url'])].append(interaction)
+
+    def save(self):
+        if self.mode != RECORD:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {
+                'version': CASSETTE_VERSION,
+                'recorded_at': datetime.now().isoformat(timespec='seconds'),
+                'interactions': list(self.interactions)
+            }
+        with self._open('w') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        print(f"📼 已录制 {len(data['interactions'])} 个请求到: {self.path}")
+
+    def record(self, method, url, params, response, elapsed):
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower() in KEPT_RESPONSE_HEADERS
+                   or k.lower().startswith(KEPT_RESPONSE_HEADER_PREFIXES)}
+        with self._lock:
+            self.interactions.append({
+                'method': method,
+                'url': self._scrub(normalize_url(url, params)),
+                'status': response.status_code,
+                'headers': headers,
+                'body': self._scrub(response.text),
+                'elapsed': round(elapsed, 4)
+            })
+
+    def play(self, method, url, params):
+        key = (method, self._scrub(normalize_url(url, params)))
+        with self._lock:
+            pending = self._pending.get(key)
+            if not pending:
+                raise CassetteMiss(f"cassette 中没有匹配的请求: {method} {key[1]}")
+            # 同一请求录制了多次时按顺序回放，最后一次重复使用
+            interaction = pending.popleft() if len(pending) > 1 else pending[0]
+
+        if self.speed and interaction['elapsed']:
+            time.sleep(interaction['elapsed'] / self.speed)
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response._content = interaction['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = url
+        return response
+
+
+# 当前生效的 cassette（进程级）
+_active = None
+
+
+def active_cassette():
+    return _active
+
+
+@contextmanager
+def use_cassette(path, mode=REPLAY, speed=1.0):
+    """在作用域内录制或回放所有交易所请求，录制模式在退出时保存"""
+    global _active
+    previous = _active
+    cassette = Cassette(path, mode, speed)
+    _active = cassette
+    try:
+        yield cassette
+    finally:
+        _active = previous
+        cassette.save()
+
+
+class CassetteSession:
+    """包装共享 session：有生效的 cassette 时录制或回放，否则直接透传"""
+
+    def __init__(self, session, secrets=()):
+        self._session = session
+        self._secrets = tuple(s for s in secrets if s)
+
+    def get(self, url, params=None, **kwargs):
+        cassette = _active
+        if cassette is None:
+            return self._session.get(url, params=params, **kwargs)
+
+        cassette.add_secrets(*self._secrets)
+        if cassette.mode == REPLAY:
+            return cassette.play('GET', url, params)
+
+        started = time.perf_counter()
+        response = self._session.get(url, params=params, **kwargs)
+        cassette.record('GET', url, params, response, time.perf_counter() - started)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+def install_from_env():
+    """按环境变量 TRADE_CASSETTE / TRADE_CASSETTE_MODE / TRADE_CASSETTE_SPEED 启用 cassette"""
+    global _active
+    path = os.environ.get('TRADE_CASSETTE')
+    if not path or _active is not None:
+        return _active
+    mode = os.environ.get('TRADE_CASSETTE_MODE', REPLAY)
+    _active = Cassette(path, mode, float(os.environ.get('TRADE_CASSETTE_SPEED', '1')))
+    if mode == RECORD:
+        atexit.register(_active.save)
+    print(f"📼 cassette {mode} 模式: {path}")
+    return _active
+
+
+install_from_env()
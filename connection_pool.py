@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+连接池注册表 - 同一交易所主机的所有导出器共享一个 requests.Session
+避免每个账户各自建立 TLS 连接池，并发请求可以复用已建立的连接
+"""
+
+import os
+import socket
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 每个主机的连接池大小（同时保持的最大连接数）
+POOL_SIZE = int(os.environ.get('EXCHANGE_POOL_SIZE', '50'))
+# 是否开启 TCP keep-alive 探测，防止空闲连接被中间设备断开
+TCP_KEEPALIVE = os.environ.get('EXCHANGE_TCP_KEEPALIVE', '1') != '0'
+KEEPALIVE_IDLE = int(os.environ.get('EXCHANGE_KEEPALIVE_IDLE', '60'))  # 空闲多久开始探测（秒）
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """开启 TCP keep-alive 的 HTTPAdapter"""
+
+    def __init__(self, *args, tcp_keepalive=TCP_KEEPALIVE, keepalive_idle=KEEPALIVE_IDLE, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        self.keepalive_idle = keepalive_idle
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            socket_options = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle))
+            kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def host_key(base_url):
+    """连接池按 scheme://host 共享"""
+    parsed = urlparse(base_url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def create_session(pool_size=POOL_SIZE, tcp_keepalive=TCP_KEEPALIVE):
+    """创建带连接重试和连接池的 requests session"""
+    session = requests.Session()
+
+    # 连接层只重试建立连接失败的情况；按状态码的重试、限频等待和重试预算
+    # 由 exchange_client.ExchangeClient 统一处理，避免两层叠加重试
+    retry_strategy = Retry(
+        total=2,
+        connect=2,
+        read=0,
+        status=0,
+        backoff_factor=0.5,
+        allowed_methods=["HEAD", "GET", "OPTIONS"]  # 允许重试的HTTP方法
+    )
+
+    adapter = KeepAliveAdapter(
+        max_retries=retry_strategy,
+        pool_connections=1,  # 每个 session 只对应一个主机
+        pool_maxsize=pool_size,
+        tcp_keepalive=tcp_keepalive
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+# 进程级连接池注册表: {scheme://host: Session}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_shared_session(base_url, pool_size=None):
+    """获取主机对应的共享 session，首次调用时创建"""
+    key = host_key(base_url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = create_session(pool_size or POOL_SIZE)
+                _sessions[key] = session
+    return session
+
+
+def release_session(base_url):
+    """关闭并移除主机对应的共享 session"""
+    with _sessions_lock:
+        session = _sessions.pop(host_key(base_url), None)
+    if session is not None:
+        session.close()
+
+
+def close_all_sessions():
+    """关闭所有共享 session（进程退出时调用）"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
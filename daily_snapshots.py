@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+每日持仓与盈亏快照 - 按 (交易所, 账户, 交易对, 日期) 物化的聚合结果
+每次查询到新成交时增量更新，时间序列查询只需读取几百行，不必重新处理全部成交
+
+每行包含: 买入/卖出数量和金额、按资产统计的手续费、当日已实现盈亏（逐笔持仓匹配）、
+收盘持仓和持仓均价。数据保存在 TRADE_CACHE_DIR 下的 SQLite 文件中
+
+account 列保存账户的凭证指纹（account_validation.credential_fingerprint）而不是用户起的账户名：
+不同会话中同名的账户不会混在一起，同一个交易所账户在不同会话中共用快照；读取时由调用方
+限定为自己会话中的账户，并把指纹换回账户名。
+
+非现货市场的成交记在 '交易对@市场'（例如 BTCUSDT@usdm）下，与现货持仓分开计算。
+成交按 (交易所, 账户, 交易对, 交易ID) 去重保存；收到早于已处理进度的成交（补查历史区间）时，
+该账户交易对会从已保存的成交重新计算
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from instrument_cache import CACHE_DIR, split_symbol
+from markets import MARKETS, market_symbol, split_market_symbol
+from lot_matching import FIFO, METHODS, Position, fee_in_quote
+
+SNAPSHOT_DB = os.environ.get('TRADE_SNAPSHOT_DB', os.path.join(CACHE_DIR, 'daily_snapshots.sqlite3'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fills (
+    exchange TEXT NOT NULL,
+    account TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    trade_id TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    is_buyer INTEGER NOT NULL,
+    qty REAL NOT NULL,
+    price REAL NOT NULL,
+    quote_qty REAL NOT NULL,
+    commission REAL NOT NULL,
+    commission_asset TEXT,
+    PRIMARY KEY (exchange, account, symbol, trade_id)
+);
+CREATE INDEX IF NOT EXISTS fills_by_time ON fills (exchange, account, symbol, time);
+
+CREATE TABLE IF NOT EXISTS daily_snapshots (
+    exchange TEXT NOT NULL,
+    account TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    day TEXT NOT NULL,
+    trade_count INTEGER NOT NULL,
+    buy_qty REAL NOT NULL,
+    sell_qty REAL NOT NULL,
+    buy_notional REAL NOT NULL,
+    sell_notional REAL NOT NULL,
+    fees_by_asset TEXT NOT NULL,
+    realized_pnl REAL NOT NULL,
+    close_position REAL NOT NULL,
+    avg_cost REAL NOT NULL,
+    PRIMARY KEY (exchange, account, symbol, day)
+);
+
+CREATE TABLE IF NOT EXISTS snapshot_state (
+    exchange TEXT NOT NULL,
+    account TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    last_time INTEGER NOT NULL,
+    last_id TEXT NOT NULL,
+    position TEXT NOT NULL,
+    PRIMARY KEY (exchange, account, symbol)
+);
+"""
+
+SNAPSHOT_FIELDS = ['exchange', 'account', 'symbol', 'day', 'trade_count', 'buy_qty', 'sell_qty',
+                   'buy_notional', 'sell_notional', 'fees_by_asset', 'realized_pnl',
+                   'close_position', 'avg_cost']
+
+
+def _day_of(time_ms):
+    return datetime.fromtimestamp(time_ms / 1000).strftime('%Y-%m-%d')
+
+
+def _fill_from_trade(key, trade):
+    return (key[0], key[1], key[2], str(trade['id']), int(trade['time']), 1 if trade['isBuyer'] else 0,
+            float(trade['qty']), float(trade['price']), float(trade.get('quoteQty') or 0),
+            float(trade.get('commission') or 0), trade.get('commissionAsset'))
+
+
+class DailySnapshotStore:
+    """每日快照存储，cost_method 决定已实现盈亏的成本计算方法"""
+
+    def __init__(self, path=SNAPSHOT_DB, cost_method=FIFO):
+        if cost_method not in METHODS:
+            raise ValueError(f"未知的成本计算方法: {cost_method}")
+        self.path = path
+        self.cost_method = cost_method
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # 多个 worker 进程同时写入时等待锁，而不是立即报错
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def update(self, trades, account_keys=None):
+        """写入新成交并更新受影响日期的快照，返回新写入的成交数
+        account_keys: {账户名: 凭证指纹}，快照按指纹保存（不在其中的账户按账户名保存）"""
+        account_keys = account_keys or {}
+        groups = defaultdict(list)
+        for trade in trades:
+            # 同一交易对的现货、杠杆和合约持仓分别计算
+            account_name = trade.get('account_name', '')
+            key = (trade.get('exchange', 'unknown'), account_keys.get(account_name, account_name),
+                   market_symbol(trade['symbol'], trade.get('market', 'spot')))
+            groups[key].append(trade)
+
+        inserted = 0
+        with self._lock, self._conn:
+            for key, group in groups.items():
+                inserted += self._update_key(key, group)
+        return inserted
+
+    def _update_key(self, key, trades):
+        new_fills = []
+        for trade in trades:
+            fill = _fill_from_trade(key, trade)
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO fills VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", fill)
+            if cursor.rowcount:
+                new_fills.append(fill)
+        if not new_fills:
+            return 0
+
+        new_fills.sort(key=lambda f: (f[4], f[3]))
+        state = self._conn.execute(
+            "SELECT last_time, last_id, position FROM snapshot_state WHERE exchange=? AND account=? AND symbol=?",
+            key).fetchone()
+
+        if state is not None and (new_fills[0][4], new_fills[0][3]) <= (state['last_time'], state['last_id']):
+            # 补查到了更早的成交，持仓状态失效，按已保存的全部成交重新计算
+            self._conn.execute("DELETE FROM daily_snapshots WHERE exchange=? AND account=? AND symbol=?", key)
+            fills = self._conn.execute(
+                "SELECT * FROM fills WHERE exchange=? AND account=? AND symbol=? ORDER BY time, trade_id",
+                key).fetchall()
+            self._apply(key, [tuple(f) for f in fills], Position(self.cost_method))
+        else:
+            position = (Position.from_state(self.cost_method, json.loads(state['position']))
+                        if state is not None else Position(self.cost_method))
+            self._apply(key, new_fills, position)
+        return len(new_fills)
+
+    def _apply(self, key, fills, position):
+        """按时间顺序把成交应用到持仓上，汇总到每日快照"""
+        base_asset, quote_asset = split_symbol(split_market_symbol(key[2])[0]) or (None, None)
+        days = {}
+        for _, _, _, trade_id, time_ms, is_buyer, qty, price, quote_qty, commission, asset in fills:
+            day = _day_of(time_ms)
+            row = days.get(day)
+            if row is None:
+                row = days[day] = self._load_day(key, day)
+
+            trade = {'price': price, 'commission': commission, 'commissionAsset': asset}
+            fee, unconverted_asset = fee_in_quote(trade, quote_asset, base_asset)
+            if unconverted_asset:
+                position.unconverted_fees[unconverted_asset] = (
+                    position.unconverted_fees.get(unconverted_asset, 0.0) + commission)
+            _, pnl = position.apply(bool(is_buyer), qty, price, fee)
+
+            side = 'buy' if is_buyer else 'sell'
+            row['trade_count'] += 1
+            row[f'{side}_qty'] += qty
+            row[f'{side}_notional'] += quote_qty or qty * price
+            if commission:
+                row['fees_by_asset'][asset] = row['fees_by_asset'].get(asset, 0.0) + commission
+            row['realized_pnl'] += pnl
+            row['close_position'] = position.qty
+            row['avg_cost'] = position.avg_cost
+
+        for day, row in days.items():
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO daily_snapshots VALUES ({', '.join('?' * len(SNAPSHOT_FIELDS))})",
+                [json.dumps(row[f]) if f == 'fees_by_asset' else row[f] for f in SNAPSHOT_FIELDS])
+
+        last = fills[-1]
+        self._conn.execute(
+            "INSERT OR REPLACE INTO snapshot_state VALUES (?, ?, ?, ?, ?, ?)",
+            key + (last[4], last[3], json.dumps(position.to_state())))
+
+    def _load_day(self, key, day):
+        row = self._conn.execute(
+            "SELECT * FROM daily_snapshots WHERE exchange=? AND account=? AND symbol=? AND day=?",
+            key + (day,)).fetchone()
+        if row is not None:
+            row = dict(row)
+            row['fees_by_asset'] = json.loads(row['fees_by_asset'])
+            return row
+        return {
+            'exchange': key[0], 'account': key[1], 'symbol': key[2], 'day': day,
+            'trade_count': 0, 'buy_qty': 0.0, 'sell_qty': 0.0, 'buy_notional': 0.0, 'sell_notional': 0.0,
+            'fees_by_asset': {}, 'realized_pnl': 0.0, 'close_position': 0.0, 'avg_cost': 0.0
+        }
+
+    def query(self, accounts=None, symbol=None, exchange=None, start_day=None, end_day=None, markets=None):
+        """按条件查询每日快照，按日期排序；accounts 为账户键（凭证指纹）列表，None 表示不限
+        symbol 为不带市场后缀的交易对，markets 为市场列表（None 表示全部市场）；
+        返回的每行 symbol 为交易对、market 为市场"""
+        if accounts is not None and not accounts:
+            return []
+        markets = tuple(markets or MARKETS)
+        conditions = []
+        params = []
+        if accounts is not None:
+            conditions.append(f"account IN ({', '.join('?' * len(accounts))})")
+            params.extend(accounts)
+        if symbol:
+            keys = [market_symbol(symbol, market) for market in markets]
+            conditions.append(f"symbol IN ({', '.join('?' * len(keys))})")
+            params.extend(keys)
+        if exchange:
+            conditions.append("exchange = ?")
+            params.append(exchange)
+        if start_day:
+            conditions.append("day >= ?")
+            params.append(start_day)
+        if end_day:
+            conditions.append("day <= ?")
+            params.append(end_day)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM daily_snapshots {where} ORDER BY day, exchange, account, symbol",
+                params).fetchall()
+        snapshots = []
+        for row in rows:
+            snapshot = dict(row)
+            snapshot['symbol'], snapshot['market'] = split_market_symbol(snapshot['symbol'])
+            if snapshot['market'] not in markets:
+                continue
+            snapshot['fees_by_asset'] = json.loads(snapshot['fees_by_asset'])
+            snapshots.append(snapshot)
+        return snapshots
+
+    def clear(self, account=None):
+        """删除某个账户键（或全部）的快照和成交"""
+        with self._lock, self._conn:
+            for table in ('fills', 'daily_snapshots', 'snapshot_state'):
+                if account is None:
+                    self._conn.execute(f"DELETE FROM {table}")
+                else:
+                    self._conn.execute(f"DELETE FROM {table} WHERE account = ?", (account,))
+
+
+# 进程级共享实例
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DailySnapshotStore()
+    return _store
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+交易所通用请求层 - 连接池、限频、重试预算、指标和并发只实现一次
+各交易所只需要提供签名器 (signer) 和响应解码器 (decoder)
+
+签名器: 实现 sign(method, endpoint, params, timestamp_ms) -> (path, headers)，
+        完整 URL 为 base_url + path
+解码器: decode(response) -> Decoded，把交易所的响应归类为下面几种结果之一
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+# requests、连接池、cassette 和时间同步在创建第一个 ExchangeClient 时才导入，
+# 只用到限频器和指标的模块（Web 路由、Prometheus 指标）不必加载网络依赖
+
+# 解码结果分类
+OK = 'ok'                      # 成功，payload 为数据
+AUTH_ERROR = 'auth_error'      # 认证失败，不重试
+TIMESTAMP_ERROR = 'timestamp'  # 时间戳被拒绝，重新同步时间后重试
+RATE_LIMITED = 'rate_limited'  # 触发限频，等待后重试
+RETRYABLE = 'retryable'        # 服务端临时错误，退避后重试
+FAILED = 'failed'              # 其他错误，不重试
+
+Decoded = namedtuple('Decoded', ['outcome', 'payload', 'message'])
+
+
+class RequestFailed(Exception):
+    """请求最终失败（网络错误、认证失败、重试用尽等）"""
+
+
+def decoded_http_status(response):
+    """按 HTTP 状态码归类（各解码器处理完交易所自己的错误码后调用）"""
+    if response.status_code in (401, 403):
+        return Decoded(AUTH_ERROR, None, f"HTTP {response.status_code}")
+    if response.status_code in (418, 429):
+        return Decoded(RATE_LIMITED, None, f"HTTP {response.status_code}")
+    if response.status_code >= 500:
+        return Decoded(RETRYABLE, None, f"HTTP {response.status_code}")
+    return Decoded(FAILED, None, f"HTTP 错误: {response.status_code}")
+
+
+class RateLimiter:
+    """令牌桶限频器，可被多个账户共享"""
+
+    def __init__(self, rate, burst=1, key=None):
+        self.rate = rate  # 每秒令牌数
+        self.burst = burst
+        self.key = key  # 注册表中的键，None 表示未注册
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，必要时等待，返回等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # 令牌不足时按欠额计算等待时间，预约后续的时间片
+            wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """触发限频后，让所有共享者暂停一段时间"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RetryBudget:
+    """重试预算：重试次数不超过请求数的一定比例，防止故障时重试风暴"""
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, capacity=20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """每个请求都会为预算增加 ratio 个令牌"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """尝试消耗一次重试，预算不足时返回 False"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class ClientMetrics:
+    """请求指标，按 (交易所, 接口) 汇总，并通知已注册的观察者"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._observers = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)    # {(exchange, endpoint, outcome): 次数}
+            self.latency = defaultdict(float)   # {(exchange, endpoint): 累计耗时}
+            self.retries = defaultdict(int)     # {(exchange, reason): 次数}
+            self.wait_seconds = defaultdict(float)  # {(exchange, reason): 累计等待}
+
+    def add_observer(self, observer):
+        """observer(event, **fields)，event 为 'request' / 'retry' / 'wait'"""
+        self._observers.append(observer)
+
+    def _notify(self, event, **fields):
+        for observer in self._observers:
+            try:
+                observer(event, **fields)
+            except Exception:
+                pass
+
+    def record_request(self, exchange, endpoint, outcome, latency, status_code=None):
+        with self._lock:
+            self.requests[(exchange, endpoint, outcome)] += 1
+            self.latency[(exchange, endpoint)] += latency
+        self._notify('request', exchange=exchange, endpoint=endpoint, outcome=outcome,
+                     latency=latency, status_code=status_code)
+
+    def record_retry(self, exchange, endpoint, reason):
+        with self._lock:
+            self.retries[(exchange, reason)] += 1
+        self._notify('retry', exchange=exchange, endpoint=endpoint, reason=reason)
+
+    def record_wait(self, exchange, seconds, reason):
+        if seconds <= 0:
+            return
+        with self._lock:
+            self.wait_seconds[(exchange, reason)] += seconds
+        self._notify('wait', exchange=exchange, seconds=seconds, reason=reason)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'latency': dict(self.latency),
+                'retries': dict(self.retries),
+                'wait_seconds': dict(self.wait_seconds),
+            }
+
+
+# 进程级指标
+metrics = ClientMetrics()
+
+# 进程级共享状态: 限频器、重试预算、主机并发槽
+_rate_limiters = {}
+_retry_budgets = {}
+_host_slots = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(registry, key, factory):
+    item = registry.get(key)
+    if item is None:
+        with _registry_lock:
+            item = registry.get(key)
+            if item is None:
+                item = factory()
+                registry[key] = item
+    return item
+
+
+def get_rate_limiter(key, rate, burst=1):
+    """获取共享限频器，key 决定共享范围（按主机或按账户）"""
+    return _get_or_create(_rate_limiters, key, lambda: RateLimiter(rate, burst, key))
+
+
+def release_rate_limiter(key):
+    """从注册表移除限频器（账户被清理后不再保留按账户的限频状态）"""
+    with _registry_lock:
+        _rate_limiters.pop(key, None)
+
+
+def get_retry_budget(base_url):
+    return _get_or_create(_retry_budgets, base_url, RetryBudget)
+
+
+def get_host_slots(base_url):
+    """同一主机同时进行的请求数不超过连接池大小"""
+    from connection_pool import POOL_SIZE
+    return _get_or_create(_host_slots, base_url, lambda: threading.BoundedSemaphore(POOL_SIZE))
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """带抖动的指数退避"""
+    return min(cap, base * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+def run_concurrently(func, items, max_workers=8):
+    """并发执行 func(item)，按输入顺序返回结果，异常原样作为结果返回"""
+    items = list(items)
+    if not items:
+        return []
+    if max_workers <= 1 or len(items) == 1:
+        results = []
+        for item in items:
+            try:
+                results.append(func(item))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        # 线程池中的任务继承当前追踪上下文
+        futures = [executor.submit(tracing.wrap_context(func), item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class ExchangeClient:
+    """单个账户的交易所客户端，负责签名请求的发送、重试和指标记录"""
+
+    def __init__(self, exchange, base_url, signer, decoder, rate_limiter=None,
+                 on_auth_error=None, timeout=30, clock=None):
+        self.exchange = exchange
+        self.base_url = base_url
+        self.signer = signer
+        self.decoder = decoder
+        self.rate_limiter = rate_limiter
+        self.on_auth_error = on_auth_error
+        self.timeout = timeout
+
+        import requests
+        from cassette import CassetteSession
+        from connection_pool import get_shared_session
+        from time_sync import get_server_clock
+
+        self._network_error = requests.exceptions.RequestException
+        # 共享 session 外包一层 cassette，便于录制/回放（未启用时直接透传）
+        self.session = CassetteSession(
+            get_shared_session(base_url),
+            secrets=[getattr(signer, name, None) for name in ('api_key', 'secret_key', 'passphrase')]
+        )
+        # 没有时间接口的路径前缀（例如 Binance /sapi）可以沿用同一主机其他客户端的时钟
+        self.clock = clock or get_server_clock(exchange, base_url)
+        self.retry_budget = get_retry_budget(base_url)
+        self.host_slots = get_host_slots(base_url)
+
+    def _retry_wait(self, endpoint, attempt, reason, wait_time):
+        metrics.record_retry(self.exchange, endpoint, reason)
+        metrics.record_wait(self.exchange, wait_time, reason)
+        time.sleep(wait_time)
+
+    def request(self, endpoint, params=None, max_retries=3):
+        """发送签名 GET 请求，成功时返回解码后的数据，失败返回 None"""
+        params = dict(params or {})
+
+        for attempt in range(max_retries + 1):
+            can_retry = attempt < max_retries
+
+            if self.rate_limiter is not None:
+                metrics.record_wait(self.exchange, self.rate_limiter.acquire(), 'rate_limit')
+
+            # 每次尝试都用校正后的服务器时间重新签名
+            path, headers = self.signer.sign('GET', endpoint, params, self.clock.now_ms(self.session))
+
+            started = time.perf_counter()
+            try:
+                with tracing.span('http', exchange=self.exchange, endpoint=endpoint, attempt=attempt) as http_span:
+                    with self.host_slots:
+                        response = self.session.get(f"{self.base_url}{path}", headers=headers, timeout=self.timeout)
+                    http_span.set(status=response.status_code, bytes=len(response.content))
+            except self._network_error as e:
+                metrics.record_request(self.exchange, endpoint, 'network_error', time.perf_counter() - started)
+                if can_retry and self.retry_budget.withdraw():
+                    wait_time = backoff_delay(attempt)
+                    tracing.log(f"  ⚠️  网络错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
+                    tracing.log(f"  ⏳ 等待 {wait_time:.1f} 秒后重试...")
+                    self._retry_wait(endpoint, attempt, 'network_error', wait_time)
+                    continue
+                tracing.log(f"❌ 网络请求错误: {e}")
+                return None
+
+            try:
+                decoded = self.decoder(response)
+            except ValueError as e:
+                decoded = Decoded(FAILED, None, f"响应解析失败: {e}")
+
+            metrics.record_request(self.exchange, endpoint, decoded.outcome,
+                                   time.perf_counter() - started, response.status_code)
+            self.retry_budget.deposit()
+
+            if decoded.outcome == OK:
+                return decoded.payload
+
+            if decoded.outcome == AUTH_ERROR:
+                if self.on_auth_error:
+                    self.on_auth_error()
+                return None
+
+            if decoded.outcome == TIMESTAMP_ERROR and can_retry:
+                tracing.log("  ⏳ 本地时间与服务器不同步，重新同步后重试...")
+                metrics.record_retry(self.exchange, endpoint, 'timestamp')
+                self.clock.invalidate()
+                continue
+
+            if decoded.outcome == RATE_LIMITED and can_retry:
+                retry_after = response.headers.get('Retry-After')
+                wait_time = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                tracing.log(f"  ⏳ 请求频率限制，等待 {wait_time:.0f} 秒后重试...")
+                if self.rate_limiter is not None:
+                    self.rate_limiter.pause(wait_time)
+                self._retry_wait(endpoint, attempt, 'rate_limited', wait_time)
+                continue
+
+            if decoded.outcome == RETRYABLE and can_retry and self.retry_budget.withdraw():
+                wait_time = backoff_delay(attempt)
+                tracing.log(f"  ⚠️  请求错误 (尝试 {attempt + 1}/{max_retries + 1}): {decoded.message}")
+                tracing.log(f"  ⏳ 等待 {wait_time:.1f} 秒后重试...")
+                self._retry_wait(endpoint, attempt, 'server_error', wait_time)
+                continue
+
+            tracing.log(f"❌ {self.exchange} 请求失败: {decoded.message}")
+            return None
+
+        return None
+
+    def request_or_raise(self, endpoint, params=None, max_retries=3):
+        """同 request，失败时抛出 RequestFailed；翻页获取成交时不能把失败当作没有更多数据"""
+        payload = self.request(endpoint, params, max_retries)
+        if payload is None:
+            raise RequestFailed(f"{self.exchange} {endpoint} 请求失败")
+        return payload
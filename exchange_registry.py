@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+交易所插件注册表 - 交易所名称 -> 导出器类的位置和展示信息
+
+导出器模块（连同 requests / urllib3 等网络依赖）在第一次创建该交易所的账户时才导入，
+Web worker 启动时不加载任何交易所模块。新增交易所只需在这里（或启动代码中）调用 register_exchange，
+路由和分析器按注册表分发，不需要修改
+
+导出器类需要接受关键字参数 api_key、secret_key、testnet、api_host，
+requires_passphrase=True 的交易所还需接受 passphrase
+"""
+
+import importlib
+import threading
+
+DEFAULT_VALIDATION_HINT = '请检查API密钥'
+
+
+class ExchangePlugin:
+    """一个交易所：target 为 '模块:类名'，首次使用时导入"""
+
+    def __init__(self, name, target, label, requires_passphrase=False, validation_hint=DEFAULT_VALIDATION_HINT):
+        self.name = name
+        self.module_name, self.class_name = target.split(':')
+        self.label = label
+        self.requires_passphrase = requires_passphrase
+        self.validation_hint = validation_hint
+        self._exporter_class = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._exporter_class is not None
+
+    @property
+    def exporter_class(self):
+        if self._exporter_class is None:
+            with self._lock:
+                if self._exporter_class is None:
+                    module = importlib.import_module(self.module_name)
+                    self._exporter_class = getattr(module, self.class_name)
+        return self._exporter_class
+
+    def create_exporter(self, api_key, secret_key, passphrase=None, testnet=False, api_host=None):
+        """创建导出器（不做网络请求）"""
+        kwargs = {'api_key': api_key, 'secret_key': secret_key, 'testnet': testnet, 'api_host': api_host}
+        if self.requires_passphrase:
+            kwargs['passphrase'] = passphrase
+        return self.exporter_class(**kwargs)
+
+
+_plugins = {}
+
+
+def register_exchange(name, target, label, requires_passphrase=False, validation_hint=DEFAULT_VALIDATION_HINT):
+    """注册（或替换）一个交易所插件"""
+    _plugins[name] = ExchangePlugin(name, target, label, requires_passphrase, validation_hint)
+    return _plugins[name]
+
+
+def get_plugin(exchange):
+    """返回交易所插件，未注册时返回 None"""
+    return _plugins.get(exchange)
+
+
+def exchange_names():
+    return list(_plugins)
+
+
+def create_exporter(exchange, api_key, secret_key, passphrase=None, testnet=False, api_host=None):
+    """按交易所名称创建导出器，未注册的交易所抛出 ValueError"""
+    plugin = _plugins.get(exchange)
+    if plugin is None:
+        raise ValueError(f"不支持的交易所: {exchange}")
+    return plugin.create_exporter(api_key, secret_key, passphrase, testnet, api_host)
+
+
+register_exchange('binance', 'binance_exporter:BinanceTradeExporter', 'Binance')
+register_exchange('okx', 'okx_exporter:OKXTradeExporter', 'OKX', requires_passphrase=True,
+                  validation_hint='请检查API密钥和密码')
+register_exchange('bybit', 'bybit_exporter:BybitTradeExporter', 'Bybit')
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+手续费归一化 - 把各种 commissionAsset（BNB、OKB、基础货币等）的手续费折算为交易对的计价货币
+
+先遍历一遍成交，收集需要的 (交易所, 资产, 计价货币, K线时间桶)，
+再按交易所的单次返回上限把时间桶合并成尽量少的 K 线请求，结果按 (交易所, 交易对, 周期)
+缓存到磁盘（已收盘的 K 线不会变化，缓存不过期）。最后再遍历一遍成交，按时间桶查表折算
+
+折算结果写入每条成交的 commissionQuote 字段，无法折算时为 None
+"""
+
+import json
+import os
+import threading
+import time
+
+from cassette import CassetteSession
+from connection_pool import get_shared_session
+from exchange_client import get_rate_limiter
+from instrument_cache import CACHE_DIR, split_symbol
+from json_backend import response_json
+
+KLINE_CACHE_DIR = os.path.join(CACHE_DIR, 'klines')
+KLINE_REQUESTS_PER_SECOND = 5  # 公共行情接口的请求频率（每个交易所）
+
+# 每个周期的毫秒数
+INTERVAL_MS = {'1m': 60 * 1000, '1h': 3600 * 1000}
+
+# 公共行情接口的默认主机
+KLINE_HOSTS = {
+    'binance': 'https://api.binance.com/api/v3',
+    'okx': 'https://www.okx.com',
+    'bybit': 'https://api.bybit.com',
+}
+
+
+def _fetch_binance_klines(session, base_url, base, quote, interval, start_ms, end_ms):
+    """Binance: GET /api/v3/klines，单次最多 1000 根"""
+    response = session.get(f"{base_url}/klines", params={
+        'symbol': f"{base}{quote}", 'interval': interval,
+        'startTime': start_ms, 'endTime': end_ms, 'limit': 1000
+    }, timeout=30)
+    response.raise_for_status()
+    return {int(k[0]): float(k[4]) for k in response_json(response)}
+
+
+def _fetch_okx_klines(session, base_url, base, quote, interval, start_ms, end_ms):
+    """OKX: GET /api/v5/market/history-candles，单次最多 100 根，after/before 为开区间"""
+    response = session.get(f"{base_url}/api/v5/market/history-candles", params={
+        'instId': f"{base}-{quote}", 'bar': {'1m': '1m', '1h': '1H'}[interval],
+        'after': end_ms + 1, 'before': start_ms - 1, 'limit': 100
+    }, timeout=30)
+    response.raise_for_status()
+    result = response_json(response)
+    if result.get('code') != '0':
+        raise ValueError(result.get('msg', 'Unknown error'))
+    return {int(k[0]): float(k[4]) for k in result['data']}
+
+
+def _fetch_bybit_klines(session, base_url, base, quote, interval, start_ms, end_ms):
+    """Bybit: GET /v5/market/kline，单次最多 1000 根"""
+    response = session.get(f"{base_url}/v5/market/kline", params={
+        'category': 'spot', 'symbol': f"{base}{quote}", 'interval': {'1m': '1', '1h': '60'}[interval],
+        'start': start_ms, 'end': end_ms, 'limit': 1000
+    }, timeout=30)
+    response.raise_for_status()
+    result = response_json(response)
+    if result.get('retCode') != 0:
+        raise ValueError(result.get('retMsg', 'Unknown error'))
+    return {int(k[0]): float(k[4]) for k in result['result']['list']}
+
+
+# 交易所 -> (K线获取函数, 单次请求的最大根数)
+KLINE_FETCHERS = {
+    'binance': (_fetch_binance_klines, 1000),
+    'okx': (_fetch_okx_klines, 100),
+    'bybit': (_fetch_bybit_klines, 1000),
+}
+
+
+def plan_requests(buckets, interval_ms, max_candles):
+    """把需要的时间桶合并为最少的 [start, end] 请求区间（贪心覆盖）"""
+    windows = []
+    window_end = None
+    for bucket in sorted(buckets):
+        if window_end is not None and bucket <= window_end:
+            continue
+        window_end = bucket + (max_candles - 1) * interval_ms
+        windows.append((bucket, window_end))
+    return windows
+
+
+class KlineCache:
+    """单个 (交易所, 交易对, 周期) 的收盘价缓存: {时间桶: 收盘价或 None}"""
+
+    def __init__(self, exchange, base, quote, interval, cache_dir=None):
+        self.cache_file = os.path.join(cache_dir or KLINE_CACHE_DIR,
+                                       f"{exchange}_{base}{quote}_{interval}.json")
+        self.prices = {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.prices = {int(k): v for k, v in json.load(f).items()}
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.prices, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"⚠️ 无法写入K线缓存 {self.cache_file}: {e}")
+
+
+class FeeNormalizer:
+    """批量把成交的手续费折算为计价货币"""
+
+    def __init__(self, interval='1h', base_urls=None, cache_dir=None):
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"不支持的K线周期: {interval}，可选: {', '.join(INTERVAL_MS)}")
+        self.interval = interval
+        self.interval_ms = INTERVAL_MS[interval]
+        self.base_urls = dict(KLINE_HOSTS, **(base_urls or {}))
+        self.cache_dir = cache_dir
+        self.requests_made = 0
+        self._lock = threading.Lock()
+
+    def _fetch_prices(self, exchange, base, quote, buckets):
+        """返回 {时间桶: 收盘价}，优先读磁盘缓存，只请求缺失的时间桶"""
+        cache = KlineCache(exchange, base, quote, self.interval, self.cache_dir)
+        missing = [b for b in buckets if b not in cache.prices]
+        if not missing:
+            return cache.prices
+
+        fetcher, max_candles = KLINE_FETCHERS[exchange]
+        base_url = self.base_urls[exchange]
+        session = CassetteSession(get_shared_session(base_url))
+        limiter = get_rate_limiter(('klines', exchange), KLINE_REQUESTS_PER_SECOND)
+        prices = dict(cache.prices)
+        for start_ms, end_ms in plan_requests(missing, self.interval_ms, max_candles):
+            limiter.acquire()
+            with self._lock:
+                self.requests_made += 1
+            prices.update(fetcher(session, base_url, base, quote, self.interval, start_ms, end_ms))
+
+        # 已收盘但没有数据的时间桶（未上线、停牌）记为 None，避免重复请求；
+        # 未收盘的 K 线价格还会变化，不写入磁盘
+        now_ms = int(time.time() * 1000)
+        open_bucket = now_ms - now_ms % self.interval_ms
+        for bucket in missing:
+            if bucket not in prices and bucket < open_bucket:
+                prices[bucket] = None
+        cache.prices = {b: p for b, p in prices.items() if b < open_bucket}
+        cache.save()
+        return prices
+
+    def _prices_for_pair(self, exchange, asset, quote, buckets):
+        """获取 asset/quote 的价格；没有该交易对时尝试反向交易对 quote/asset"""
+        try:
+            return self._fetch_prices(exchange, asset, quote, buckets)
+        except Exception as e:
+            direct_error = e
+        try:
+            inverse = self._fetch_prices(exchange, quote, asset, buckets)
+            return {b: (1 / p if p else None) for b, p in inverse.items()}
+        except Exception:
+            print(f"⚠️ 无法获取 {exchange} {asset}/{quote} 的K线: {direct_error}")
+            return {}
+
+    def normalize(self, trades):
+        """为每条成交写入 commissionQuote，返回按计价货币汇总的手续费和无法折算的部分"""
+        symbol_assets = {}
+        needs = {}     # {(交易所, 资产, 计价货币): {时间桶}}
+        pending = []   # [(成交, 需求键, 时间桶, 手续费)]
+
+        # 第一遍: 直接可折算的手续费，同时收集需要的 K 线
+        for trade in trades:
+            symbol = trade['symbol']
+            assets = symbol_assets.get(symbol)
+            if assets is None:
+                assets = symbol_assets[symbol] = split_symbol(symbol) or (None, None)
+            base, quote = assets
+            commission = float(trade.get('commission') or 0)
+            asset = trade.get('commissionAsset')
+
+            if not commission or asset == quote:
+                trade['commissionQuote'] = commission
+            elif asset == base:
+                trade['commissionQuote'] = commission * float(trade['price'])
+            elif quote is None or trade.get('exchange', 'binance') not in KLINE_FETCHERS:
+                trade['commissionQuote'] = None
+            else:
+                key = (trade.get('exchange', 'binance'), asset, quote)
+                bucket = int(trade['time']) // self.interval_ms * self.interval_ms
+                needs.setdefault(key, set()).add(bucket)
+                pending.append((trade, key, bucket, commission))
+
+        # 批量获取 K 线
+        prices = {key: self._prices_for_pair(*key, buckets) for key, buckets in needs.items()}
+
+        # 第二遍: 查表折算
+        for trade, key, bucket, commission in pending:
+            price = prices[key].get(bucket)
+            trade['commissionQuote'] = commission * price if price else None
+
+        return summarize_fees(trades, symbol_assets)
+
+
+def summarize_fees(trades, symbol_assets=None):
+    """汇总已归一化的手续费: {'by_quote': {计价货币: 金额}, 'unconverted': {资产: 数量}}"""
+    symbol_assets = symbol_assets or {}
+    by_quote = {}
+    unconverted = {}
+    for trade in trades:
+        symbol = trade['symbol']
+        if symbol not in symbol_assets:
+            symbol_assets[symbol] = split_symbol(symbol) or (None, None)
+        fee = trade.get('commissionQuote')
+        if fee is None:
+            asset = trade.get('commissionAsset')
+            unconverted[asset] = unconverted.get(asset, 0.0) + float(trade.get('commission') or 0)
+        else:
+            quote = symbol_assets[symbol][1]
+            by_quote[quote] = by_quote.get(quote, 0.0) + fee
+    return {'by_quote': by_quote, 'unconverted': unconverted}
+
+
+def normalize_fees(trades, interval='1h', base_urls=None):
+    """便捷函数：折算一组成交的手续费"""
+    return FeeNormalizer(interval, base_urls).normalize(trades)
@@ -0,0 +1,49 @@
+"""
+gunicorn 配置 - 通过环境变量调整
+
+    TRADE_BIND      监听地址，默认 0.0.0.0:8080
+    TRADE_WORKERS   worker 进程数，默认 CPU 核数 * 2 + 1
+    TRADE_THREADS   每个 worker 的线程数，默认 8（查询主要在等待交易所响应，线程比进程便宜）
+    TRADE_TIMEOUT   单个请求的超时（秒），默认 120，长时间段的查询可能需要调大
+    TRADE_METRICS_DIR  各 worker 写出 Prometheus 指标的目录，/metrics 合并所有 worker 的指标，
+                       默认 TRADE_CACHE_DIR/metrics（见 prometheus_metrics.py）
+
+必须设置 TRADE_SECRET_KEY，否则 master 拒绝启动
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('TRADE_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('TRADE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('TRADE_THREADS', '8'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('TRADE_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.environ.get('TRADE_ACCESS_LOG', '-') or None  # 设为空字符串关闭访问日志
+# 每个 worker 独立导入 app，各自创建连接池和 SQLite 连接（不能在 fork 前共享）
+preload_app = False
+
+
+def on_starting(server):
+    """master 启动时检查密钥（而不是等每个 worker 导入 wsgi.py 时逐个启动失败），并清理旧的指标文件"""
+    if not os.environ.get('TRADE_SECRET_KEY'):
+        raise RuntimeError("❌ 未设置 TRADE_SECRET_KEY，所有 worker 需要相同的密钥，见 wsgi.py")
+    # 上次运行的 worker 留下的指标文件，不清理的话计数会被重复合并
+    import prometheus_metrics
+    prometheus_metrics.clear_multiprocess_dir()
+
+
+def post_worker_init(worker):
+    """每个 worker 写出自己的指标并启动后台同步线程（租约保证同一时间只有一个 worker 在同步）"""
+    import prometheus_metrics
+    from app import start_background_sync
+    prometheus_metrics.registry.enable_multiprocess()
+    start_background_sync()
+
+
+def worker_exit(server, worker):
+    """worker 退出前写出最后的指标，它的计数在重启前仍然计入 /metrics"""
+    import prometheus_metrics
+    prometheus_metrics.registry.dump()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+HTTP 缓存与压缩 - 成交和分析接口的 ETag / If-None-Match 和 gzip / brotli 压缩
+
+    - 每个 JSON 响应带弱 ETag（未压缩内容的摘要），GET 请求命中 If-None-Match 时返回 304，不重新传输
+    - 视图可以预先设置 ETag（例如共享存储中结果的摘要），并用 not_modified() 在加载数据前提前返回 304
+    - 按 Accept-Encoding 选择 br（安装了 brotli 时）或 gzip，小于 MIN_COMPRESS_BYTES 的响应不压缩
+
+使用弱 ETag 是因为同一内容的 gzip、brotli 和未压缩版本字节不同但语义相同。
+TRADE_COMPRESSION=0 关闭压缩（例如前面已有负责压缩的反向代理）
+"""
+
+import gzip
+import hashlib
+import os
+from functools import wraps
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+COMPRESSION_ENABLED = os.environ.get('TRADE_COMPRESSION', '1') != '0'
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # 动态内容：压缩率接近最高档，速度快一个数量级
+
+# 客户端每次都要重新验证，但可以用缓存的内容响应 304
+CACHE_CONTROL = 'private, no-cache'
+
+
+def content_etag(body):
+    """响应体的摘要"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def not_modified(etag):
+    """GET / HEAD 请求的 If-None-Match 命中 etag 时返回 304 响应，否则返回 None"""
+    if etag is None or request.method not in ('GET', 'HEAD'):
+        return None
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def negotiate_encoding():
+    """按 Accept-Encoding 的权重选择 br / gzip，都不接受时返回 None"""
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    best_quality = 0
+    for encoding in available:  # 权重相同时优先 br
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response):
+    """按客户端支持的编码压缩响应体（就地修改）"""
+    response.vary.add('Accept-Encoding')
+    if (not COMPRESSION_ENABLED or response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def cached_json(view):
+    """
+    视图装饰器：为 JSON 响应设置 ETag、处理 If-None-Match 并压缩
+    视图已设置 ETag 时沿用，否则用响应体的摘要
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or not response.is_json:
+            return response
+        etag, _ = response.get_etag()
+        if etag is None:
+            etag = content_etag(response.get_data())
+            response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return not_modified(etag) or compress_response(response)
+    return wrapper
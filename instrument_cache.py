@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+交易对元数据缓存 - Binance、OKX 和 Bybit 共用
+从交易所的 exchangeInfo / instruments 接口一次性加载，按 TTL 持久化到磁盘，
+同一进程内的所有账户共享同一份数据
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from json_backend import response_json
+
+# 缓存目录和有效期
+CACHE_DIR = os.environ.get(
+    'TRADE_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'binance_accounting')
+)
+INSTRUMENT_TTL = 24 * 3600  # 元数据有效期（秒）
+FAILURE_RETRY_INTERVAL = 300  # 加载失败后多久再尝试（秒）
+
+# 元数据不可用时用于拆分交易对的计价货币，按长度从长到短匹配
+FALLBACK_QUOTES = sorted(
+    ['USDT', 'USDC', 'FDUSD', 'TUSD', 'BUSD', 'DAI', 'EUR', 'TRY', 'BTC', 'ETH', 'BNB', 'OKB'],
+    key=len, reverse=True
+)
+
+
+def normalize_symbol(symbol):
+    """统一交易对写法 (例如: btc-usdt / BTC_USDT -> BTCUSDT)"""
+    return symbol.upper().replace('-', '').replace('_', '').replace('/', '')
+
+
+def split_symbol(symbol):
+    """按常见计价货币后缀拆分交易对，返回 (base, quote)，无法拆分时返回 None"""
+    symbol_upper = normalize_symbol(symbol)
+    for quote in FALLBACK_QUOTES:
+        if symbol_upper.endswith(quote) and len(symbol_upper) > len(quote):
+            return symbol_upper[:-len(quote)], quote
+    return None
+
+
+def _load_binance(session, base_url):
+    """加载 Binance 现货交易对 (GET /api/v3/exchangeInfo)"""
+    response = session.get(f"{base_url}/exchangeInfo", timeout=30)
+    response.raise_for_status()
+    instruments = {}
+    for item in response_json(response).get('symbols', []):
+        filters = {f.get('filterType'): f for f in item.get('filters', [])}
+        instruments[item['symbol']] = {
+            'symbol': item['symbol'],
+            'exchange_symbol': item['symbol'],
+            'base': item.get('baseAsset'),
+            'quote': item.get('quoteAsset'),
+            'tick_size': filters.get('PRICE_FILTER', {}).get('tickSize'),
+            'step_size': filters.get('LOT_SIZE', {}).get('stepSize'),
+            'status': item.get('status')
+        }
+    return instruments
+
+
+def _load_okx(session, base_url):
+    """加载 OKX 现货交易对 (GET /api/v5/public/instruments)"""
+    response = session.get(f"{base_url}/api/v5/public/instruments",
+                           params={'instType': 'SPOT'}, timeout=30)
+    response.raise_for_status()
+    data = response_json(response)
+    if data.get('code') != '0':
+        raise ValueError(data.get('msg', 'Unknown error'))
+    instruments = {}
+    for item in data.get('data', []):
+        symbol = normalize_symbol(item['instId'])
+        instruments[symbol] = {
+            'symbol': symbol,
+            'exchange_symbol': item['instId'],
+            'base': item.get('baseCcy'),
+            'quote': item.get('quoteCcy'),
+            'tick_size': item.get('tickSz'),
+            'step_size': item.get('lotSz'),
+            'status': item.get('state')
+        }
+    return instruments
+
+
+def _load_okx_swap(session, base_url):
+    """加载 OKX 永续合约 (GET /api/v5/public/instruments?instType=SWAP)，成交数量按 contract_size 换算"""
+    response = session.get(f"{base_url}/api/v5/public/instruments",
+                           params={'instType': 'SWAP'}, timeout=30)
+    response.raise_for_status()
+    data = response_json(response)
+    if data.get('code') != '0':
+        raise ValueError(data.get('msg', 'Unknown error'))
+    instruments = {}
+    for item in data.get('data', []):
+        symbol = normalize_symbol(item['instId'])
+        instruments[symbol] = {
+            'symbol': symbol,
+            'exchange_symbol': item['instId'],
+            'base': item.get('ctValCcy'),
+            'quote': item.get('settleCcy'),
+            'tick_size': item.get('tickSz'),
+            'step_size': item.get('lotSz'),
+            'contract_size': item.get('ctVal'),
+            'status': item.get('state')
+        }
+    return instruments
+
+
+def _load_bybit(session, base_url):
+    """加载 Bybit 现货交易对 (GET /v5/market/instruments-info)"""
+    instruments = {}
+    params = {'category': 'spot', 'limit': '1000'}
+    while True:
+        response = session.get(f"{base_url}/v5/market/instruments-info", params=params, timeout=30)
+        response.raise_for_status()
+        data = response_json(response)
+        if data.get('retCode') != 0:
+            raise ValueError(data.get('retMsg', 'Unknown error'))
+        result = data.get('result', {})
+        for item in result.get('list', []):
+            instruments[item['symbol']] = {
+                'symbol': item['symbol'],
+                'exchange_symbol': item['symbol'],
+                'base': item.get('baseCoin'),
+                'quote': item.get('quoteCoin'),
+                'tick_size': item.get('priceFilter', {}).get('tickSize'),
+                'step_size': item.get('lotSizeFilter', {}).get('basePrecision'),
+                'status': item.get('status')
+            }
+        cursor = result.get('nextPageCursor')
+        if not cursor:
+            break
+        params['cursor'] = cursor
+    return instruments
+
+
+LOADERS = {
+    'binance': _load_binance,
+    'okx': _load_okx,
+    'okx_swap': _load_okx_swap,
+    'bybit': _load_bybit,
+}
+
+
+class InstrumentCache:
+    """单个交易所主机的交易对元数据缓存"""
+
+    def __init__(self, exchange, base_url, ttl=INSTRUMENT_TTL, cache_dir=None):
+        self.exchange = exchange
+        self.base_url = base_url
+        self.ttl = ttl
+        host = urlparse(base_url).netloc or base_url
+        self.cache_file = os.path.join(cache_dir or CACHE_DIR, f"instruments_{exchange}_{host}.json")
+        self._instruments = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return self._instruments is not None and time.time() < self._expires_at
+
+    def _load_from_disk(self):
+        """读取磁盘缓存，过期或损坏时返回 False"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        expires_at = cached.get('fetched_at', 0) + self.ttl
+        if time.time() >= expires_at or not cached.get('instruments'):
+            return False
+
+        self._instruments = cached['instruments']
+        self._expires_at = expires_at
+        return True
+
+    def _save_to_disk(self, fetched_at):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'fetched_at': fetched_at, 'instruments': self._instruments}, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"⚠️ 无法写入交易对缓存 {self.cache_file}: {e}")
+
+    def _fetch(self, session):
+        """从交易所接口拉取元数据"""
+        try:
+            if session is None:
+                import requests
+                session = requests
+            self._instruments = LOADERS[self.exchange](session, self.base_url)
+            fetched_at = time.time()
+            self._expires_at = fetched_at + self.ttl
+            self._save_to_disk(fetched_at)
+        except Exception as e:
+            print(f"⚠️ 获取 {self.exchange} 交易对信息失败: {e}，使用内置规则转换交易对")
+            # 保留旧数据（如果有），短时间内不再重复请求
+            if self._instruments is None:
+                self._instruments = {}
+            self._expires_at = time.time() + FAILURE_RETRY_INTERVAL
+
+    def ensure_loaded(self, session=None):
+        """确保元数据已加载，同一进程内只会请求一次（直到过期）"""
+        if self._is_fresh():
+            return self._instruments
+        with self._lock:
+            if not self._is_fresh() and not self._load_from_disk():
+                self._fetch(session)
+        return self._instruments
+
+    def get(self, symbol, session=None):
+        """获取交易对信息，找不到时返回 None"""
+        return self.ensure_loaded(session).get(normalize_symbol(symbol))
+
+    def to_exchange_symbol(self, symbol, session=None):
+        """将统一写法的交易对转换为交易所写法，找不到时返回 None"""
+        info = self.get(symbol, session)
+        return info['exchange_symbol'] if info else None
+
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._instruments = None
+            self._expires_at = 0
+            try:
+                os.remove(self.cache_file)
+            except OSError:
+                pass
+
+
+# 进程级缓存注册表: {(exchange, base_url): InstrumentCache}
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_instrument_cache(exchange, base_url):
+    """获取进程内共享的交易对元数据缓存"""
+    key = (exchange, base_url)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = InstrumentCache(exchange, base_url)
+                _caches[key] = cache
+    return cache
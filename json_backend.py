@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+JSON 后端 - 交易所响应解析、JSON 导出和 Flask 响应统一使用的序列化函数
+安装了 orjson 时使用 orjson（解析和序列化都快数倍），否则回退到标准库 json
+
+TRADE_JSON_BACKEND=json 可强制使用标准库；orjson 不支持的输入（超过 64 位的整数等）
+自动回退到标准库。两种后端输出的 JSON 语义相同，仅数字写法（如 1e-7 / 1e-07）可能不同：
+
+    - NaN / Infinity 与标准库一样原样输出（orjson 会写成 null，含有这些值时改用标准库）
+    - ensure_ascii=True 时与标准库（和 Flask 默认的 JSON 响应）一样把非 ASCII 字符转义为 \\uXXXX
+    - 解析时 orjson 不接受的 NaN / Infinity 回退到标准库
+"""
+
+import json
+import math
+import os
+import re
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None and os.environ.get('TRADE_JSON_BACKEND', 'auto') != 'json' else 'json'
+
+if BACKEND == 'orjson':
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+    _ORJSON_ERRORS = (orjson.JSONEncodeError, TypeError, OverflowError)
+
+_NON_ASCII = re.compile('[^\x00-\x7f]')
+
+
+def loads(data):
+    """解析 JSON（str 或 bytes）"""
+    if BACKEND == 'orjson':
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # NaN / Infinity 等 orjson 不接受的写法交给标准库
+    return json.loads(data)
+
+
+def response_json(response):
+    """解析 requests 响应体，替代 response.json()"""
+    if BACKEND == 'orjson':
+        return loads(response.content)
+    return response.json()
+
+
+def _has_non_finite(obj):
+    """obj 中是否有 NaN / Infinity"""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(value) for value in obj)
+    return False
+
+
+def _escape_unicode(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        # 与标准库一样写成 UTF-16 代理对
+        code -= 0x10000
+        return '\\u{0:04x}\\u{1:04x}'.format(0xD800 | code >> 10, 0xDC00 | code & 0x3FF)
+    return '\\u{0:04x}'.format(code)
+
+
+def _escape_non_ascii(data):
+    """把 UTF-8 JSON 中的非 ASCII 字符转义为 \\uXXXX（非 ASCII 字符只会出现在字符串中）"""
+    if data.isascii():
+        return data
+    return _NON_ASCII.sub(_escape_unicode, data.decode('utf-8')).encode('ascii')
+
+
+def dumps_bytes(obj, indent=False, sort_keys=False, default=None, ensure_ascii=False):
+    """序列化为 UTF-8 字节，indent=True 时缩进 2 个空格；ensure_ascii=True 时转义非 ASCII 字符"""
+    if BACKEND == 'orjson':
+        option = _ORJSON_OPTIONS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if default is not None:
+            # 日期和 dataclass 交给 default 处理，与标准库的结果保持一致
+            option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        try:
+            data = orjson.dumps(obj, default=default, option=option)
+        except _ORJSON_ERRORS:
+            data = None
+        # orjson 把 NaN / Infinity 写成 null，只在输出中有 null 时才检查
+        if data is not None and not (b'null' in data and _has_non_finite(obj)):
+            return _escape_non_ascii(data) if ensure_ascii else data
+    return json.dumps(obj, indent=2 if indent else None, separators=None if indent else (',', ':'),
+                      sort_keys=sort_keys, default=default, ensure_ascii=ensure_ascii).encode('utf-8')
+
+
+def dumps(obj, indent=False, sort_keys=False, default=None, ensure_ascii=False):
+    """序列化为字符串"""
+    return dumps_bytes(obj, indent, sort_keys, default, ensure_ascii).decode('utf-8')
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+逐笔持仓匹配 (lot matching) - 按 FIFO / LIFO / 平均成本计算已实现盈亏
+按时间顺序流式消费成交，每笔成交只进出持仓队列一次，整体为 O(n)
+
+手续费处理:
+    - 计价货币手续费直接计入成本（开仓）或从收入中扣除（平仓）
+    - 基础货币手续费按成交价折算为计价货币
+    - 其他资产（如 BNB、OKB）使用 fee_normalization 写入的 commissionQuote，
+      没有折算结果时单独累计在 unconverted_fees 中
+
+支持空头：卖出数量超过持仓时剩余部分开空仓，之后的买入先平空仓
+"""
+
+import argparse
+import csv
+import json
+import sys
+from collections import deque
+
+from instrument_cache import split_symbol
+from markets import market_symbol
+
+FIFO = 'fifo'
+LIFO = 'lifo'
+AVERAGE = 'average'
+METHODS = (FIFO, LIFO, AVERAGE)
+
+# 浮点误差容忍度，小于该数量的剩余持仓视为已平
+QTY_EPSILON = 1e-12
+
+
+def fee_in_quote(trade, quote_asset, base_asset):
+    """把手续费折算为计价货币，返回 (计价货币手续费, 无法折算的资产或 None)"""
+    if trade.get('commissionQuote') is not None:
+        # 已由 fee_normalization 按历史 K 线折算
+        return trade['commissionQuote'], None
+    commission = float(trade.get('commission') or 0)
+    if not commission:
+        return 0.0, None
+    asset = trade.get('commissionAsset')
+    if asset == quote_asset:
+        return commission, None
+    if asset == base_asset:
+        return commission * float(trade['price']), None
+    return 0.0, asset
+
+
+class Position:
+    """单个 (账户, 交易对) 的持仓，lots 为 [数量, 单位成本]，数量为正表示多头，负为空头"""
+
+    __slots__ = ('method', 'lots', 'qty', 'cost', 'realized_pnl', 'fees', 'unconverted_fees')
+
+    def __init__(self, method):
+        self.method = method
+        self.lots = deque()
+        self.qty = 0.0    # 持仓数量（增量维护，避免每笔遍历所有持仓）
+        self.cost = 0.0   # 持仓总成本 sum(数量 * 单位成本)
+        self.realized_pnl = 0.0
+        self.fees = 0.0
+        self.unconverted_fees = {}
+
+    def to_state(self):
+        """导出持仓状态（可 JSON 序列化），用于增量计算时持久化"""
+        return {
+            'lots': [list(lot) for lot in self.lots],
+            'qty': self.qty,
+            'cost': self.cost,
+            'realized_pnl': self.realized_pnl,
+            'fees': self.fees,
+            'unconverted_fees': dict(self.unconverted_fees)
+        }
+
+    @classmethod
+    def from_state(cls, method, state):
+        position = cls(method)
+        position.lots = deque([list(lot) for lot in state['lots']])
+        position.qty = state['qty']
+        position.cost = state['cost']
+        position.realized_pnl = state['realized_pnl']
+        position.fees = state['fees']
+        position.unconverted_fees = dict(state['unconverted_fees'])
+        return position
+
+    @property
+    def avg_cost(self):
+        if abs(self.qty) <= QTY_EPSILON:
+            return 0.0
+        return self.cost / self.qty
+
+    def _open(self, signed_qty, unit_cost):
+        self.qty += signed_qty
+        self.cost += signed_qty * unit_cost
+        if self.method == AVERAGE and self.lots:
+            # 平均成本法只保留一个合并后的持仓
+            lot = self.lots[0]
+            total = lot[0] + signed_qty
+            lot[1] = (lot[0] * lot[1] + signed_qty * unit_cost) / total
+            lot[0] = total
+        else:
+            self.lots.append([signed_qty, unit_cost])
+
+    def apply(self, is_buy, qty, price, fee):
+        """处理一笔成交，返回 (平仓数量, 本笔已实现盈亏)"""
+        direction = 1 if is_buy else -1
+        remaining = qty
+        matched = 0.0
+        pnl = 0.0
+        self.fees += fee
+
+        # 方向相反的持仓先被平掉；FIFO 从队首取，LIFO 和平均成本从队尾取
+        while remaining > QTY_EPSILON and self.lots and self.lots[0][0] * direction < 0:
+            lot = self.lots[0] if self.method == FIFO else self.lots[-1]
+            close_qty = min(remaining, abs(lot[0]))
+            # 多头平仓: (卖价 - 成本) * 数量；空头平仓: (成本 - 买价) * 数量
+            pnl += (price - lot[1]) * close_qty * -direction
+            lot[0] += close_qty * direction
+            self.qty += close_qty * direction
+            self.cost += close_qty * direction * lot[1]
+            remaining -= close_qty
+            matched += close_qty
+            if abs(lot[0]) <= QTY_EPSILON:
+                if len(self.lots) == 1:
+                    # 最后一个持仓被平掉，清除累计的浮点误差
+                    self.qty = self.cost = 0.0
+                if self.method == FIFO:
+                    self.lots.popleft()
+                else:
+                    self.lots.pop()
+
+        # 手续费按比例分摊：平仓部分计入已实现盈亏，开仓部分计入持仓成本
+        close_fee = fee * matched / qty if qty else fee
+        pnl -= close_fee
+        if remaining > QTY_EPSILON:
+            open_fee = fee - close_fee
+            unit_cost = price + direction * open_fee / remaining
+            self._open(direction * remaining, unit_cost)
+
+        self.realized_pnl += pnl
+        return matched, pnl
+
+
+class LotMatcher:
+    """流式持仓匹配器，按时间顺序逐笔输入成交"""
+
+    def __init__(self, method=FIFO, per_account=True):
+        if method not in METHODS:
+            raise ValueError(f"未知的成本计算方法: {method}，可选: {', '.join(METHODS)}")
+        self.method = method
+        self.per_account = per_account
+        self.positions = {}  # {(交易所, 账户, 交易对): Position}
+        self._assets = {}    # {交易对: (base, quote)}
+
+    def _symbol_assets(self, symbol):
+        assets = self._assets.get(symbol)
+        if assets is None:
+            assets = self._assets[symbol] = split_symbol(symbol) or (None, None)
+        return assets
+
+    def process(self, trade):
+        """处理一笔成交，返回该笔的已实现盈亏记录"""
+        symbol = trade['symbol']
+        # 同一交易对的现货、杠杆和合约持仓分别匹配（BTCUSDT / BTCUSDT@usdm）
+        position_symbol = market_symbol(symbol, trade.get('market', 'spot'))
+        if self.per_account:
+            key = (trade.get('exchange', 'unknown'), trade.get('account_name', ''), position_symbol)
+        else:
+            key = ('', '', position_symbol)
+        position = self.positions.get(key)
+        if position is None:
+            position = self.positions[key] = Position(self.method)
+
+        base_asset, quote_asset = self._symbol_assets(symbol)
+        price = float(trade['price'])
+        qty = float(trade['qty'])
+        fee, unconverted_asset = fee_in_quote(trade, quote_asset, base_asset)
+        if unconverted_asset:
+            position.unconverted_fees[unconverted_asset] = (
+                position.unconverted_fees.get(unconverted_asset, 0.0) + float(trade['commission']))
+
+        matched, pnl = position.apply(trade['isBuyer'], qty, price, fee)
+        return {
+            'id': trade['id'],
+            'time': int(trade['time']),
+            'exchange': key[0],
+            'account': key[1],
+            'symbol': position_symbol,
+            'side': 'BUY' if trade['isBuyer'] else 'SELL',
+            'qty': qty,
+            'price': price,
+            'fee': fee,
+            'matched_qty': matched,
+            'realized_pnl': pnl,
+            'position_qty': position.qty,
+            'avg_cost': position.avg_cost
+        }
+
+    def match(self, trades):
+        """生成器：逐笔输出已实现盈亏记录，trades 需按时间排序"""
+        for trade in trades:
+            yield self.process(trade)
+
+    def summary(self):
+        """汇总已实现盈亏、手续费和剩余持仓"""
+        positions = []
+        total_pnl = 0.0
+        total_fees = 0.0
+        unconverted = {}
+        for (exchange, account, symbol), position in self.positions.items():
+            total_pnl += position.realized_pnl
+            total_fees += position.fees
+            for asset, amount in position.unconverted_fees.items():
+                unconverted[asset] = unconverted.get(asset, 0.0) + amount
+            positions.append({
+                'exchange': exchange,
+                'account': account,
+                'symbol': symbol,
+                'realized_pnl': position.realized_pnl,
+                'fees': position.fees,
+                'open_qty': position.qty,
+                'avg_cost': position.avg_cost,
+                'open_lots': len(position.lots),
+                'unconverted_fees': dict(position.unconverted_fees)
+            })
+        return {
+            'method': self.method,
+            'realized_pnl': total_pnl,
+            'fees': total_fees,
+            'unconverted_fees': unconverted,
+            'positions': positions
+        }
+
+
+def realized_pnl(trades, method=FIFO, per_account=True):
+    """计算一组成交的已实现盈亏汇总（会先按时间排序）"""
+    matcher = LotMatcher(method, per_account)
+    for _ in matcher.match(sorted(trades, key=lambda t: int(t['time']))):
+        pass
+    return matcher.summary()
+
+
+FILL_FIELDS = ['id', 'time', 'exchange', 'account', 'symbol', 'side', 'qty', 'price', 'fee',
+               'matched_qty', 'realized_pnl', 'position_qty', 'avg_cost']
+
+
+def write_fills_csv(fills, filename):
+    """把逐笔已实现盈亏写入 CSV，fills 可以是生成器，返回写入的行数"""
+    count = 0
+    with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FILL_FIELDS)
+        writer.writeheader()
+        for fill in fills:
+            writer.writerow(fill)
+            count += 1
+    return count
+
+
+def print_summary(summary):
+    print(f"\n💰 已实现盈亏 ({summary['method'].upper()}):")
+    for p in summary['positions']:
+        label = f"{p['exchange']}/{p['account']} " if p['account'] else ''
+        print(f"   {label}{p['symbol']}: 盈亏 {p['realized_pnl']:.2f}，手续费 {p['fees']:.4f}，"
+              f"持仓 {p['open_qty']:.8f} @ {p['avg_cost']:.6f}")
+    print(f"   合计: {summary['realized_pnl']:.2f}（已扣除手续费 {summary['fees']:.4f}）")
+    if summary['unconverted_fees']:
+        fees = ', '.join(f"{amount:.8f} {asset}" for asset, amount in summary['unconverted_fees'].items())
+        print(f"   ⚠️ 未折算的手续费: {fees}")
+
+
+def main(argv=None):
+    """从导出的 JSON 文件计算已实现盈亏"""
+    parser = argparse.ArgumentParser(description='按 FIFO / LIFO / 平均成本计算已实现盈亏')
+    parser.add_argument('trades_file', help='export_to_json 导出的交易记录文件')
+    parser.add_argument('--method', choices=METHODS, default=FIFO)
+    parser.add_argument('--combined', action='store_true', help='不区分账户，合并计算')
+    parser.add_argument('--output', help='逐笔盈亏输出到 CSV 文件')
+    args = parser.parse_args(argv)
+
+    with open(args.trades_file, 'r', encoding='utf-8') as f:
+        trades = sorted(json.load(f), key=lambda t: int(t['time']))
+
+    matcher = LotMatcher(args.method, per_account=not args.combined)
+    fills = matcher.match(trades)
+    if args.output:
+        count = write_fills_csv(fills, args.output)
+        print(f"✅ {count} 条逐笔盈亏已导出到: {args.output}")
+    else:
+        for _ in fills:
+            pass
+    print_summary(matcher.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
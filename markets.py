@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+交易市场 - 同一账户在现货、杠杆和合约市场的成交分别从不同的接口获取
+
+    spot    现货
+    margin  杠杆（全仓）
+    usdm    U本位合约（USDⓈ-M，Bybit / OKX 称为 linear）
+    coinm   币本位合约（COIN-M，Bybit / OKX 称为 inverse）
+
+各导出器在 markets 属性中声明支持的市场，iter_trade_pages / iter_trades 等方法按 market 参数选择接口，
+产出的成交都转换为同一种格式并带上 'market' 字段；合约成交的 qty 为币的数量、quoteQty 为计价金额，
+与现货一致，原始张数保存在 'contracts' 中
+"""
+
+import threading
+
+from instrument_cache import split_symbol
+
+SPOT = 'spot'
+MARGIN = 'margin'
+USDM = 'usdm'
+COINM = 'coinm'
+
+MARKETS = (SPOT, MARGIN, USDM, COINM)
+DEFAULT_MARKETS = (SPOT,)
+
+MARKET_LABELS = {
+    SPOT: '现货',
+    MARGIN: '杠杆',
+    USDM: 'U本位合约',
+    COINM: '币本位合约',
+}
+
+# 其他交易所的叫法
+MARKET_ALIASES = {
+    'linear': USDM,
+    'inverse': COINM,
+    'usds-m': USDM,
+    'coin-m': COINM,
+}
+
+# 非现货市场的成交在缓存和快照中按 '交易对@市场' 区分
+MARKET_SEPARATOR = '@'
+
+
+def parse_markets(value):
+    """
+    解析市场列表（'spot,usdm' 或 ['spot', 'linear']），去重并保持顺序；
+    为空时返回 DEFAULT_MARKETS，包含未知市场时抛出 ValueError
+    """
+    if not value:
+        return DEFAULT_MARKETS
+    names = value.split(',') if isinstance(value, str) else value
+    markets = []
+    for name in names:
+        name = str(name).strip().lower()
+        if not name:
+            continue
+        market = MARKET_ALIASES.get(name, name)
+        if market not in MARKETS:
+            raise ValueError(f"不支持的市场: {name}（可选: {', '.join(MARKETS)}）")
+        if market not in markets:
+            markets.append(market)
+    return tuple(markets) or DEFAULT_MARKETS
+
+
+def market_label(market):
+    return MARKET_LABELS.get(market, market)
+
+
+def market_symbol(symbol, market=SPOT):
+    """缓存和快照中使用的键：现货保持原样，其他市场加后缀（BTCUSDT@usdm）"""
+    return symbol if market == SPOT else f"{symbol}{MARKET_SEPARATOR}{market}"
+
+
+def split_market_symbol(key):
+    """market_symbol 的逆运算，返回 (交易对, 市场)"""
+    symbol, _, market = key.partition(MARKET_SEPARATOR)
+    return symbol, market or SPOT
+
+
+def inverse_base(symbol):
+    """币本位合约的标的币（BTCUSDT / BTCUSD -> BTC），无法拆分时返回 None"""
+    parts = split_symbol(symbol)
+    if parts:
+        return parts[0]
+    if symbol.upper().endswith('USD') and len(symbol) > 3:
+        return symbol.upper()[:-3]
+    return None
+
+
+def unsupported_market_error(label, market):
+    return ValueError(f"{label} 不支持{market_label(market)}市场")
+
+
+class MarketClients:
+    """
+    导出器按市场分别创建的请求客户端：每个市场的接口前缀和限频器各自独立，
+    一个市场被限频或退避不影响同一账户其他市场的获取。客户端在第一次使用该市场时才创建
+    """
+
+    def __init__(self, label, markets, factory):
+        self.label = label
+        self.markets = tuple(markets)
+        self._factory = factory  # factory(market) -> ExchangeClient
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, market):
+        client = self._clients.get(market)
+        if client is None:
+            if market not in self.markets:
+                raise unsupported_market_error(self.label, market)
+            with self._lock:
+                client = self._clients.get(market)
+                if client is None:
+                    client = self._clients[market] = self._factory(market)
+        return client
+
+    def created(self):
+        """已创建的客户端（用于释放连接池和限频器）"""
+        return list(self._clients.values())
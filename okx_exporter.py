@@ -4,55 +4,46 @@ OKX 交易记录导出器 - 对应 Binance 版本
 包含网络重试机制和交互式导出功能
 """
 
-import requests
 import hmac
-import hashlib
-import time
-import json
-import csv
 import base64
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from urllib.parse import urlencode
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from exchange_client import (ExchangeClient, Decoded, OK, AUTH_ERROR, TIMESTAMP_ERROR, RATE_LIMITED, FAILED,
+                             decoded_http_status, get_rate_limiter)
+from instrument_cache import get_instrument_cache, split_symbol
+from json_backend import response_json
+from markets import SPOT, MARGIN, USDM, COINM, MarketClients, inverse_base, market_label
+from trade_dedup import DedupIndex, new_dedup_index
+from trade_merge import day_window, iter_market_trades, iter_period_days, trade_time
+import trade_export
+import tracing
 
-class OKXTradeExporter:
-    """OKX 交易记录导出器"""
+OKX_REQUESTS_PER_SECOND = 5  # 每秒请求数（按账户）
+PAGE_LIMIT = 100  # trade/fills 单次返回的最大条数
+OKX_AUTH_ERROR_CODES = ('50105', '50111', '50113')  # 密码错误 / API key 无效 / 签名无效
+OKX_RATE_LIMIT_CODES = ('50011',)
+
+# 各市场在 trade/fills 中的 instType；U本位和币本位都是永续合约（BTC-USDT-SWAP / BTC-USD-SWAP）
+OKX_INST_TYPES = {
+    SPOT: 'SPOT',
+    MARGIN: 'MARGIN',
+    USDM: 'SWAP',
+    COINM: 'SWAP',
+}
+
+class OKXSigner:
+    """OKX HMAC-SHA256 (Base64) 签名"""
     
-    def __init__(self, api_key=None, secret_key=None, passphrase=None, testnet=None):
+    def __init__(self, api_key, secret_key, passphrase):
         self.api_key = api_key
         self.secret_key = secret_key
         self.passphrase = passphrase
-        testnet = testnet if testnet is not None else False
-        self.base_url = "https://www.okx.com" if not testnet else "https://www.okx.com"
-        
-        # 创建带重试机制的session
-        self.session = self._create_retry_session()
-        
-    def _create_retry_session(self):
-        """创建带重试机制的requests session"""
-        session = requests.Session()
-        
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=5,  # 总重试次数
-            backoff_factor=1,  # 退避因子，重试间隔会递增
-            status_forcelist=[429, 500, 502, 503, 504],  # 需要重试的HTTP状态码
-            allowed_methods=["HEAD", "GET", "OPTIONS"]  # 允许重试的HTTP方法
-        )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        
-        # 增加超时设置
-        session.timeout = 30
-        
-        return session
     
-    def _get_timestamp(self):
-        """获取 OKX 格式的时间戳"""
-        return datetime.utcnow().isoformat()[:-3] + 'Z'
+    @staticmethod
+    def _format_timestamp(timestamp_ms):
+        """转换为 OKX 格式的时间戳 (ISO 8601, 毫秒精度)"""
+        utc_time = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
+        return utc_time.strftime('%Y-%m-%dT%H:%M:%S.') + f"{timestamp_ms % 1000:03d}Z"
     
     def _sign(self, timestamp, method, request_path, body=''):
         """生成 OKX API 签名"""
@@ -69,78 +60,88 @@ class OKXTradeExporter:
         d = mac.digest()
         return base64.b64encode(d).decode()
     
-    def _make_request(self, endpoint, params=None, max_retries=3):
-        """发送带重试机制的请求"""
-        if params is None:
-            params = {}
-            
+    def sign(self, method, endpoint, params, timestamp_ms):
+        """返回 (请求路径, 请求头)"""
         # 构建请求路径
         request_path = f"/api/v5/{endpoint}"
         if params:
             request_path += '?' + urlencode(params)
         
-        # 生成时间戳和签名
-        timestamp = self._get_timestamp()
-        signature = self._sign(timestamp, 'GET', request_path)
-        
+        timestamp = self._format_timestamp(timestamp_ms)
         headers = {
             'OK-ACCESS-KEY': self.api_key,
-            'OK-ACCESS-SIGN': signature,
+            'OK-ACCESS-SIGN': self._sign(timestamp, method, request_path),
             'OK-ACCESS-TIMESTAMP': timestamp,
             'OK-ACCESS-PASSPHRASE': self.passphrase,
             'Content-Type': 'application/json'
         }
+        return request_path, headers
+
+def decode_okx_response(response):
+    """解析 OKX 响应"""
+    try:
+        data = response_json(response)
+    except ValueError:
+        data = {}
+    code = data.get('code') if isinstance(data, dict) else None
+    
+    if code == '0' and response.status_code == 200:
+        return Decoded(OK, data.get('data', []), None)
+    if code == '50102':
+        # 时间戳过期
+        return Decoded(TIMESTAMP_ERROR, None, data.get('msg'))
+    if code in OKX_AUTH_ERROR_CODES:
+        return Decoded(AUTH_ERROR, None, data.get('msg'))
+    if code in OKX_RATE_LIMIT_CODES:
+        return Decoded(RATE_LIMITED, None, data.get('msg'))
+    if response.status_code == 200:
+        return Decoded(FAILED, None, f"API 错误: {data.get('msg', 'Unknown error')}")
+    return decoded_http_status(response)
+
+class OKXTradeExporter:
+    """OKX 交易记录导出器"""
+    
+    EXCHANGE = 'okx'
+    
+    def __init__(self, api_key=None, secret_key=None, passphrase=None, testnet=None, api_host=None):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.passphrase = passphrase
+        testnet = testnet if testnet is not None else False
+        self.base_url = "https://www.okx.com" if not testnet else "https://www.okx.com"
+        if api_host:
+            # 自定义 API 主机（例如代理或本地模拟服务器）
+            self.base_url = api_host.rstrip('/')
+        self.instruments = get_instrument_cache('okx', self.base_url)
+        self.swap_instruments = get_instrument_cache('okx_swap', self.base_url)
+        self.auth_error_callback = None  # 认证失败时的回调，由账户管理设置
+        self.markets = tuple(OKX_INST_TYPES)
+        
+        # 通用请求层：连接池、时间同步、限频和重试均由 ExchangeClient 负责，每个市场一个客户端
+        self.market_clients = MarketClients('OKX', self.markets, self._create_client)
+        self.client = self.market_clients.get(SPOT)
+        self.session = self.client.session
+        self.clock = self.client.clock
+    
+    def _create_client(self, market):
+        return ExchangeClient(
+            'okx', self.base_url,
+            signer=OKXSigner(self.api_key, self.secret_key, self.passphrase),
+            decoder=decode_okx_response,
+            # OKX 的私有接口按账户限频，每个 API key 的每个市场单独一个限频器
+            rate_limiter=get_rate_limiter(('okx', self.api_key, market), OKX_REQUESTS_PER_SECOND),
+            on_auth_error=self._report_auth_error
+        )
         
-        url = f"{self.base_url}{request_path}"
-        
-        # 重试机制
-        for attempt in range(max_retries + 1):
-            try:
-                response = self.session.get(url, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('code') == '0':
-                        return data.get('data', [])
-                    else:
-                        print(f"API 错误: {data.get('msg', 'Unknown error')}")
-                        return None
-                elif response.status_code == 429:
-                    # 频率限制，等待更长时间
-                    wait_time = 2 ** attempt
-                    print(f"  ⏳ 请求频率限制，等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"HTTP 错误: {response.status_code}")
-                    return None
-                    
-            except (requests.exceptions.SSLError, 
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.Timeout) as e:
-                
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt  # 指数退避
-                    print(f"  ⚠️  网络错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
-                    print(f"  ⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"❌ 网络请求错误: {e}")
-                    return None
-                    
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt
-                    print(f"  ⚠️  请求错误 (尝试 {attempt + 1}/{max_retries + 1}): {str(e)[:100]}...")
-                    print(f"  ⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"❌ 请求错误: {e}")
-                    return None
-        
-        return None
+    def _report_auth_error(self):
+        """通知账户管理方认证失败（API密钥失效或权限不足）"""
+        print("❌ API 认证失败，请检查API密钥和权限")
+        if self.auth_error_callback:
+            self.auth_error_callback()
+    
+    def _make_request(self, endpoint, params=None, max_retries=3):
+        """发送带重试机制的请求"""
+        return self.client.request(endpoint, params, max_retries)
     
     def test_connection(self):
         """测试API连接和权限"""
@@ -161,69 +162,108 @@ class OKXTradeExporter:
     
     def _convert_symbol_to_okx_format(self, symbol):
         """将交易对转换为 OKX 格式 (例如: BTCUSDT -> BTC-USDT)"""
-        # 常见的基础货币列表
-        base_currencies = [
-            'BTC', 'ETH', 'BNB', 'ADA', 'XRP', 'DOT', 'UNI', 'LINK', 'LTC', 'BCH',
-            'SOL', 'MATIC', 'AVAX', 'ATOM', 'NEAR', 'FTM', 'ALGO', 'XLM', 'ICP',
-            'HBAR', 'VET', 'MANA', 'SAND', 'AXS', 'THETA', 'EGLD', 'EOS', 'AAVE',
-            'MKR', 'COMP', 'SUSHI', 'YFI', 'SNX', 'CRV', 'BAL', 'REN', 'KNC',
-            'PNUT', 'DOGE', 'SHIB', 'PEPE', 'FLOKI', 'BONK'
-        ]
+        okx_symbol = self.instruments.to_exchange_symbol(symbol, self.session)
+        if okx_symbol:
+            return okx_symbol
         
-        # 常见的计价货币
-        quote_currencies = ['USDT', 'USDC', 'BTC', 'ETH', 'BNB']
+        # 元数据中没有该交易对（例如已下架），按计价货币后缀拆分
+        parts = split_symbol(symbol)
+        if parts:
+            return f"{parts[0]}-{parts[1]}"
         
-        symbol_upper = symbol.upper()
-        
-        # 尝试匹配基础货币和计价货币
-        for base in base_currencies:
-            for quote in quote_currencies:
-                if symbol_upper == base + quote:
-                    return f"{base}-{quote}"
-        
-        # 如果没有匹配到，返回原始符号（可能需要手动处理）
+        # 如果无法拆分，返回原始符号（可能需要手动处理）
         return symbol
     
-    def get_trades_for_day(self, symbol, date_str):
-        """获取指定日期的交易记录"""
+    def _market_symbol(self, symbol, market):
+        """交易对在各市场的写法：现货和杠杆为 BTC-USDT，U本位永续为 BTC-USDT-SWAP，币本位永续为 BTC-USD-SWAP"""
+        if market == COINM:
+            base = inverse_base(symbol)
+            return f"{base}-USD-SWAP" if base else symbol
+        okx_symbol = self._convert_symbol_to_okx_format(symbol)
+        return f"{okx_symbol}-SWAP" if market == USDM else okx_symbol
+    
+    def _contract_size(self, inst_id):
+        """永续合约每张的面值（U本位为币数量，币本位为美元）
+        
+        元数据不可用时抛出 ValueError：按 1 张计算的数量可能相差上百倍，这一天按获取失败处理，
+        不写入成交缓存和每日快照"""
+        info = self.swap_instruments.get(inst_id, self.session)
         try:
-            # 转换交易对格式
-            okx_symbol = self._convert_symbol_to_okx_format(symbol)
-            
-            # 计算时间戳 (OKX 使用毫秒时间戳)
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            start_time = int(date_obj.timestamp() * 1000)
-            end_time = int((date_obj + timedelta(days=1) - timedelta(seconds=1)).timestamp() * 1000)
-            
-            params = {
-                'instId': okx_symbol,
-                'begin': str(start_time),
-                'end': str(end_time),
-                'limit': '100'
-            }
-            
-            print(f"正在获取 {date_str} 00:00 到 {date_str} 23:59 的交易记录...")
-            
-            trades = self._make_request("trade/fills", params)
-            
-            if trades is None:
-                print("  这个时间段没有交易记录")
-                return []
-            elif len(trades) == 0:
-                print("  这个时间段没有交易记录")
-                return []
-            else:
-                # 转换为 Binance 兼容格式
-                converted_trades = self._convert_trades_to_binance_format(trades, symbol)
-                print(f"  获取到 {len(converted_trades)} 条记录")
-                return converted_trades
-                
+            contract_size = float(info['contract_size'])
+        except (TypeError, KeyError, ValueError):
+            contract_size = 0.0
+        if not contract_size > 0:
+            raise ValueError(f"缺少 {inst_id} 的合约面值（交易对元数据不可用），无法换算成交数量")
+        return contract_size
+    
+    def get_symbol_info(self, symbol):
+        """获取交易对元数据（基础/计价货币、价格和数量精度），找不到时返回 None"""
+        return self.instruments.get(symbol, self.session)
+    
+    def iter_trade_pages(self, symbol, date_str, market=SPOT, before_request=None):
+        """逐页获取指定日期、指定市场的交易记录，每页一个已转换的列表（OKX 按时间倒序返回）
+        
+        返回满 100 条时用 after=最早一条的 billId 继续翻页
+        
+        before_request() 在实际发出每一页的请求之前调用（后台同步用于全局限频）
+        """
+        client = self.market_clients.get(market)
+        okx_symbol = self._market_symbol(symbol, market)
+        contract_size = self._contract_size(okx_symbol) if market in (USDM, COINM) else None
+        
+        # 计算时间戳 (OKX 使用毫秒时间戳)
+        start_time, end_time = day_window(date_str)
+        
+        params = {
+            'instType': OKX_INST_TYPES[market],
+            'instId': okx_symbol,
+            'begin': str(start_time),
+            'end': str(end_time),
+            'limit': str(PAGE_LIMIT)
+        }
+        page_number = 0
+        while True:
+            if before_request is not None:
+                before_request()
+            page_number += 1
+            with tracing.span('window', exchange='okx', market=market, symbol=symbol, date=date_str,
+                              page=page_number) as window:
+                if page_number == 1:
+                    tracing.log(f"正在获取 {date_str} 00:00 到次日 00:00 的{market_label(market)}交易记录...")
+                trades = client.request_or_raise("trade/fills", params)
+                if trades:
+                    # 转换为 Binance 兼容格式
+                    with tracing.span('convert', exchange='okx', rows=len(trades)):
+                        converted_trades = self._convert_trades_to_binance_format(trades, symbol, market,
+                                                                                  contract_size)
+                    window.set(trades=len(converted_trades))
+            if not trades:
+                return
+            yield converted_trades
+            if len(trades) < PAGE_LIMIT or not trades[-1].get('billId'):
+                return
+            params = dict(params, after=trades[-1]['billId'])
+    
+    def get_trades_for_day(self, symbol, date_str, market=SPOT):
+        """获取指定日期、指定市场的交易记录（按时间升序）"""
+        trades = []
+        try:
+            # 重试或翻页边界可能返回重复的成交
+            seen = DedupIndex()
+            for page in self.iter_trade_pages(symbol, date_str, market):
+                trades.extend(seen.filter(page, self.EXCHANGE))
         except Exception as e:
-            print(f"  获取 {date_str} 数据时出错: {e}")
-            return []
+            tracing.log(f"  获取 {date_str} 数据时出错: {e}")
+        
+        if trades:
+            trades.sort(key=trade_time)
+            tracing.log(f"  获取到 {len(trades)} 条记录")
+        else:
+            tracing.log("  这个时间段没有交易记录")
+        return trades
     
-    def _convert_trades_to_binance_format(self, okx_trades, original_symbol):
-        """将 OKX 交易格式转换为 Binance 兼容格式"""
+    def _convert_trades_to_binance_format(self, okx_trades, original_symbol, market=SPOT, contract_size=None):
+        """将 OKX 交易格式转换为 Binance 兼容格式，永续合约的张数按 contract_size 换算为币数量"""
         converted_trades = []
         
         for trade in okx_trades:
@@ -232,6 +272,7 @@ class OKXTradeExporter:
                 'id': trade.get('tradeId', ''),
                 'orderId': trade.get('ordId', ''),
                 'symbol': original_symbol,
+                'market': market,
                 'time': trade.get('ts', ''),
                 'isBuyer': trade.get('side', '').lower() == 'buy',
                 'isMaker': trade.get('execType', '') == 'M',
@@ -241,37 +282,49 @@ class OKXTradeExporter:
                 'commission': trade.get('fee', '0'),
                 'commissionAsset': trade.get('feeCcy', 'USDT')
             }
+            if contract_size is not None:
+                price = float(trade.get('fillPx', '0'))
+                contracts = float(trade.get('fillSz', '0'))
+                converted_trade['instrument'] = trade.get('instId', '')
+                converted_trade['contracts'] = trade.get('fillSz', '0')
+                converted_trade['realizedPnl'] = trade.get('fillPnl', '0')
+                if market == COINM:
+                    # 币本位每张面值为美元
+                    quote_qty = contracts * contract_size
+                    converted_trade['qty'] = str(quote_qty / price if price else 0.0)
+                    converted_trade['quoteQty'] = str(quote_qty)
+                else:
+                    qty = contracts * contract_size
+                    converted_trade['qty'] = str(qty)
+                    converted_trade['quoteQty'] = str(qty * price)
             converted_trades.append(converted_trade)
         
         return converted_trades
     
-    def get_all_trades_in_period(self, symbol, start_date, end_date):
-        """获取指定时间段内的所有交易记录"""
-        print(f"开始获取 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
+    def iter_trades(self, symbol, start_date, end_date, market=SPOT):
+        """生成器：按时间顺序逐条产出指定时间段内、指定市场的交易记录，每次只在内存中保留一天
         
-        all_trades = []
-        current_date = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        
-        total_trades = 0
+        market 也可以是市场列表，各市场并发获取后按时间归并为一个流"""
+        if not isinstance(market, str):
+            yield from iter_market_trades(self, symbol, start_date, end_date, market)
+            return
+        # 相邻日窗口首尾重叠，跨天的重复成交在这里过滤
+        seen = new_dedup_index()
+        for date_str in iter_period_days(start_date, end_date):
+            yield from seen.filter(self.get_trades_for_day(symbol, date_str, market), self.EXCHANGE)
+            # 只有相邻两天之间会有重复，更早的键不再需要
+            seen.next_window()
+    
+    def get_all_trades_in_period(self, symbol, start_date, end_date, market=SPOT):
+        """获取指定时间段内的所有交易记录"""
+        tracing.log(f"开始获取 {symbol} 从 {start_date} 到 {end_date} 的交易记录...")
         
-        while current_date <= end_date_obj:
-            date_str = current_date.strftime('%Y-%m-%d')
-            day_trades = self.get_trades_for_day(symbol, date_str)
-            
-            if day_trades:
-                all_trades.extend(day_trades)
-                total_trades += len(day_trades)
-                print(f"  获取到 {len(day_trades)} 条记录，累计 {total_trades} 条")
-            
-            current_date += timedelta(days=1)
-            
-            # 添加延迟避免频率限制
-            time.sleep(0.2)
+        all_trades = list(self.iter_trades(symbol, start_date, end_date, market))
         
-        print(f"\n总共获取到 {len(all_trades)} 条交易记录")
+        tracing.log(f"\n总共获取到 {len(all_trades)} 条交易记录")
         
-        if all_trades:
+        # 静默模式下跳过统计输出，避免在服务端热路径上额外遍历一遍数据
+        if all_trades and not tracing.is_quiet():
             self._print_trade_summary(all_trades)
         
         return all_trades
@@ -298,51 +351,9 @@ class OKXTradeExporter:
         print(f"交易时间范围: {start_time.strftime('%Y-%m-%d %H:%M:%S')} 至 {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     def export_to_csv(self, trades, filename):
-        """导出交易记录到CSV文件"""
-        if not trades:
-            print("没有交易记录可导出")
-            return
-        
-        # 转换数据格式
-        formatted_trades = []
-        for trade in trades:
-            formatted_trade = {
-                '交易ID': trade['id'],
-                '订单ID': trade['orderId'],
-                '交易对': trade['symbol'],
-                '交易时间': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                '买卖方向': '买入' if trade['isBuyer'] else '卖出',
-                '价格': float(trade['price']),
-                '数量': float(trade['qty']),
-                '金额': float(trade['quoteQty']),
-                '手续费': float(trade['commission']),
-                '手续费资产': trade['commissionAsset'],
-                '是否maker': '是' if trade['isMaker'] else '否',
-                '原始时间戳': trade['time']
-            }
-            formatted_trades.append(formatted_trade)
-        
-        # 按时间排序
-        formatted_trades.sort(key=lambda x: x['原始时间戳'])
-        
-        # 写入CSV文件
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            fieldnames = list(formatted_trades[0].keys())
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            writer.writeheader()
-            for trade in formatted_trades:
-                writer.writerow(trade)
-        
-        print(f"✅ 交易记录已成功导出到: {filename}")
+        """导出交易记录到CSV文件，trades 可以是 iter_trades 返回的生成器"""
+        return trade_export.export_to_csv(trades, filename)
     
     def export_to_json(self, trades, filename):
-        """导出交易记录到JSON文件"""
-        if not trades:
-            print("没有交易记录可导出")
-            return
-        
-        with open(filename, 'w', encoding='utf-8') as jsonfile:
-            json.dump(trades, jsonfile, indent=2, ensure_ascii=False)
-        
-        print(f"✅ 交易记录已成功导出到: {filename}") 
\ No newline at end of file
+        """导出交易记录到JSON文件，trades 可以是 iter_trades 返回的生成器"""
+        return trade_export.export_to_json(trades, filename)
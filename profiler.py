@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+分阶段性能剖析 - 命令行导出器的 --profile 模式
+按阶段（获取、转换、分析、导出）统计墙钟时间、CPU 时间和内存，
+并输出 cProfile 结果或采样得到的调用栈（可直接用于火焰图）
+
+两种模式:
+    cprofile  确定性剖析，结果精确但开销较大，适合短时间范围
+    sample    后台线程定时采样调用栈，开销很小，适合一年这样的长时间导出
+"""
+
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+import tracing
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+
+
+def _max_rss_bytes():
+    """进程峰值常驻内存（Linux 上 ru_maxrss 单位为 KB，macOS 为字节）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class StackSampler:
+    """定时采样所有线程的调用栈，按 '阶段;函数;函数...' 汇总次数"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+        self.phase = '-'
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _collect(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[';'.join([self.phase] + stack[::-1])] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._collect, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def dump(self, path):
+        """保存为 collapsed stack 格式（flamegraph.pl / speedscope 可直接读取）"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class PhaseProfiler:
+    """按阶段统计耗时和内存，同时运行 cProfile 或调用栈采样"""
+
+    def __init__(self, mode=CPROFILE, interval=0.01):
+        if mode not in (CPROFILE, SAMPLE):
+            raise ValueError(f"未知的剖析模式: {mode}")
+        self.mode = mode
+        self.phases = []
+        self._profile = cProfile.Profile() if mode == CPROFILE else None
+        self._sampler = StackSampler(interval) if mode == SAMPLE else None
+        # tracemalloc 开销较大，只在确定性模式下统计每个阶段的分配峰值
+        self._track_allocations = mode == CPROFILE
+
+    def start(self):
+        if self._track_allocations:
+            tracemalloc.start()
+        if self._sampler:
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler:
+            self._sampler.stop()
+        if self._track_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段；阶段内的 HTTP 请求耗时通过追踪 span 汇总为网络时间"""
+        if self._sampler:
+            self._sampler.phase = name
+        if self._track_allocations:
+            tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        if self._profile:
+            self._profile.enable()
+        try:
+            with tracing.start_trace(f"profile:{name}") as trace:
+                yield
+        finally:
+            if self._profile:
+                self._profile.disable()
+            record = {
+                'phase': name,
+                'wall_seconds': time.perf_counter() - wall_started,
+                'cpu_seconds': time.process_time() - cpu_started,
+                'network_seconds': sum(span['duration_ms'] for span in trace.timeline()
+                                       if span['name'] == 'http') / 1000,
+                'max_rss_bytes': _max_rss_bytes()
+            }
+            if self._track_allocations:
+                record['peak_alloc_bytes'] = tracemalloc.get_traced_memory()[1] - allocated_before
+            self.phases.append(record)
+            if self._sampler:
+                self._sampler.phase = '-'
+
+    def print_summary(self):
+        total_wall = sum(p['wall_seconds'] for p in self.phases) or 1
+        print("\n=== 性能剖析 ===")
+        print(f"{'阶段':<10} {'墙钟(s)':>9} {'占比':>7} {'CPU(s)':>9} {'网络(s)':>9} {'分配峰值(MB)':>13} {'RSS峰值(MB)':>12}")
+        for p in self.phases:
+            peak = p.get('peak_alloc_bytes')
+            peak_text = f"{peak / 1024 / 1024:.1f}" if peak is not None else '-'
+            print(f"{p['phase']:<12} {p['wall_seconds']:>9.3f} {p['wall_seconds'] / total_wall:>7.1%} "
+                  f"{p['cpu_seconds']:>9.3f} {p['network_seconds']:>9.3f} {peak_text:>13} "
+                  f"{p['max_rss_bytes'] / 1024 / 1024:>12.1f}")
+
+    def dump(self, prefix):
+        """保存剖析结果，返回写入的文件列表"""
+        files = []
+        if self._profile:
+            self._profile.dump_stats(f"{prefix}.prof")
+            files.append(f"{prefix}.prof")
+        if self._sampler:
+            self._sampler.dump(f"{prefix}.folded")
+            files.append(f"{prefix}.folded")
+        with open(f"{prefix}.json", 'w', encoding='utf-8') as f:
+            json.dump({'mode': self.mode, 'phases': self.phases}, f, indent=2, ensure_ascii=False)
+        files.append(f"{prefix}.json")
+        return files
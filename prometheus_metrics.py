@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Prometheus 指标 - 交易所请求和 Flask 路由的延迟、重试、限频和数据量
+不依赖 prometheus_client，直接输出 Prometheus 文本格式 (0.0.4)
+
+gunicorn 多进程部署时每个 worker 只有自己的计数。gunicorn.conf.py 在 worker 中调用
+registry.enable_multiprocess()：每个进程每 FLUSH_INTERVAL 秒把自己的指标写到 TRADE_METRICS_DIR
+（默认 TRADE_CACHE_DIR/metrics）下的一个文件，/metrics 由处理请求的 worker 合并所有进程的文件后输出，
+其他 worker 的数据最多延迟 FLUSH_INTERVAL 秒。已退出的 worker 的计数保留到服务重启
+"""
+
+import atexit
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+
+import json_backend
+import tracing
+from exchange_client import metrics as client_metrics
+from instrument_cache import CACHE_DIR
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_DIR = os.environ.get('TRADE_METRICS_DIR', os.path.join(CACHE_DIR, 'metrics'))
+FLUSH_INTERVAL = 5  # 多进程模式下写出本进程指标的间隔（秒）
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7)
+
+
+def _format_labels(label_names, label_values):
+    if not label_names:
+        return ''
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def collect(self, others=()):
+        """others: 其他进程导出的状态（_state() 的结果），与本进程的数据合并后输出"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples(self._merge(others)))
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def _state(self):
+        with self._lock:
+            return [[[str(v) for v in key], value] for key, value in self._values.items()]
+
+    def _merge(self, others):
+        values = defaultdict(float)
+        for state in (self._state(), *others):
+            for key, value in state:
+                values[tuple(key)] += value
+        return values
+
+    def _samples(self, values):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """累计分桶直方图"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = {}  # {labels: [每个桶的计数..., +Inf]}
+        self._sums = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._sums[key] += value
+
+    def _state(self):
+        with self._lock:
+            return [[[str(v) for v in key], list(counts), self._sums[key]] for key, counts in self._counts.items()]
+
+    def _merge(self, others):
+        merged = {}
+        for state in (self._state(), *others):
+            for key, counts, total in state:
+                entry = merged.setdefault(tuple(key), [[0] * len(counts), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+        return merged
+
+    def _samples(self, merged):
+        lines = []
+        for key, (counts, total) in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names + ('le',), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._directory = None
+        self._path = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def enable_multiprocess(self, directory=METRICS_DIR, interval=FLUSH_INTERVAL):
+        """多进程模式：定期把本进程的指标写到 directory，expose() 合并 directory 下所有进程的指标"""
+        if self._path is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        # 文件名带启动时间：worker 重启后 pid 被复用时不会覆盖已退出 worker 的计数
+        self._path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+        self.dump()
+        atexit.register(self.dump)
+        threading.Thread(target=self._flush_loop, args=(interval,), name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.dump()
+            except OSError as e:
+                tracing.log(f"⚠️ 写入指标文件失败: {e}")
+
+    def dump(self):
+        """把本进程的指标写到多进程目录（未启用多进程模式时什么都不做）"""
+        if self._path is None:
+            return
+        payload = json_backend.dumps_bytes({metric.name: metric._state() for metric in self._metrics})
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, self._path)
+
+    def _other_states(self):
+        """{指标名: [其他进程的状态]}"""
+        states = defaultdict(list)
+        if self._directory is None:
+            return states
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            if not name.endswith('.json') or path == self._path:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    data = json_backend.loads(f.read())
+            except (OSError, ValueError):  # 文件正在被替换或已损坏
+                continue
+            for metric_name, state in data.items():
+                states[metric_name].append(state)
+        return states
+
+    def expose(self):
+        """生成 Prometheus 文本格式（多进程模式下包含所有进程的指标）"""
+        states = self._other_states()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect(states.get(metric.name, ())))
+        return '\n'.join(lines) + '\n'
+
+
+def clear_multiprocess_dir(directory=METRICS_DIR):
+    """删除上次运行留下的指标文件（gunicorn master 启动时调用）"""
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.tmp')):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+registry = Registry()
+
+# 交易所请求
+EXCHANGE_REQUEST_SECONDS = registry.register(Histogram(
+    'exchange_request_duration_seconds', '交易所 API 请求耗时', ('exchange', 'endpoint', 'outcome')))
+EXCHANGE_RETRIES = registry.register(Counter(
+    'exchange_retries_total', '交易所 API 重试次数', ('exchange', 'endpoint', 'reason')))
+EXCHANGE_RATE_LIMITED = registry.register(Counter(
+    'exchange_rate_limited_total', '交易所返回限频 (429) 的次数', ('exchange', 'endpoint')))
+EXCHANGE_WAIT_SECONDS = registry.register(Counter(
+    'exchange_wait_seconds_total', '因限频或退避而等待的总时间', ('exchange', 'reason')))
+TRADES_FETCHED = registry.register(Counter(
+    'trades_fetched_total', '从交易所获取的成交记录数', ('exchange',)))
+TRADE_CACHE_DAYS = registry.register(Counter(
+    'trade_cache_days_total', '交互查询按天读取成交的缓存命中情况', ('exchange', 'outcome')))
+SYNC_DAYS = registry.register(Counter(
+    'sync_days_total', '后台同步获取的天数', ('exchange', 'outcome')))
+
+# Flask 路由
+ROUTE_SECONDS = registry.register(Histogram(
+    'http_request_duration_seconds', 'Flask 路由处理耗时', ('route', 'method', 'status')))
+ROUTE_RESPONSE_BYTES = registry.register(Histogram(
+    'http_response_size_bytes', 'Flask 路由响应大小', ('route',), buckets=SIZE_BUCKETS))
+SESSIONS_EVICTED = registry.register(Counter(
+    'analyzer_sessions_evicted_total', '被清理的会话分析器数量', ('reason',)))
+
+
+def _observe_client_event(event, **fields):
+    """exchange_client 指标事件 -> Prometheus 指标"""
+    if event == 'request':
+        EXCHANGE_REQUEST_SECONDS.observe(fields['latency'], exchange=fields['exchange'],
+                                         endpoint=fields['endpoint'], outcome=fields['outcome'])
+        if fields['outcome'] == 'rate_limited':
+            EXCHANGE_RATE_LIMITED.inc(exchange=fields['exchange'], endpoint=fields['endpoint'])
+    elif event == 'retry':
+        EXCHANGE_RETRIES.inc(exchange=fields['exchange'], endpoint=fields['endpoint'], reason=fields['reason'])
+    elif event == 'wait':
+        EXCHANGE_WAIT_SECONDS.inc(fields['seconds'], exchange=fields['exchange'], reason=fields['reason'])
+
+
+client_metrics.add_observer(_observe_client_event)
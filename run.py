@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 """
 运行脚本 - 启动 Binance 多账户交易分析网站
+
+    python run.py                 # 开发服务器（调试模式，单进程）
+    python run.py --production    # gunicorn 多进程，见 wsgi.py / gunicorn.conf.py
 """
 
-from app import app
+import os
+import sys
 
 if __name__ == '__main__':
+    if '--production' in sys.argv[1:]:
+        import wsgi
+        wsgi.main()
+        sys.exit(0)
+
+    from app import app, start_background_sync
+
     print("🚀 启动 Binance 多账户交易分析网站...")
     print("📍 请在浏览器中访问: http://localhost:8080")
     print("⚠️  使用 Ctrl+C 停止服务器")
     print("-" * 50)
     
+    # 调试模式的 reloader 会再启动一个子进程处理请求，后台同步只在子进程中启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_sync()
+    
     app.run(
         debug=True,
         host='0.0.0.0',
         port=8080,
         threaded=True
-    ) 
\ No newline at end of file
+    ) 
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+会话分析器注册表 - 每个浏览器会话一个 MultiExchangeTradeAnalyzer，互不影响
+
+    - 超过 TRADE_SESSION_IDLE_SECONDS 未访问的会话被清理
+    - 会话数超过 TRADE_MAX_SESSIONS 时清理最久未访问的会话
+    - 清理时，如果某个主机 / 限频键已没有任何存活账户在用，关闭对应的共享连接池并移除限频器；
+      注册表之外仍在使用的客户端（例如后台同步的导出器）由 external_clients() 提供，同样视为存活
+
+清理在访问注册表时顺带进行（最久未访问的会话在队首），不需要后台线程
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from exchange_client import release_rate_limiter
+
+SESSION_IDLE_SECONDS = int(os.environ.get('TRADE_SESSION_IDLE_SECONDS', '1800'))
+MAX_SESSIONS = int(os.environ.get('TRADE_MAX_SESSIONS', '200'))
+MAX_ACCOUNTS_PER_SESSION = int(os.environ.get('TRADE_MAX_ACCOUNTS_PER_SESSION', '20'))
+
+
+class AnalyzerRegistry:
+    """按会话 ID 保存分析器，factory() 创建新的分析器"""
+
+    def __init__(self, factory, idle_seconds=SESSION_IDLE_SECONDS, max_sessions=MAX_SESSIONS, on_evict=None,
+                 external_clients=None):
+        self.factory = factory
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict  # on_evict(reason, count)，用于指标
+        self.external_clients = external_clients  # external_clients() -> 注册表之外仍在使用的 ExchangeClient
+        self._entries = OrderedDict()  # {会话ID: [分析器, 最后访问时间]}，最久未访问的在前
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_id):
+        """返回会话的分析器，不存在时创建"""
+        now = time.monotonic()
+        evicted = {}
+        with self._lock:
+            evicted['idle'] = self._expire(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = self._entries[session_id] = [self.factory(), now]
+                overflow = []
+                while len(self._entries) > self.max_sessions:
+                    overflow.append(self._entries.popitem(last=False)[1][0])
+                evicted['capacity'] = overflow
+            else:
+                entry[1] = now
+                self._entries.move_to_end(session_id)
+        self._release(evicted)
+        return entry[0]
+
+    def peek(self, session_id):
+        """返回会话的分析器，不存在时返回 None（不创建、不更新访问时间）"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+        return entry[0] if entry else None
+
+    def remove(self, session_id):
+        """移除会话（例如清除账户），释放其资源"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._release({'cleared': [entry[0]]})
+
+    def evict_idle(self):
+        """立即清理所有空闲超时的会话，返回清理的数量"""
+        with self._lock:
+            expired = self._expire(time.monotonic())
+        self._release({'idle': expired})
+        return len(expired)
+
+    def _expire(self, now):
+        expired = []
+        while self._entries:
+            session_id, (analyzer, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self._entries[session_id]
+            expired.append(analyzer)
+        return expired
+
+    def _release(self, evicted):
+        """释放被清理会话的账户；仍被其他会话使用的连接池和限频器保留"""
+        if not any(evicted.values()):
+            return
+        # 被清理的会话有账户时连接池模块早已加载；没有时不必为此导入 requests
+        from connection_pool import host_key, release_session
+        with self._lock:
+            live = [client for analyzer, _ in self._entries.values()
+                    for info in list(analyzer.accounts.values())
+                    for client in info['exporter'].market_clients.created()]
+        if self.external_clients is not None:
+            live.extend(self.external_clients())
+        hosts_in_use = {host_key(client.base_url) for client in live}
+        limiters_in_use = {client.rate_limiter.key for client in live if client.rate_limiter is not None}
+
+        hosts = set()
+        limiter_keys = set()
+        for reason, analyzers in evicted.items():
+            for analyzer in analyzers:
+                for info in list(analyzer.accounts.values()):
+                    # 每个市场一个客户端（接口主机和限频器各不相同）
+                    for client in info['exporter'].market_clients.created():
+                        hosts.add(host_key(client.base_url))
+                        if client.rate_limiter is not None and client.rate_limiter.key is not None:
+                            limiter_keys.add(client.rate_limiter.key)
+                analyzer.accounts.clear()
+            if analyzers and self.on_evict:
+                self.on_evict(reason, len(analyzers))
+
+        for host in hosts - hosts_in_use:
+            release_session(host)
+        for key in limiter_keys - limiters_in_use:
+            release_rate_limiter(key)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+多进程共享状态 - 账户注册和查询结果保存在本机 SQLite 中，任何 worker 都能处理任何会话的请求
+
+    - accounts: 每个会话的账户配置（含 API 密钥）；安装了 cryptography 且设置了 TRADE_SECRET_KEY 时
+      用由该密钥派生的 Fernet 密钥加密保存，数据库及其 -wal / -shm 文件的权限都是 0600
+    - session_versions: 会话账户的版本号，worker 发现版本变化时从这里重建分析器
+    - results: 查询和分析结果（成交列表、分析报告等），代替放在 cookie 里的 Flask session；
+      每个结果保存内容摘要，用于生成 HTTP ETag 而不必读取和反序列化结果本身
+    - sync_targets: 需要后台同步的 (账户, 交易对) 及其市场，见 sync_scheduler.py
+    - leases: 多个 worker 之间的租约（例如只有一个 worker 运行后台同步）
+    - traces: 每个会话最近的查询追踪（/traces/<trace_id>），每个会话最多保留 MAX_TRACES_PER_SESSION 条
+
+使用 WAL 模式，读写互不阻塞；超过 TRADE_RESULT_TTL 未访问的会话被定期清理
+"""
+
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import json_backend
+import tracing
+from instrument_cache import CACHE_DIR
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # 可选依赖，未安装时账户配置不加密
+    Fernet = None
+
+SHARED_STORE_DB = os.environ.get('TRADE_SHARED_STORE', os.path.join(CACHE_DIR, 'shared_state.sqlite3'))
+RESULT_TTL = int(os.environ.get('TRADE_RESULT_TTL', '86400'))  # 会话数据保留时间（秒）
+PURGE_INTERVAL = 600  # 清理过期会话的间隔（秒）
+MAX_TRACES_PER_SESSION = 100
+SECRET_KEY = os.environ.get('TRADE_SECRET_KEY')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_versions (
+    sid TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    touched REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    sid TEXT NOT NULL,
+    account_name TEXT NOT NULL,
+    config BLOB NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (sid, account_name)
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    sid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (sid, name)
+);
+
+CREATE TABLE IF NOT EXISTS sync_targets (
+    sid TEXT NOT NULL,
+    account_name TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    days INTEGER NOT NULL,
+    markets TEXT NOT NULL DEFAULT 'spot',
+    PRIMARY KEY (sid, account_name, symbol)
+);
+
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS traces (
+    trace_id TEXT PRIMARY KEY,
+    sid TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    created REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS traces_sid ON traces (sid, created);
+"""
+
+
+def _digest(payload):
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _config_cipher(secret_key):
+    """由 TRADE_SECRET_KEY 派生的账户配置加密器，没有密钥或未安装 cryptography 时返回 None"""
+    if not secret_key or Fernet is None:
+        return None
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+               info=b'shared_store accounts').derive(secret_key.encode('utf-8'))
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def _create_private(path):
+    """创建（或收紧）只允许本用户读写的文件"""
+    os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+    os.chmod(path, 0o600)
+
+
+class SharedStore:
+    """按会话 ID 保存账户配置和查询结果"""
+
+    def __init__(self, path=SHARED_STORE_DB, ttl=RESULT_TTL, secret_key=SECRET_KEY):
+        self.path = path
+        self.ttl = ttl
+        self._cipher = _config_cipher(secret_key)
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # 在 SQLite 打开数据库之前创建：-wal / -shm 文件同样含有账户配置，
+            # SQLite 之后重新创建它们时沿用数据库文件的权限
+            for suffix in ('', '-wal', '-shm'):
+                _create_private(path + suffix)
+            if self._cipher is None:
+                tracing.log("⚠️ 未设置 TRADE_SECRET_KEY 或未安装 cryptography，账户配置将以明文保存在共享存储中")
+        # 多个 worker 进程同时写入时等待锁，而不是立即报错
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+            if 'digest' not in columns:  # 旧版本创建的数据库
+                self._conn.execute("ALTER TABLE results ADD COLUMN digest TEXT")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sync_targets)")}
+            if 'markets' not in columns:
+                self._conn.execute("ALTER TABLE sync_targets ADD COLUMN markets TEXT NOT NULL DEFAULT 'spot'")
+        if self._cipher is not None:
+            self._encrypt_plaintext_accounts()
+
+    def _encode_config(self, config):
+        payload = json_backend.dumps_bytes(config)
+        return self._cipher.encrypt(payload) if self._cipher is not None else payload
+
+    def _decode_config(self, payload):
+        """解密账户配置，无法解密（密钥已更换或未安装 cryptography）时返回 None"""
+        payload = bytes(payload)
+        if payload[:1] == b'{':  # 未加密的配置
+            return json_backend.loads(payload)
+        if self._cipher is None:
+            return None
+        try:
+            return json_backend.loads(self._cipher.decrypt(payload))
+        except InvalidToken:
+            return None
+
+    def _encrypt_plaintext_accounts(self):
+        """加密旧版本（或未设置密钥时）以明文保存的账户配置"""
+        with self._lock:
+            rows = self._conn.execute("SELECT sid, account_name, config FROM accounts").fetchall()
+        statements = [("UPDATE accounts SET config = ? WHERE sid = ? AND account_name = ? AND config = ?",
+                       (self._cipher.encrypt(bytes(config)), sid, account_name, config))
+                      for sid, account_name, config in rows if bytes(config)[:1] == b'{']
+        if statements:
+            self._write(statements)
+
+    def _write(self, statements):
+        """在一个写事务中执行 [(sql, params)]"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _bump(self, sid):
+        return ("INSERT INTO session_versions VALUES (?, 1, ?) "
+                "ON CONFLICT(sid) DO UPDATE SET version = version + 1, touched = excluded.touched",
+                (sid, time.time()))
+
+    def version(self, sid):
+        """会话账户的版本号，没有记录时为 0"""
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM session_versions WHERE sid = ?", (sid,)).fetchone()
+        return row[0] if row else 0
+
+    def save_accounts(self, sid, configs):
+        """添加或替换会话的账户配置，返回新的版本号"""
+        with self._lock:
+            position = self._conn.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM accounts WHERE sid = ?", (sid,)).fetchone()[0]
+        statements = []
+        for offset, config in enumerate(configs, 1):
+            statements.append(("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?)",
+                               (sid, config['account_name'], self._encode_config(config), position + offset)))
+        statements.append(self._bump(sid))
+        self._write(statements)
+        return self.version(sid)
+
+    def load_accounts(self, sid):
+        """返回 (版本号, 账户配置列表)，按添加顺序排列"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT config FROM accounts WHERE sid = ? ORDER BY position", (sid,)).fetchall()
+            version = self._conn.execute(
+                "SELECT version FROM session_versions WHERE sid = ?", (sid,)).fetchone()
+        configs = [self._decode_config(row[0]) for row in rows]
+        if None in configs:
+            tracing.log(f"⚠️ {configs.count(None)} 个账户配置无法解密（TRADE_SECRET_KEY 已更换？），已跳过")
+        return (version[0] if version else 0), [config for config in configs if config is not None]
+
+    def clear_session(self, sid):
+        """删除会话的账户和结果，版本号加一让其他 worker 丢弃缓存的分析器"""
+        self._write([("DELETE FROM accounts WHERE sid = ?", (sid,)),
+                     ("DELETE FROM results WHERE sid = ?", (sid,)),
+                     ("DELETE FROM sync_targets WHERE sid = ?", (sid,)),
+                     ("DELETE FROM traces WHERE sid = ?", (sid,)),
+                     self._bump(sid)])
+
+    def put_results(self, sid, **values):
+        """保存一组结果（值须可 JSON 序列化），None 表示删除"""
+        statements = []
+        for name, value in values.items():
+            if value is None:
+                statements.append(("DELETE FROM results WHERE sid = ? AND name = ?", (sid, name)))
+            else:
+                payload = json_backend.dumps_bytes(value)
+                statements.append(("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                   (sid, name, payload, _digest(payload))))
+        statements.append(("INSERT INTO session_versions VALUES (?, 0, ?) "
+                           "ON CONFLICT(sid) DO UPDATE SET touched = excluded.touched", (sid, time.time())))
+        self._write(statements)
+
+    def get_result(self, sid, name, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM results WHERE sid = ? AND name = ?", (sid, name)).fetchone()
+        return json_backend.loads(row[0]) if row else default
+
+    def result_digest(self, sid, *names):
+        """若干结果的组合摘要（内容不变则摘要不变），全部不存在时返回 None"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, digest, CASE WHEN digest IS NULL THEN payload END FROM results "
+                "WHERE sid = ? AND name IN (%s)" % ','.join('?' * len(names)), (sid, *names)).fetchall()
+        if not rows:
+            return None
+        digests = {name: digest or _digest(payload) for name, digest, payload in rows}
+        return _digest('\x1f'.join(f"{name}={digests.get(name, '')}" for name in names).encode('utf-8'))
+
+    def has_result(self, sid, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM results WHERE sid = ? AND name = ?", (sid, name)).fetchone()
+        return row is not None
+
+    def put_trace(self, sid, trace, keep=MAX_TRACES_PER_SESSION):
+        """保存一次查询追踪（tracing.Trace），只保留会话最近的 keep 条"""
+        payload = json_backend.dumps_bytes(trace.to_dict(), default=str)
+        self._write([("INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?)",
+                      (trace.trace_id, sid, payload, time.time())),
+                     ("DELETE FROM traces WHERE sid = ? AND trace_id NOT IN "
+                      "(SELECT trace_id FROM traces WHERE sid = ? ORDER BY created DESC LIMIT ?)",
+                      (sid, sid, keep))])
+
+    def get_trace(self, sid, trace_id):
+        """会话的某条追踪（dict），不存在或属于其他会话时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM traces WHERE trace_id = ? AND sid = ?", (trace_id, sid)).fetchone()
+        return json_backend.loads(row[0]) if row else None
+
+    def purge(self, now=None):
+        """删除超过 ttl 未访问的会话，返回删除的会话数"""
+        cutoff = (now or time.time()) - self.ttl
+        with self._lock:
+            sids = [row[0] for row in self._conn.execute(
+                "SELECT sid FROM session_versions WHERE touched < ?", (cutoff,)).fetchall()]
+        statements = []
+        for sid in sids:
+            for table in ('accounts', 'results', 'sync_targets', 'traces', 'session_versions'):
+                statements.append((f"DELETE FROM {table} WHERE sid = ?", (sid,)))
+        if statements:
+            self._write(statements)
+        return len(sids)
+
+    def set_sync_target(self, sid, account_name, symbol, days, markets=('spot',)):
+        """添加或更新后台同步目标：账户最近 days 天的 symbol 成交（markets 中的各个市场）"""
+        self._write([("INSERT OR REPLACE INTO sync_targets VALUES (?, ?, ?, ?, ?)",
+                      (sid, account_name, symbol, days, ','.join(markets)))])
+
+    def remove_sync_target(self, sid, account_name, symbol):
+        self._write([("DELETE FROM sync_targets WHERE sid = ? AND account_name = ? AND symbol = ?",
+                      (sid, account_name, symbol))])
+
+    def sync_targets(self, sid=None):
+        """同步目标及对应的账户配置 [{'sid', 'account_name', 'symbol', 'days', 'markets', 'config'}]，
+        账户已被移除的目标不返回"""
+        sql = ("SELECT t.sid, t.account_name, t.symbol, t.days, a.config, t.markets FROM sync_targets t "
+               "JOIN accounts a ON a.sid = t.sid AND a.account_name = t.account_name")
+        with self._lock:
+            if sid is None:
+                rows = self._conn.execute(sql).fetchall()
+            else:
+                rows = self._conn.execute(sql + " WHERE t.sid = ?", (sid,)).fetchall()
+        targets = []
+        for row in rows:
+            config = self._decode_config(row[4])
+            if config is not None:
+                targets.append({'sid': row[0], 'account_name': row[1], 'symbol': row[2], 'days': row[3],
+                                'markets': tuple(row[5].split(',')), 'config': config})
+        return targets
+
+    def acquire_lease(self, name, owner, ttl):
+        """获取或续期租约，成功（租约无人持有、已过期或本来就属于 owner）时返回 True"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+                acquired = row is None or row[0] == owner or row[1] < now
+                if acquired:
+                    self._conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, owner, now + ttl))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def maybe_purge(self):
+        """距离上次清理超过 PURGE_INTERVAL 时清理过期会话"""
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return 0
+        self._last_purge = now
+        return self.purge(now)
+
+
+# 进程级共享实例
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_shared_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SharedStore()
+    return _store
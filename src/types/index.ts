@@ -74,6 +74,26 @@ export interface ProfitStats {
   min_qty: number;
 }
 
+export interface RealizedPosition {
+  exchange: string;
+  account: string;
+  symbol: string;
+  realized_pnl: number;
+  fees: number;
+  open_qty: number;
+  avg_cost: number;
+  open_lots: number;
+  unconverted_fees: { [asset: string]: number };
+}
+
+export interface RealizedPnl {
+  method: 'fifo' | 'lifo' | 'average';
+  realized_pnl: number;
+  fees: number;
+  unconverted_fees: { [asset: string]: number };
+  positions: RealizedPosition[];
+}
+
 export interface TradeAnalysis {
   total_count: number;
   buy_count: number;
@@ -83,7 +103,10 @@ export interface TradeAnalysis {
   buy_stats?: TradeStats;
   sell_stats?: TradeStats;
   profit_stats?: ProfitStats;
+  realized_pnl?: RealizedPnl;
   total_commission_by_asset: { [key: string]: number };
+  total_commission_quote?: { [quote: string]: number };
+  unconverted_commission?: { [asset: string]: number };
 }
 
 export interface QueryParams {
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+后台同步 - 定期把配置的 (账户, 交易对, 市场) 最近几天的成交获取到 trade_cache，
+交互查询 /query_trades 时这些日期直接从缓存读取
+
+    - 全局限频：所有后台同步共享一个令牌桶（TRADE_SYNC_REQUESTS_PER_SECOND，每页一个令牌），
+      在各交易所自身的限频之外，给交互查询留出余量
+    - 抖动：每个目标的同步间隔在 TRADE_SYNC_INTERVAL 上下浮动 SYNC_JITTER，避免所有目标同时到期
+    - 退避：同步失败的目标按指数退避（最长 MAX_BACKOFF_SECONDS）后再试，成功后恢复正常间隔
+    - 多个 worker 进程通过共享存储中的租约选出一个负责同步，其余 worker 待命；
+      同步过程中每页请求前续期租约，租约被其他 worker 接管时立即停止本轮同步
+
+已经结束的日期缓存后不再获取，每轮通常只需刷新当天的成交。TRADE_SYNC=0 关闭后台同步
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import prometheus_metrics
+import tracing
+from account_validation import credential_fingerprint
+from exchange_client import RateLimiter, backoff_delay
+from markets import SPOT, market_label, market_symbol
+from trade_cache import fetch_day
+from trade_merge import iter_period_days
+
+SYNC_ENABLED = os.environ.get('TRADE_SYNC', '1') != '0'
+SYNC_INTERVAL = int(os.environ.get('TRADE_SYNC_INTERVAL', '120'))  # 每个目标的同步间隔（秒）
+SYNC_REQUESTS_PER_SECOND = float(os.environ.get('TRADE_SYNC_REQUESTS_PER_SECOND', '2'))
+SYNC_JITTER = 0.2  # 间隔的随机浮动比例
+MAX_BACKOFF_SECONDS = 3600
+MAX_SYNC_DAYS = 90  # 单个目标最多同步的天数
+TICK_SECONDS = 5  # 检查到期目标和续期租约的间隔
+LEASE_NAME = 'sync_scheduler'
+LEASE_SECONDS = 60
+LEASE_RENEW_SECONDS = 15  # 同步过程中续期租约的最短间隔
+
+
+class LeaseLost(Exception):
+    """同步过程中租约被其他 worker 接管"""
+
+
+class SyncScheduler:
+    """
+    后台同步线程
+    store: SharedStore（同步目标、账户配置和租约）；cache: TradeCache；
+    exporter_factory(config) 按账户配置创建导出器
+    """
+
+    def __init__(self, store, cache, exporter_factory, interval=SYNC_INTERVAL,
+                 requests_per_second=SYNC_REQUESTS_PER_SECOND, jitter=SYNC_JITTER):
+        self.store = store
+        self.cache = cache
+        self.exporter_factory = exporter_factory
+        self.interval = interval
+        self.jitter = jitter
+        self.budget = RateLimiter(requests_per_second, burst=max(1, int(requests_per_second)))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._state = {}  # {(凭证指纹, 交易对, 市场): [下次同步时间, 连续失败次数]}
+        self._exporters = {}  # {凭证指纹: 导出器}
+        self._lease_renewed = 0.0
+        self._lease_lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trade-sync', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=TICK_SECONDS * 2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(TICK_SECONDS):
+            try:
+                if self.store.acquire_lease(LEASE_NAME, self.owner, LEASE_SECONDS):
+                    self._lease_renewed = time.time()
+                    self.run_once()
+            except Exception as e:
+                tracing.log(f"⚠️ 后台同步出错: {e}")
+
+    def _jobs(self):
+        """按 (凭证指纹, 交易对, 市场) 合并各会话的同步目标，同一账户取最大的天数"""
+        jobs = {}
+        for target in self.store.sync_targets():
+            config = target['config']
+            fingerprint = credential_fingerprint(config['exchange'], config['api_key'], config['secret_key'],
+                                                 config.get('passphrase'), config.get('testnet', False))
+            days = min(MAX_SYNC_DAYS, target['days'])
+            for market in target['markets']:
+                key = (fingerprint, target['symbol'], market)
+                if key not in jobs or jobs[key][1] < days:
+                    jobs[key] = (config, days)
+        return jobs
+
+    def run_once(self, now=None):
+        """同步所有到期的目标，返回 {'synced': 成功数, 'failed': 失败数}"""
+        now = now or time.time()
+        self._lease_lost = False
+        jobs = self._jobs()
+        # 目标被移除后丢弃其状态和导出器
+        for key in set(self._state) - set(jobs):
+            del self._state[key]
+        fingerprints = {fingerprint for fingerprint, _, _ in jobs}
+        for fingerprint in set(self._exporters) - fingerprints:
+            del self._exporters[fingerprint]
+
+        summary = {'synced': 0, 'failed': 0}
+        for key, (config, days) in jobs.items():
+            state = self._state.setdefault(key, [now, 0])
+            if state[0] > now or self._stop.is_set():
+                continue
+            fingerprint, symbol, market = key
+            try:
+                if not self._renew_lease():
+                    raise LeaseLost('后台同步租约已被其他 worker 接管')
+                synced = self.sync_target(fingerprint, config, symbol, days, market)
+            except LeaseLost:
+                # 其他 worker 已接管同步，本目标保持到期状态，由新的持有者处理
+                tracing.log("⚠️ 后台同步租约已被其他 worker 接管，停止本轮同步")
+                break
+            except Exception as e:
+                tracing.log(f"⚠️ 同步 {config['account_name']} {symbol}（{market_label(market)}）失败: {e}")
+                synced = False
+            if synced:
+                state[1] = 0
+                state[0] = time.time() + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+                summary['synced'] += 1
+            else:
+                state[1] += 1
+                state[0] = time.time() + backoff_delay(state[1], base=self.interval, cap=MAX_BACKOFF_SECONDS)
+                summary['failed'] += 1
+        return summary
+
+    def clients(self):
+        """后台同步的导出器已创建的请求客户端（会话清理时这些连接池和限频器不能释放）"""
+        return [client for exporter in list(self._exporters.values())
+                for client in exporter.market_clients.created()]
+
+    def _renew_lease(self):
+        """续期租约（最多每 LEASE_RENEW_SECONDS 一次），已被其他 worker 接管时返回 False"""
+        now = time.time()
+        if not self._lease_lost and now - self._lease_renewed >= LEASE_RENEW_SECONDS:
+            if self.store.acquire_lease(LEASE_NAME, self.owner, LEASE_SECONDS):
+                self._lease_renewed = now
+            else:
+                self._lease_lost = True
+        return not self._lease_lost
+
+    def _before_page(self):
+        """每页请求前：续期租约并从全局令牌桶取令牌"""
+        if not self._renew_lease():
+            raise LeaseLost('后台同步租约已被其他 worker 接管')
+        self.budget.acquire()
+
+    def sync_target(self, fingerprint, config, symbol, days, market=SPOT):
+        """获取缓存中缺失或过期的日期，全部完整获取时返回 True；租约丢失时抛出 LeaseLost"""
+        exporter = self._exporters.get(fingerprint)
+        if exporter is None:
+            exporter = self._exporters[fingerprint] = self.exporter_factory(config)
+        end_date = datetime.now().date()
+        start_date = end_date - timedelta(days=days - 1)
+        key = market_symbol(symbol, market)
+        for date_str in iter_period_days(start_date.isoformat(), end_date.isoformat()):
+            if self.cache.is_fresh(fingerprint, key, date_str):
+                continue
+            fetched_at = time.time()
+            trades, complete = fetch_day(exporter, symbol, date_str, before_page=self._before_page, market=market)
+            if self._lease_lost:
+                # fetch_day 把 _before_page 抛出的 LeaseLost 当作获取出错，这里重新抛出，不按失败退避
+                raise LeaseLost('后台同步租约已被其他 worker 接管')
+            if not complete:
+                prometheus_metrics.SYNC_DAYS.inc(exchange=config['exchange'], outcome='failed')
+                return False
+            self.cache.put(fingerprint, key, date_str, trades, fetched_at)
+            prometheus_metrics.SYNC_DAYS.inc(exchange=config['exchange'], outcome='fetched')
+        return True
+
+
+# 进程级实例
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler_clients():
+    """本进程后台同步正在使用的请求客户端，没有启动后台同步时为空"""
+    scheduler = _scheduler
+    return scheduler.clients() if scheduler is not None else []
+
+
+def start_sync_scheduler(store, cache, exporter_factory):
+    """启动本进程的后台同步线程（只启动一次），TRADE_SYNC=0 时返回 None"""
+    global _scheduler
+    if not SYNC_ENABLED:
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = SyncScheduler(store, cache, exporter_factory).start()
+    return _scheduler
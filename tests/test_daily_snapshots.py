@@ -0,0 +1,136 @@
+"""每日快照：增量更新、去重、补查历史后重算、按账户键和市场查询、多个连接同时写入"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daily_snapshots import DailySnapshotStore  # noqa: E402
+
+
+def at(day, hour):
+    return int(datetime(2024, 1, day, hour).timestamp() * 1000)
+
+
+def trade(trade_id, day, hour, is_buy, qty, price, commission=0, asset='USDT', **extra):
+    return dict({'id': trade_id, 'time': at(day, hour), 'symbol': 'BTCUSDT', 'isBuyer': is_buy, 'qty': qty,
+                 'price': price, 'quoteQty': qty * price, 'commission': commission, 'commissionAsset': asset,
+                 'exchange': 'binance', 'account_name': '主账户'}, **extra)
+
+
+TRADES = [trade(1, 1, 10, True, 1, 100, 0.1), trade(2, 1, 11, True, 1, 200),
+          trade(3, 2, 10, False, 1, 300, 0.001, 'BNB'), trade(4, 3, 10, False, 1, 250)]
+KEYS = {'主账户': 'fp-main'}
+
+
+def snapshot_view(rows):
+    return [(row['day'], row['market'], row['trade_count'], round(row['realized_pnl'], 6), row['close_position'])
+            for row in rows]
+
+
+class DailySnapshotStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = DailySnapshotStore(':memory:')
+
+    def test_daily_rows(self):
+        self.assertEqual(self.store.update(TRADES, KEYS), 4)
+        rows = self.store.query(accounts=['fp-main'])
+        self.assertEqual(snapshot_view(rows), [('2024-01-01', 'spot', 2, 0.0, 2.0),
+                                               ('2024-01-02', 'spot', 1, 199.9, 1.0),
+                                               ('2024-01-03', 'spot', 1, 50.0, 0.0)])
+        self.assertEqual(rows[0]['account'], 'fp-main')
+        self.assertEqual(rows[1]['fees_by_asset'], {'BNB': 0.001})
+
+    def test_incremental_matches_full(self):
+        for batch in (TRADES[:2], TRADES[2:3], TRADES[3:]):
+            self.store.update(batch, KEYS)
+        full = DailySnapshotStore(':memory:')
+        full.update(TRADES, KEYS)
+        self.assertEqual(self.store.query(), full.query())
+
+    def test_duplicates_ignored(self):
+        self.store.update(TRADES, KEYS)
+        self.assertEqual(self.store.update(TRADES[1:3], KEYS), 0)
+        self.assertEqual(sum(row['trade_count'] for row in self.store.query()), 4)
+
+    def test_backfill_recomputes(self):
+        # 先收到后几天的成交，再补查到更早的买入
+        self.store.update(TRADES[2:], KEYS)
+        self.store.update(TRADES[:2], KEYS)
+        full = DailySnapshotStore(':memory:')
+        full.update(TRADES, KEYS)
+        self.assertEqual(snapshot_view(self.store.query()), snapshot_view(full.query()))
+
+    def test_query_filters(self):
+        other = [trade(10, 2, 12, True, 1, 100, account_name='子账户'),
+                 trade(11, 2, 13, True, 2, 100, market='usdm'),
+                 trade(12, 2, 14, True, 1, 10, symbol='ETHBTC')]
+        self.store.update(TRADES + other, {'主账户': 'fp-main', '子账户': 'fp-sub'})
+        self.assertEqual(self.store.query(accounts=[]), [])
+        self.assertEqual({row['account'] for row in self.store.query(accounts=['fp-sub'])}, {'fp-sub'})
+        usdm = self.store.query(symbol='BTCUSDT', markets=['usdm'])
+        self.assertEqual([(row['symbol'], row['market'], row['close_position']) for row in usdm],
+                         [('BTCUSDT', 'usdm', 2.0)])
+        spot = self.store.query(accounts=['fp-main'], symbol='BTCUSDT', markets=['spot'])
+        self.assertEqual({row['market'] for row in spot}, {'spot'})
+        self.assertEqual([row['day'] for row in self.store.query(accounts=['fp-main'], symbol='BTCUSDT',
+                                                                   start_day='2024-01-02', end_day='2024-01-02')],
+                         ['2024-01-02', '2024-01-02'])
+        self.assertEqual(self.store.query(exchange='okx'), [])
+
+    def test_clear_account(self):
+        self.store.update(TRADES + [trade(10, 2, 12, True, 1, 100, account_name='子账户')],
+                          {'主账户': 'fp-main', '子账户': 'fp-sub'})
+        self.store.clear('fp-main')
+        self.assertEqual({row['account'] for row in self.store.query()}, {'fp-sub'})
+        # 清理后重新写入同样的成交不会被当作重复
+        self.assertEqual(self.store.update(TRADES, KEYS), 4)
+
+    def test_unknown_cost_method(self):
+        with self.assertRaises(ValueError):
+            DailySnapshotStore(':memory:', cost_method='hifo')
+
+
+class ConcurrentWriterTest(unittest.TestCase):
+    """多个 worker 进程各自打开同一个数据库文件写入"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, 'snapshots.sqlite3')
+
+    def test_wal_and_busy_timeout(self):
+        store = DailySnapshotStore(self.path)
+        self.assertEqual(store._conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertGreater(store._conn.execute("PRAGMA busy_timeout").fetchone()[0], 0)
+
+    def test_concurrent_updates(self):
+        stores = [DailySnapshotStore(self.path) for _ in range(4)]
+        errors = []
+
+        def write(index, store):
+            try:
+                for batch in range(20):
+                    trades = [trade(f"{index}-{batch}-{i}", 1 + batch % 3, 10, i % 2 == 0, 1, 100 + i,
+                                    account_name=f"账户{index}") for i in range(10)]
+                    store.update(trades)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(i, store)) for i, store in enumerate(stores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(row['trade_count'] for row in DailySnapshotStore(self.path).query()), 4 * 20 * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
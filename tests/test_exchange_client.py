@@ -0,0 +1,205 @@
+"""通用请求层：按解码结果重试、退避、重试预算、限频暂停，以及令牌桶限频器"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import exchange_client  # noqa: E402
+from exchange_client import (AUTH_ERROR, FAILED, OK, RATE_LIMITED, RETRYABLE, TIMESTAMP_ERROR,  # noqa: E402
+                             Decoded, ExchangeClient, RateLimiter, RequestFailed, RetryBudget, backoff_delay,
+                             get_rate_limiter, release_rate_limiter, run_concurrently)
+
+
+class FakeResponse:
+    def __init__(self, outcome, payload=None, headers=None):
+        self.outcome = outcome
+        self.payload = payload
+        self.status_code = 200 if outcome == OK else 500
+        self.headers = headers or {}
+        self.content = b'{}'
+
+
+class FakeSession:
+    """按顺序返回预设的响应，异常实例会被抛出"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeSigner:
+    def sign(self, method, endpoint, params, timestamp_ms):
+        return endpoint, {}
+
+
+class FakeClock:
+    def __init__(self):
+        self.invalidated = 0
+
+    def now_ms(self, session):
+        return 0
+
+    def invalidate(self):
+        self.invalidated += 1
+
+
+def decode(response):
+    if response.outcome == 'invalid':
+        raise ValueError('不是 JSON')
+    return Decoded(response.outcome, response.payload, response.outcome)
+
+
+class ExchangeClientTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(exchange_client.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.auth_errors = 0
+        self.clock = FakeClock()
+
+    def client(self, responses, rate_limiter=None):
+        def on_auth_error():
+            self.auth_errors += 1
+        client = ExchangeClient('fake', 'https://fake.invalid', FakeSigner(), decode, rate_limiter=rate_limiter,
+                                on_auth_error=on_auth_error, clock=self.clock)
+        client.session = FakeSession(responses)
+        client.retry_budget = RetryBudget()
+        return client
+
+    def test_ok(self):
+        client = self.client([FakeResponse(OK, [1])])
+        self.assertEqual(client.request('/trades'), [1])
+        self.sleep.assert_not_called()
+
+    def test_retryable_then_ok(self):
+        client = self.client([FakeResponse(RETRYABLE), FakeResponse(OK, [1])])
+        self.assertEqual(client.request('/trades'), [1])
+        self.assertEqual(client.session.calls, 2)
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_retries_exhausted(self):
+        client = self.client([FakeResponse(RETRYABLE)] * 4)
+        self.assertIsNone(client.request('/trades', max_retries=3))
+        self.assertEqual(client.session.calls, 4)
+        client = self.client([FakeResponse(RETRYABLE)] * 2)
+        with self.assertRaises(RequestFailed):
+            client.request_or_raise('/trades', max_retries=1)
+
+    def test_network_error_retried(self):
+        client = self.client([requests.exceptions.ConnectionError('断开'), FakeResponse(OK, [1])])
+        self.assertEqual(client.request('/trades'), [1])
+        client = self.client([requests.exceptions.ConnectionError('断开')] * 2)
+        self.assertIsNone(client.request('/trades', max_retries=1))
+
+    def test_auth_error_not_retried(self):
+        client = self.client([FakeResponse(AUTH_ERROR)])
+        self.assertIsNone(client.request('/trades'))
+        self.assertEqual(client.session.calls, 1)
+        self.assertEqual(self.auth_errors, 1)
+
+    def test_failed_and_invalid_not_retried(self):
+        for outcome in (FAILED, 'invalid'):
+            with self.subTest(outcome=outcome):
+                client = self.client([FakeResponse(outcome)])
+                self.assertIsNone(client.request('/trades'))
+                self.assertEqual(client.session.calls, 1)
+
+    def test_timestamp_error_resyncs_clock(self):
+        client = self.client([FakeResponse(TIMESTAMP_ERROR), FakeResponse(OK, [1])])
+        self.assertEqual(client.request('/trades'), [1])
+        self.assertEqual(self.clock.invalidated, 1)
+        self.sleep.assert_not_called()
+
+    def test_rate_limited_pauses_shared_limiter(self):
+        limiter = RateLimiter(1000, burst=1000)
+        client = self.client([FakeResponse(RATE_LIMITED, headers={'Retry-After': '3'}), FakeResponse(OK, [1])],
+                             rate_limiter=limiter)
+        with mock.patch.object(limiter, 'pause', wraps=limiter.pause) as pause:
+            self.assertEqual(client.request('/trades'), [1])
+        pause.assert_called_once_with(3.0)
+        self.assertIn(mock.call(3.0), self.sleep.call_args_list)
+
+    def test_retry_budget_exhausted(self):
+        client = self.client([FakeResponse(RETRYABLE), FakeResponse(OK, [1])])
+        client.retry_budget = RetryBudget(ratio=0, min_per_second=0, capacity=0)
+        self.assertIsNone(client.request('/trades'))
+        self.assertEqual(client.session.calls, 1)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(exchange_client.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait(self):
+        limiter = RateLimiter(10, burst=2)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 0.1, places=2)
+        # 欠额累积：下一个请求预约再往后的时间片
+        self.assertAlmostEqual(limiter.acquire(), 0.2, places=2)
+
+    def test_pause(self):
+        limiter = RateLimiter(1000, burst=10)
+        limiter.pause(5)
+        self.assertAlmostEqual(limiter.acquire(), 5, places=1)
+
+    def test_shared_registry(self):
+        key = ('test', 'account')
+        limiter = get_rate_limiter(key, 5)
+        self.assertIs(get_rate_limiter(key, 5), limiter)
+        release_rate_limiter(key)
+        self.assertIsNot(get_rate_limiter(key, 5), limiter)
+        release_rate_limiter(key)
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def test_withdraw_and_deposit(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+
+class HelpersTest(unittest.TestCase):
+
+    def test_backoff_delay_bounds(self):
+        for attempt in range(10):
+            delay = backoff_delay(attempt, base=1, cap=30)
+            self.assertGreaterEqual(delay, min(30, 2 ** attempt) / 2)
+            self.assertLessEqual(delay, min(30, 2 ** attempt))
+
+    def test_run_concurrently_keeps_order_and_errors(self):
+        def work(item):
+            if item == 3:
+                raise ValueError('坏数据')
+            return item * 2
+        for max_workers in (1, 4):
+            results = run_concurrently(work, range(5), max_workers=max_workers)
+            self.assertEqual(results[:3] + results[4:], [0, 2, 4, 8])
+            self.assertIsInstance(results[3], ValueError)
+        self.assertEqual(run_concurrently(work, []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""ETag / If-None-Match 和按 Accept-Encoding 压缩"""
+
+import gzip
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request  # noqa: E402
+
+import http_caching  # noqa: E402
+from http_caching import cached_json, not_modified  # noqa: E402
+
+LARGE = {'trades': [{'id': i, 'price': 100.5 + i} for i in range(200)]}
+
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/large', methods=['GET', 'POST'])
+    @cached_json
+    def large():
+        return jsonify(LARGE)
+
+    @app.route('/small')
+    @cached_json
+    def small():
+        return jsonify({'success': True})
+
+    @app.route('/error')
+    @cached_json
+    def error():
+        return jsonify({'success': False, 'message': '出错'}), 500
+
+    @app.route('/stored')
+    @cached_json
+    def stored():
+        # 视图用存储中的摘要作为 ETag，命中时不加载数据
+        cached = not_modified('stored-digest')
+        if cached is not None:
+            return cached
+        response = jsonify(LARGE if request.args.get('large') else {'success': True})
+        response.set_etag('stored-digest', weak=True)
+        return response
+
+    return app
+
+
+class CachedJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = make_app().test_client()
+
+    def test_gzip_round_trip(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(response.headers['Cache-Control'], http_caching.CACHE_CONTROL)
+        self.assertEqual(gzip.decompress(response.data), jsonify_bytes(LARGE))
+        # mtime=0：相同内容的压缩结果相同
+        again = self.client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(again.data, response.data)
+
+    def test_no_accepted_encoding(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_json(), LARGE)
+
+    def test_quality_weights(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip;q=1.0, br;q=0.5'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    @unittest.skipIf(http_caching.brotli is None, "未安装 brotli")
+    def test_brotli_preferred(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(http_caching.brotli.decompress(response.data), jsonify_bytes(LARGE))
+
+    def test_small_response_not_compressed(self):
+        response = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_etag_same_for_all_encodings(self):
+        plain = self.client.get('/large')
+        compressed = self.client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(plain.get_etag(), compressed.get_etag())
+        self.assertTrue(plain.get_etag()[1])  # 弱 ETag
+
+    def test_if_none_match(self):
+        etag, _ = self.client.get('/large').get_etag()
+        response = self.client.get('/large', headers={'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        # 只有 GET / HEAD 返回 304
+        response = self.client.post('/large', headers={'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/large', headers={'If-None-Match': 'W/"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_errors_not_cached(self):
+        response = self.client.get('/error', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(response.get_etag()[0])
+        self.assertNotIn('Cache-Control', response.headers)
+
+    def test_view_etag_kept(self):
+        response = self.client.get('/stored?large=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.get_etag(), ('stored-digest', True))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        response = self.client.get('/stored', headers={'If-None-Match': 'W/"stored-digest"'})
+        self.assertEqual(response.status_code, 304)
+
+
+def jsonify_bytes(obj):
+    app = make_app()
+    with app.app_context():
+        return jsonify(obj).get_data()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""交易对元数据缓存：磁盘缓存、过期、加载失败后的退避和旧数据保留"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrument_cache  # noqa: E402
+from instrument_cache import InstrumentCache, get_instrument_cache, normalize_symbol, split_symbol  # noqa: E402
+
+EXCHANGE_INFO = {'symbols': [
+    {'symbol': 'BTCUSDT', 'baseAsset': 'BTC', 'quoteAsset': 'USDT', 'status': 'TRADING',
+     'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.01'}, {'filterType': 'LOT_SIZE', 'stepSize': '0.0001'}]},
+]}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.content = json.dumps(data).encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeSession:
+    def __init__(self, data=EXCHANGE_INFO, error=None):
+        self.data = data
+        self.error = error
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(self.data)
+
+
+class InstrumentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def cache(self, ttl=3600):
+        return InstrumentCache('binance', 'https://api.binance.com/api/v3', ttl=ttl, cache_dir=self.directory)
+
+    def test_load_and_lookup(self):
+        session = FakeSession()
+        cache = self.cache()
+        info = cache.get('btc-usdt', session)
+        self.assertEqual((info['base'], info['quote'], info['tick_size']), ('BTC', 'USDT', '0.01'))
+        self.assertEqual(cache.to_exchange_symbol('BTC/USDT', session), 'BTCUSDT')
+        self.assertIsNone(cache.to_exchange_symbol('ETHUSDT', session))
+        self.assertEqual(session.calls, 1)
+
+    def test_disk_cache_shared_between_instances(self):
+        self.cache().ensure_loaded(FakeSession())
+        session = FakeSession()
+        self.assertIn('BTCUSDT', self.cache().ensure_loaded(session))
+        self.assertEqual(session.calls, 0)
+
+    def test_expired_disk_cache_refetched(self):
+        self.cache().ensure_loaded(FakeSession())
+        session = FakeSession()
+        with mock.patch.object(instrument_cache.time, 'time', return_value=time.time() + 7200):
+            self.cache().ensure_loaded(session)
+        self.assertEqual(session.calls, 1)
+
+    def test_corrupt_disk_cache_refetched(self):
+        cache = self.cache()
+        with open(cache.cache_file, 'w') as f:
+            f.write('{"fetched_at": ')
+        session = FakeSession()
+        self.assertIn('BTCUSDT', cache.ensure_loaded(session))
+        self.assertEqual(session.calls, 1)
+
+    def test_failure_backs_off(self):
+        session = FakeSession(error=ConnectionError('断开'))
+        cache = self.cache()
+        self.assertIsNone(cache.get('BTCUSDT', session))
+        self.assertIsNone(cache.get('BTCUSDT', session))
+        self.assertEqual(session.calls, 1)  # FAILURE_RETRY_INTERVAL 内不再请求
+        self.assertFalse(os.path.exists(cache.cache_file))
+
+    def test_failure_keeps_previous_data(self):
+        cache = self.cache(ttl=-1)  # 每次都已过期
+        cache.ensure_loaded(FakeSession())
+        os.remove(cache.cache_file)
+        cache._expires_at = 0
+        self.assertIsNotNone(cache.get('BTCUSDT', FakeSession(error=ConnectionError('断开'))))
+
+    def test_clear(self):
+        cache = self.cache()
+        cache.ensure_loaded(FakeSession())
+        cache.clear()
+        self.assertFalse(os.path.exists(cache.cache_file))
+        session = FakeSession()
+        cache.ensure_loaded(session)
+        self.assertEqual(session.calls, 1)
+
+    def test_shared_registry(self):
+        first = get_instrument_cache('binance', 'https://example.invalid')
+        self.assertIs(get_instrument_cache('binance', 'https://example.invalid'), first)
+        self.assertIsNot(get_instrument_cache('okx', 'https://example.invalid'), first)
+
+
+class SymbolTest(unittest.TestCase):
+
+    def test_normalize(self):
+        for symbol in ('btc-usdt', 'BTC_USDT', 'btc/usdt', 'BTCUSDT'):
+            self.assertEqual(normalize_symbol(symbol), 'BTCUSDT')
+
+    def test_split(self):
+        self.assertEqual(split_symbol('BTCFDUSD'), ('BTC', 'FDUSD'))
+        self.assertEqual(split_symbol('eth-btc'), ('ETH', 'BTC'))
+        self.assertIsNone(split_symbol('USDT'))
+        self.assertIsNone(split_symbol('XYZ'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""两种 JSON 后端语义一致：非有限数、非 ASCII 转义、超大整数和 default 的回退"""
+
+import json
+import math
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_backend  # noqa: E402
+
+SAMPLE = {'symbol': 'BTCUSDT', 'account': '主账户 🚀', 'price': 42000.5, 'qty': 1e-7, 'ids': [1, 2, 3],
+          'nested': {'isBuyer': True, 'note': None}}
+BACKENDS = ['json'] + (['orjson'] if json_backend.BACKEND == 'orjson' else [])
+
+
+def same(a, b):
+    """比较解析结果，NaN 视为相等"""
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+class BackendTestCase(unittest.TestCase):
+
+    def each_backend(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend), mock.patch.object(json_backend, 'BACKEND', backend):
+                yield backend
+
+
+class DumpsTest(BackendTestCase):
+
+    def test_round_trip(self):
+        for _ in self.each_backend():
+            for indent in (False, True):
+                data = json_backend.dumps_bytes(SAMPLE, indent=indent)
+                self.assertEqual(json.loads(data), SAMPLE)
+
+    def test_ensure_ascii_matches_stdlib(self):
+        expected = json.dumps(SAMPLE, separators=(',', ':'), ensure_ascii=True)
+        for backend in self.each_backend():
+            text = json_backend.dumps(SAMPLE, ensure_ascii=True)
+            self.assertTrue(text.isascii())
+            # 数字写法可能不同（1e-7 / 1e-07），其余部分逐字一致
+            self.assertEqual(text.replace('1e-07', '1e-7'), expected.replace('1e-07', '1e-7'))
+
+    def test_utf8_by_default(self):
+        for _ in self.each_backend():
+            self.assertIn('主账户 🚀'.encode('utf-8'), json_backend.dumps_bytes(SAMPLE))
+
+    def test_non_finite_floats_kept(self):
+        obj = {'nan': float('nan'), 'inf': [float('inf'), -float('inf')], 'none': None}
+        for _ in self.each_backend():
+            text = json_backend.dumps(obj)
+            self.assertIn('NaN', text)
+            self.assertIn('-Infinity', text)
+            self.assertTrue(same(json_backend.loads(text), obj))
+
+    def test_big_int_falls_back(self):
+        obj = {'id': 2 ** 70}
+        for _ in self.each_backend():
+            self.assertEqual(json_backend.loads(json_backend.dumps_bytes(obj)), obj)
+
+    def test_default_and_sort_keys(self):
+        obj = {'b': datetime(2024, 1, 2, 3, 4, 5), 'a': 1}
+        for _ in self.each_backend():
+            text = json_backend.dumps(obj, sort_keys=True, default=str)
+            self.assertEqual(json.loads(text), {'a': 1, 'b': '2024-01-02 03:04:05'})
+            self.assertLess(text.index('"a"'), text.index('"b"'))
+
+    def test_unserializable_raises(self):
+        for _ in self.each_backend():
+            with self.assertRaises(TypeError):
+                json_backend.dumps_bytes({'value': object()})
+
+
+class LoadsTest(BackendTestCase):
+
+    def test_loads_bytes_and_str(self):
+        for _ in self.each_backend():
+            self.assertEqual(json_backend.loads(b'{"a": [1, 2]}'), {'a': [1, 2]})
+            self.assertEqual(json_backend.loads('{"a": "中"}'), {'a': '中'})
+
+    def test_loads_non_finite(self):
+        for _ in self.each_backend():
+            value = json_backend.loads('[NaN, Infinity]')
+            self.assertTrue(math.isnan(value[0]))
+            self.assertEqual(value[1], float('inf'))
+
+    def test_invalid_json_raises(self):
+        for _ in self.each_backend():
+            with self.assertRaises(ValueError):
+                json_backend.loads('{"a": ')
+
+
+class FlaskProviderTest(unittest.TestCase):
+    """app.json.dumps 只有紧凑输出和 2 空格缩进走 json_backend，其他参数交给标准库"""
+
+    @classmethod
+    def setUpClass(cls):
+        import app
+        cls.provider = app.app.json
+
+    def test_indent_honoured(self):
+        for indent in (4, 0, '\t'):
+            with self.subTest(indent=indent):
+                self.assertEqual(self.provider.dumps(SAMPLE, indent=indent),
+                                 json.dumps(SAMPLE, indent=indent, ensure_ascii=True, sort_keys=True))
+        self.assertEqual(self.provider.dumps({'a': [1]}, indent=2), '{\n  "a": [\n    1\n  ]\n}')
+
+    def test_separators_honoured(self):
+        self.assertEqual(self.provider.dumps({'a': 1}, separators=(', ', ': ')), '{"a": 1}')
+
+    def test_default_escapes_non_ascii(self):
+        self.assertEqual(json.loads(self.provider.dumps(SAMPLE)), SAMPLE)
+        self.assertTrue(self.provider.dumps(SAMPLE).isascii())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""逐笔持仓匹配：三种成本方法、空头、手续费折算和持仓状态的持久化"""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lot_matching import AVERAGE, FIFO, LIFO, LotMatcher, Position, realized_pnl  # noqa: E402
+
+
+def trade(trade_id, is_buy, qty, price, commission=0, asset='USDT', **extra):
+    return dict({'id': trade_id, 'time': trade_id, 'symbol': 'BTCUSDT', 'isBuyer': is_buy, 'qty': str(qty),
+                 'price': str(price), 'commission': str(commission), 'commissionAsset': asset,
+                 'exchange': 'binance', 'account_name': '主账户'}, **extra)
+
+
+SEQUENCE = [trade(1, True, 1, 100), trade(2, True, 1, 200), trade(3, False, 1, 300)]
+
+
+class CostMethodTest(unittest.TestCase):
+
+    def test_methods(self):
+        for method, pnl, avg_cost in ((FIFO, 200, 200), (LIFO, 100, 100), (AVERAGE, 150, 150)):
+            with self.subTest(method=method):
+                summary = realized_pnl(SEQUENCE, method)
+                self.assertAlmostEqual(summary['realized_pnl'], pnl)
+                position = summary['positions'][0]
+                self.assertAlmostEqual(position['open_qty'], 1)
+                self.assertAlmostEqual(position['avg_cost'], avg_cost)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            LotMatcher('hifo')
+
+    def test_unsorted_input_sorted_by_time(self):
+        self.assertAlmostEqual(realized_pnl(list(reversed(SEQUENCE)))['realized_pnl'], 200)
+
+    def test_short_position(self):
+        matcher = LotMatcher(FIFO)
+        fills = list(matcher.match([trade(1, False, 2, 100), trade(2, True, 1, 80), trade(3, True, 2, 90)]))
+        self.assertAlmostEqual(fills[1]['realized_pnl'], 20)
+        self.assertAlmostEqual(fills[1]['position_qty'], -1)
+        # 先平掉剩余的 1 个空头，再开 1 个多头
+        self.assertAlmostEqual(fills[2]['matched_qty'], 1)
+        self.assertAlmostEqual(fills[2]['realized_pnl'], 10)
+        self.assertAlmostEqual(fills[2]['position_qty'], 1)
+        self.assertAlmostEqual(fills[2]['avg_cost'], 90)
+
+    def test_fully_closed_position_has_no_residue(self):
+        trades = [trade(i, True, 0.1, 100) for i in range(1, 11)] + [trade(11, False, 1, 100)]
+        position = realized_pnl(trades)['positions'][0]
+        self.assertEqual(position['open_qty'], 0)
+        self.assertEqual(position['avg_cost'], 0)
+        self.assertEqual(position['open_lots'], 0)
+
+
+class FeeTest(unittest.TestCase):
+
+    def test_quote_and_base_fees(self):
+        # 买入手续费计入成本，卖出的基础货币手续费按成交价折算
+        summary = realized_pnl([trade(1, True, 1, 100, 1, 'USDT'), trade(2, False, 1, 110, 0.001, 'BTC')])
+        self.assertAlmostEqual(summary['realized_pnl'], 110 - 101 - 0.11)
+        self.assertAlmostEqual(summary['fees'], 1.11)
+
+    def test_unconverted_fee_tracked_separately(self):
+        summary = realized_pnl([trade(1, True, 1, 100, 0.01, 'BNB'), trade(2, False, 1, 110, 0.01, 'BNB')])
+        self.assertAlmostEqual(summary['realized_pnl'], 10)
+        self.assertAlmostEqual(summary['unconverted_fees']['BNB'], 0.02)
+
+    def test_normalized_fee_used(self):
+        summary = realized_pnl([trade(1, True, 1, 100), trade(2, False, 1, 110, 0.01, 'BNB', commissionQuote=0.5)])
+        self.assertAlmostEqual(summary['realized_pnl'], 9.5)
+        self.assertEqual(summary['unconverted_fees'], {})
+
+
+class PositionKeyTest(unittest.TestCase):
+
+    def test_markets_and_accounts_separate(self):
+        trades = [trade(1, True, 1, 100), trade(2, False, 1, 120, market='usdm'),
+                  trade(3, False, 1, 110, account_name='子账户')]
+        positions = {(p['account'], p['symbol']): p for p in realized_pnl(trades)['positions']}
+        self.assertEqual(set(positions), {('主账户', 'BTCUSDT'), ('主账户', 'BTCUSDT@usdm'), ('子账户', 'BTCUSDT')})
+        self.assertEqual(realized_pnl(trades)['realized_pnl'], 0)
+
+    def test_combined_accounts(self):
+        trades = [trade(1, True, 1, 100), trade(2, False, 1, 110, account_name='子账户')]
+        self.assertAlmostEqual(realized_pnl(trades, per_account=False)['realized_pnl'], 10)
+
+
+class PositionStateTest(unittest.TestCase):
+
+    def test_state_round_trip(self):
+        for method in (FIFO, LIFO, AVERAGE):
+            with self.subTest(method=method):
+                continuous = Position(method)
+                resumed = Position(method)
+                for position in (continuous, resumed):
+                    position.apply(True, 1, 100, 0.1)
+                    position.apply(True, 2, 110, 0.2)
+                state = json.loads(json.dumps(resumed.to_state()))
+                resumed = Position.from_state(method, state)
+                for position in (continuous, resumed):
+                    position.apply(False, 2.5, 120, 0.3)
+                self.assertEqual(continuous.to_state(), resumed.to_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""多进程模式下 /metrics 合并所有 worker 写出的指标"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prometheus_metrics import Counter, Histogram, Registry, clear_multiprocess_dir  # noqa: E402
+
+
+def make_registry():
+    registry = Registry()
+    counter = registry.register(Counter('jobs_total', '任务数', ('kind',)))
+    histogram = registry.register(Histogram('job_seconds', '任务耗时', ('kind',), buckets=(1, 10)))
+    return registry, counter, histogram
+
+
+class MultiprocessRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_single_process_unchanged(self):
+        registry, counter, histogram = make_registry()
+        counter.inc(2, kind='a')
+        histogram.observe(5, kind='a')
+        text = registry.expose()
+        self.assertIn('jobs_total{kind="a"} 2', text)
+        self.assertIn('job_seconds_bucket{kind="a",le="1"} 0', text)
+        self.assertIn('job_seconds_bucket{kind="a",le="10"} 1', text)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_merges_other_workers(self):
+        # 用两个 Registry 模拟两个 worker：各自写出，任意一个都能输出合计
+        first, first_counter, first_histogram = make_registry()
+        second, second_counter, second_histogram = make_registry()
+        first._directory, first._path = self.directory, os.path.join(self.directory, '1.json')
+        second._directory, second._path = self.directory, os.path.join(self.directory, '2.json')
+
+        first_counter.inc(kind='a')
+        first_histogram.observe(0.5, kind='a')
+        second_counter.inc(3, kind='a')
+        second_counter.inc(kind='b')
+        second_histogram.observe(20, kind='a')
+        second.dump()
+
+        text = first.expose()
+        self.assertIn('jobs_total{kind="a"} 4', text)
+        self.assertIn('jobs_total{kind="b"} 1', text)
+        self.assertIn('job_seconds_bucket{kind="a",le="1"} 1', text)
+        self.assertIn('job_seconds_bucket{kind="a",le="+Inf"} 2', text)
+        self.assertIn('job_seconds_sum{kind="a"} 20.5', text)
+        self.assertIn('job_seconds_count{kind="a"} 2', text)
+
+    def test_unreadable_files_skipped(self):
+        registry, counter, _ = make_registry()
+        registry._directory = self.directory
+        with open(os.path.join(self.directory, 'broken.json'), 'w') as f:
+            f.write('{"jobs_total": [[["a"], 1')
+        counter.inc(kind='a')
+        self.assertIn('jobs_total{kind="a"} 1', registry.expose())
+
+    def test_clear_multiprocess_dir(self):
+        registry, counter, _ = make_registry()
+        registry._path = os.path.join(self.directory, '1.json')
+        counter.inc(kind='a')
+        registry.dump()
+        clear_multiprocess_dir(self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
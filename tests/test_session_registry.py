@@ -0,0 +1,89 @@
+"""会话清理：仍被其他会话或后台同步使用的连接池和限频器不能释放"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connection_pool  # noqa: E402
+from exchange_client import get_rate_limiter  # noqa: E402
+from markets import MarketClients  # noqa: E402
+from session_registry import AnalyzerRegistry  # noqa: E402
+
+
+class FakeClient:
+    def __init__(self, base_url, limiter_key):
+        self.base_url = base_url
+        self.rate_limiter = get_rate_limiter(limiter_key, 10)
+        connection_pool.get_shared_session(base_url)
+
+
+class FakeExporter:
+    def __init__(self, base_url, limiter_key):
+        self.market_clients = MarketClients('fake', ('spot',), lambda market: FakeClient(base_url, limiter_key))
+        self.market_clients.get('spot')
+
+
+class FakeAnalyzer:
+    def __init__(self):
+        self.accounts = {}
+
+
+def analyzer_with(base_url, limiter_key):
+    analyzer = FakeAnalyzer()
+    analyzer.accounts['a'] = {'exporter': FakeExporter(base_url, limiter_key)}
+    return analyzer
+
+
+class AnalyzerRegistryReleaseTest(unittest.TestCase):
+
+    def test_release_unused_resources(self):
+        registry = AnalyzerRegistry(FakeAnalyzer)
+        registry._entries['s1'] = [analyzer_with('https://unused.test', ('fake', 'k1')), 0]
+        limiter = get_rate_limiter(('fake', 'k1'), 10)
+        registry.remove('s1')
+        self.assertIsNot(get_rate_limiter(('fake', 'k1'), 10), limiter)
+        self.assertNotIn('https://unused.test', connection_pool._sessions)
+
+    def test_keep_resources_used_by_other_sessions(self):
+        registry = AnalyzerRegistry(FakeAnalyzer)
+        registry._entries['s1'] = [analyzer_with('https://shared.test', ('fake', 'k2')), 0]
+        registry._entries['s2'] = [analyzer_with('https://shared.test', ('fake', 'k2')), 0]
+        limiter = get_rate_limiter(('fake', 'k2'), 10)
+        registry.remove('s1')
+        self.assertIs(get_rate_limiter(('fake', 'k2'), 10), limiter)
+        self.assertIn('https://shared.test', connection_pool._sessions)
+
+    def test_keep_resources_used_by_background_sync(self):
+        sync_exporter = FakeExporter('https://sync.test', ('fake', 'k3'))
+        registry = AnalyzerRegistry(FakeAnalyzer,
+                                    external_clients=lambda: sync_exporter.market_clients.created())
+        registry._entries['s1'] = [analyzer_with('https://sync.test', ('fake', 'k3')), 0]
+        limiter = get_rate_limiter(('fake', 'k3'), 10)
+        session = connection_pool._sessions['https://sync.test']
+        registry.remove('s1')
+        # 后台同步仍在用同一个限频器和连接池，清理后不能出现第二个限频器
+        self.assertIs(get_rate_limiter(('fake', 'k3'), 10), limiter)
+        self.assertIs(connection_pool._sessions['https://sync.test'], session)
+
+    def test_idle_eviction(self):
+        registry = AnalyzerRegistry(FakeAnalyzer, idle_seconds=0)
+        registry.get('s1')
+        self.assertEqual(registry.evict_idle(), 1)
+        self.assertEqual(len(registry), 0)
+
+    def test_capacity_eviction(self):
+        evicted = []
+        registry = AnalyzerRegistry(FakeAnalyzer, max_sessions=2,
+                                    on_evict=lambda reason, count: evicted.append((reason, count)))
+        first = registry.get('s1')
+        registry.get('s2')
+        registry.get('s3')
+        self.assertIsNone(registry.peek('s1'))
+        self.assertIsNot(registry.get('s1'), first)
+        self.assertIn(('capacity', 1), evicted)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""共享存储：账户配置加密、文件权限、结果摘要、租约和过期清理"""
+
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shared_store  # noqa: E402
+import tracing  # noqa: E402
+from shared_store import SharedStore  # noqa: E402
+
+CONFIG = {'account_name': '主账户', 'exchange': 'binance', 'api_key': 'key-123', 'secret_key': 'secret-456'}
+
+
+class SharedStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, 'shared.sqlite3')
+
+    def raw_configs(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return [bytes(row[0]) for row in conn.execute("SELECT config FROM accounts")]
+        finally:
+            conn.close()
+
+
+@unittest.skipIf(shared_store.Fernet is None, "未安装 cryptography")
+class EncryptionTest(SharedStoreTestCase):
+
+    def test_configs_encrypted_at_rest(self):
+        store = SharedStore(self.path, secret_key='k1')
+        store.save_accounts('s1', [CONFIG])
+        for payload in self.raw_configs():
+            self.assertNotIn(b'secret-456', payload)
+            self.assertNotIn(b'key-123', payload)
+        self.assertEqual(store.load_accounts('s1'), (1, [CONFIG]))
+
+    def test_wrong_key_skips_accounts(self):
+        SharedStore(self.path, secret_key='k1').save_accounts('s1', [CONFIG])
+        version, configs = SharedStore(self.path, secret_key='k2').load_accounts('s1')
+        self.assertEqual((version, configs), (1, []))
+        # 同步目标同样跳过无法解密的账户，而不是把密文当作配置
+        store = SharedStore(self.path, secret_key='k2')
+        store.set_sync_target('s1', '主账户', 'BTCUSDT', 7)
+        self.assertEqual(store.sync_targets(), [])
+
+    def test_plaintext_accounts_migrated(self):
+        SharedStore(self.path, secret_key=None).save_accounts('s1', [CONFIG])
+        self.assertTrue(all(payload.startswith(b'{') for payload in self.raw_configs()))
+        store = SharedStore(self.path, secret_key='k1')
+        self.assertFalse(any(payload.startswith(b'{') for payload in self.raw_configs()))
+        self.assertEqual(store.load_accounts('s1')[1], [CONFIG])
+
+    def test_encrypted_accounts_unreadable_without_key(self):
+        SharedStore(self.path, secret_key='k1').save_accounts('s1', [CONFIG])
+        self.assertEqual(SharedStore(self.path, secret_key=None).load_accounts('s1')[1], [])
+
+
+class StoreTest(SharedStoreTestCase):
+
+    def test_private_files(self):
+        store = SharedStore(self.path, secret_key=None)
+        store.save_accounts('s1', [CONFIG])
+        for suffix in ('', '-wal', '-shm'):
+            mode = stat.S_IMODE(os.stat(self.path + suffix).st_mode)
+            self.assertEqual(mode, 0o600, suffix)
+
+    def test_results_and_digest(self):
+        store = SharedStore(self.path, secret_key=None)
+        self.assertIsNone(store.result_digest('s1', 'trades'))
+        store.put_results('s1', trades=[1, 2], symbol='BTCUSDT')
+        digest = store.result_digest('s1', 'trades', 'symbol')
+        self.assertEqual(store.get_result('s1', 'trades'), [1, 2])
+        self.assertEqual(store.result_digest('s1', 'trades', 'symbol'), digest)
+        store.put_results('s1', trades=[1, 2, 3])
+        self.assertNotEqual(store.result_digest('s1', 'trades', 'symbol'), digest)
+        store.put_results('s1', trades=None)
+        self.assertFalse(store.has_result('s1', 'trades'))
+        self.assertEqual(store.get_result('s1', 'trades', 'missing'), 'missing')
+
+    def test_clear_session(self):
+        store = SharedStore(self.path, secret_key=None)
+        store.save_accounts('s1', [CONFIG])
+        store.put_results('s1', trades=[1])
+        store.clear_session('s1')
+        self.assertEqual(store.load_accounts('s1'), (2, []))
+        self.assertIsNone(store.get_result('s1', 'trades'))
+
+    def test_traces_scoped_to_session(self):
+        store = SharedStore(self.path, secret_key=None)
+        trace_ids = []
+        for _ in range(4):
+            with tracing.start_trace('query') as trace:
+                pass
+            store.put_trace('s1', trace, keep=3)
+            trace_ids.append(trace.trace_id)
+        self.assertIsNone(store.get_trace('s1', trace_ids[0]))
+        self.assertEqual(store.get_trace('s1', trace_ids[-1])['name'], 'query')
+        self.assertIsNone(store.get_trace('s2', trace_ids[-1]))
+
+    def test_purge_expired_sessions(self):
+        store = SharedStore(self.path, ttl=60, secret_key=None)
+        store.save_accounts('old', [CONFIG])
+        store.put_results('old', trades=[1])
+        with tracing.start_trace('query') as trace:
+            pass
+        store.put_trace('old', trace)
+        store.save_accounts('new', [CONFIG])
+        self.assertEqual(store.purge(now=time.time() + 30), 0)
+        self.assertEqual(store.purge(now=time.time() + 120), 2)
+        self.assertEqual(store.load_accounts('old'), (0, []))
+        self.assertIsNone(store.get_trace('old', trace.trace_id))
+
+
+class LeaseTest(SharedStoreTestCase):
+
+    def test_lease_exclusive_until_expired(self):
+        first = SharedStore(self.path, secret_key=None)
+        second = SharedStore(self.path, secret_key=None)  # 另一个 worker 的连接
+        self.assertTrue(first.acquire_lease('sync', 'worker-1', 60))
+        self.assertFalse(second.acquire_lease('sync', 'worker-2', 60))
+        self.assertTrue(first.acquire_lease('sync', 'worker-1', 60))  # 续期
+
+    def test_expired_lease_taken_over(self):
+        first = SharedStore(self.path, secret_key=None)
+        second = SharedStore(self.path, secret_key=None)
+        self.assertTrue(first.acquire_lease('sync', 'worker-1', -1))
+        self.assertTrue(second.acquire_lease('sync', 'worker-2', 60))
+        self.assertFalse(first.acquire_lease('sync', 'worker-1', 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
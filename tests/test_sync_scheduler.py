@@ -0,0 +1,157 @@
+"""后台同步：成功的日期写入缓存，失败的目标退避，租约被接管时立即停止且不计为失败"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync_scheduler  # noqa: E402
+from account_validation import credential_fingerprint  # noqa: E402
+from shared_store import SharedStore  # noqa: E402
+from sync_scheduler import LEASE_NAME, SyncScheduler  # noqa: E402
+from trade_cache import TradeCache  # noqa: E402
+
+CONFIG = {'account_name': '主账户', 'exchange': 'binance', 'api_key': 'key', 'secret_key': 'secret'}
+FINGERPRINT = credential_fingerprint('binance', 'key', 'secret', None, False)
+
+
+class _Clients:
+    def created(self):
+        return ['client']
+
+
+class FakeExporter:
+    """每天返回 pages_per_day 页成交；fail_days 中的日期在第一页之后抛出异常"""
+    EXCHANGE = 'binance'
+
+    def __init__(self, pages_per_day=1, fail_days=(), on_page=None):
+        self.pages_per_day = pages_per_day
+        self.fail_days = set(fail_days)
+        self.on_page = on_page
+        self.pages = 0
+        self.market_clients = _Clients()
+
+    def iter_trade_pages(self, symbol, date_str, market='spot', before_request=None):
+        start_ms = int(datetime.strptime(date_str, '%Y-%m-%d').timestamp() * 1000)
+        for page in range(self.pages_per_day):
+            if before_request is not None:
+                before_request()
+            if self.on_page is not None:
+                self.on_page(self.pages)
+            self.pages += 1
+            if date_str in self.fail_days and page > 0:
+                raise RuntimeError('服务端错误')
+            yield [{'id': f"{date_str}-{page}", 'symbol': symbol, 'time': start_ms + page,
+                    'price': '1', 'qty': '1', 'isBuyer': True}]
+
+
+class SyncSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.store = SharedStore(os.path.join(directory, 'shared.sqlite3'), secret_key=None)
+        self.cache = TradeCache(':memory:')
+        self.store.save_accounts('s1', [CONFIG])
+        self.today = datetime.now().date()
+        self.days = [(self.today - timedelta(days=offset)).isoformat() for offset in (1, 0)]
+
+    def scheduler(self, exporter, **kwargs):
+        self.created = []
+
+        def factory(config):
+            self.created.append(config['account_name'])
+            return exporter
+        scheduler = SyncScheduler(self.store, self.cache, factory, interval=60, requests_per_second=1000, **kwargs)
+        self.assertTrue(self.store.acquire_lease(LEASE_NAME, scheduler.owner, 60))
+        scheduler._lease_renewed = time.time()
+        return scheduler
+
+    def test_sync_fills_cache(self):
+        self.store.set_sync_target('s1', '主账户', 'BTCUSDT', 2)
+        exporter = FakeExporter(pages_per_day=2)
+        scheduler = self.scheduler(exporter)
+        self.assertEqual(scheduler.run_once(), {'synced': 1, 'failed': 0})
+        for day in self.days:
+            self.assertEqual(len(self.cache.get(FINGERPRINT, 'BTCUSDT', day)), 2)
+        # 未到下次同步时间
+        self.assertEqual(scheduler.run_once(), {'synced': 0, 'failed': 0})
+        self.assertEqual(exporter.pages, 4)
+        self.assertEqual(scheduler.clients(), ['client'])
+
+    def test_targets_merged_per_account(self):
+        # 两个会话添加了同一个交易所账户，只同步一次，天数取较大者
+        self.store.save_accounts('s2', [CONFIG])
+        self.store.set_sync_target('s1', '主账户', 'BTCUSDT', 1)
+        self.store.set_sync_target('s2', '主账户', 'BTCUSDT', 2)
+        exporter = FakeExporter()
+        scheduler = self.scheduler(exporter)
+        self.assertEqual(scheduler.run_once(), {'synced': 1, 'failed': 0})
+        self.assertEqual(self.created, ['主账户'])
+        self.assertEqual(exporter.pages, 2)
+
+    def test_failed_day_backs_off(self):
+        self.store.set_sync_target('s1', '主账户', 'BTCUSDT', 2)
+        exporter = FakeExporter(pages_per_day=2, fail_days=[self.days[1]])
+        scheduler = self.scheduler(exporter)
+        now = time.time()
+        self.assertEqual(scheduler.run_once(now), {'synced': 0, 'failed': 1})
+        self.assertIsNotNone(self.cache.get(FINGERPRINT, 'BTCUSDT', self.days[0]))
+        self.assertIsNone(self.cache.get(FINGERPRINT, 'BTCUSDT', self.days[1]))
+        next_time, failures = scheduler._state[(FINGERPRINT, 'BTCUSDT', 'spot')]
+        self.assertEqual(failures, 1)
+        self.assertGreater(next_time, now)
+        # 退避期间不再请求
+        pages = exporter.pages
+        self.assertEqual(scheduler.run_once(now + 1), {'synced': 0, 'failed': 0})
+        self.assertEqual(exporter.pages, pages)
+
+    def test_lease_taken_before_sync(self):
+        self.store.set_sync_target('s1', '主账户', 'BTCUSDT', 2)
+        exporter = FakeExporter()
+        scheduler = self.scheduler(exporter)
+        self.assertFalse(self.store.acquire_lease(LEASE_NAME, 'other-worker', 60))
+        # 本 worker 的租约过期后被其他 worker 接管
+        self.store.acquire_lease(LEASE_NAME, scheduler.owner, -1)
+        self.assertTrue(self.store.acquire_lease(LEASE_NAME, 'other-worker', 60))
+        scheduler._lease_renewed = 0
+        self.assertEqual(scheduler.run_once(), {'synced': 0, 'failed': 0})
+        self.assertEqual(exporter.pages, 0)
+        self.assertEqual(scheduler._state[(FINGERPRINT, 'BTCUSDT', 'spot')][1], 0)
+
+    def test_lease_lost_between_pages(self):
+        self.store.set_sync_target('s1', '主账户', 'BTCUSDT', 2)
+
+        def take_over(pages):
+            if pages == 1:  # 第二页之后其他 worker 接管
+                self.store.acquire_lease(LEASE_NAME, scheduler.owner, -1)
+                self.store.acquire_lease(LEASE_NAME, 'other-worker', 60)
+
+        exporter = FakeExporter(pages_per_day=3, on_page=take_over)
+        scheduler = self.scheduler(exporter)
+        with mock.patch.object(sync_scheduler, 'LEASE_RENEW_SECONDS', 0):
+            self.assertEqual(scheduler.run_once(), {'synced': 0, 'failed': 0})
+        self.assertEqual(exporter.pages, 2)
+        for day in self.days:
+            self.assertIsNone(self.cache.get(FINGERPRINT, 'BTCUSDT', day))
+        # 不按失败退避，由接管的 worker 继续同步
+        self.assertEqual(scheduler._state[(FINGERPRINT, 'BTCUSDT', 'spot')][1], 0)
+
+    def test_removed_target_dropped(self):
+        self.store.set_sync_target('s1', '主账户', 'BTCUSDT', 1)
+        scheduler = self.scheduler(FakeExporter())
+        scheduler.run_once()
+        self.store.remove_sync_target('s1', '主账户', 'BTCUSDT')
+        scheduler.run_once()
+        self.assertEqual(scheduler._state, {})
+        self.assertEqual(scheduler.clients(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
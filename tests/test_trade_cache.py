@@ -0,0 +1,123 @@
+"""按天缓存：只有完整获取的日期写入缓存，请求失败的日期不缓存"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from binance_exporter import BinanceTradeExporter  # noqa: E402
+from exchange_client import ExchangeClient  # noqa: E402
+from trade_cache import TradeCache, fetch_day, is_closed  # noqa: E402
+from trade_merge import day_window  # noqa: E402
+
+DAY = '2024-01-02'
+
+
+class FailingClient(ExchangeClient):
+    """每次请求都失败的客户端（ExchangeClient.request 在重试用尽后返回 None）"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, endpoint, params=None, max_retries=3):
+        self.requests += 1
+        return None
+
+
+class PagedClient(ExchangeClient):
+    """按顺序返回给定的页，页用完后失败"""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+
+    def request(self, endpoint, params=None, max_retries=3):
+        return self.pages.pop(0) if self.pages else None
+
+
+def binance_trade(trade_id, time_ms):
+    return {'id': trade_id, 'orderId': trade_id, 'symbol': 'BTCUSDT', 'price': '100', 'qty': '1',
+            'quoteQty': '100', 'commission': '0', 'commissionAsset': 'USDT', 'time': time_ms,
+            'isBuyer': True, 'isMaker': False}
+
+
+def exporter_with(client):
+    exporter = BinanceTradeExporter(api_key='key', secret_key='secret')
+    exporter.market_clients._clients['spot'] = client
+    return exporter
+
+
+class FetchDayTest(unittest.TestCase):
+
+    def test_failed_request_is_incomplete(self):
+        client = FailingClient()
+        trades, complete = fetch_day(exporter_with(client), 'BTCUSDT', DAY)
+        self.assertEqual(trades, [])
+        self.assertFalse(complete)
+        self.assertEqual(client.requests, 1)
+
+    def test_failure_after_full_page_is_incomplete(self):
+        start_ms, _ = day_window(DAY)
+        full_page = [binance_trade(i, start_ms + i) for i in range(1000)]
+        trades, complete = fetch_day(exporter_with(PagedClient([full_page])), 'BTCUSDT', DAY)
+        self.assertEqual(len(trades), 1000)
+        self.assertFalse(complete)
+
+    def test_empty_day_is_complete(self):
+        trades, complete = fetch_day(exporter_with(PagedClient([[]])), 'BTCUSDT', DAY)
+        self.assertEqual((trades, complete), ([], True))
+
+    def test_before_page_only_for_requests(self):
+        start_ms, _ = day_window(DAY)
+        pages = [[binance_trade(i, start_ms + i) for i in range(1000)], [binance_trade(1000, start_ms + 1000)]]
+        tokens = []
+        trades, complete = fetch_day(exporter_with(PagedClient(pages)), 'BTCUSDT', DAY,
+                                     before_page=lambda: tokens.append(1))
+        self.assertTrue(complete)
+        self.assertEqual(len(trades), 1001)
+        self.assertEqual(len(tokens), 2)
+
+
+class TradeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TradeCache(':memory:')
+
+    def test_failed_day_is_not_cached(self):
+        batches = list(self.cache.day_batches(exporter_with(FailingClient()), 'fp', 'BTCUSDT', DAY, DAY))
+        self.assertEqual(batches, [])
+        self.assertFalse(self.cache.is_fresh('fp', 'BTCUSDT', DAY))
+        self.assertIsNone(self.cache.get('fp', 'BTCUSDT', DAY))
+
+    def test_complete_day_is_cached_per_market(self):
+        start_ms, _ = day_window(DAY)
+        exporter = exporter_with(PagedClient([[binance_trade(1, start_ms + 1)]]))
+        stats = {}
+        batches = list(self.cache.day_batches(exporter, 'fp', 'BTCUSDT', DAY, DAY, stats))
+        self.assertEqual(len(batches[0]), 1)
+        self.assertEqual(stats, {'cached_days': 0, 'fetched_days': 1})
+        self.assertTrue(self.cache.is_fresh('fp', 'BTCUSDT', DAY))
+        self.assertFalse(self.cache.is_fresh('fp', 'BTCUSDT@usdm', DAY))
+
+        # 第二次从缓存读取，不再请求
+        batches = list(self.cache.day_batches(exporter_with(FailingClient()), 'fp', 'BTCUSDT', DAY, DAY, stats))
+        self.assertEqual(len(batches[0]), 1)
+        self.assertEqual(stats['cached_days'], 1)
+
+    def test_open_day_expires(self):
+        _, end_ms = day_window(DAY)
+        fetched_at = end_ms / 1000 - 60  # 当天结束前获取
+        self.assertFalse(is_closed(DAY, fetched_at))
+        self.cache.put('fp', 'BTCUSDT', DAY, [], fetched_at)
+        self.assertFalse(self.cache.is_fresh('fp', 'BTCUSDT', DAY, now=fetched_at + self.cache.fresh_seconds + 1))
+        self.assertTrue(self.cache.is_fresh('fp', 'BTCUSDT', DAY, now=fetched_at + 1))
+
+    def test_closed_day_stays_fresh(self):
+        _, end_ms = day_window(DAY)
+        fetched_at = end_ms / 1000 + 3600
+        self.cache.put('fp', 'BTCUSDT', DAY, [], fetched_at)
+        self.assertTrue(self.cache.is_fresh('fp', 'BTCUSDT', DAY, now=fetched_at + 10 ** 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""跨天去重只保留最近的键，内存不随时间跨度增长"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trade_dedup import RollingDedupIndex  # noqa: E402
+
+DAY_MS = 86400000
+
+
+def day_trades(day, count=100):
+    """一天的成交，最后一笔在次日 00:00:00.000（相邻日窗口的重叠部分）"""
+    start = day * DAY_MS
+    trades = [{'id': day * count + i + 1, 'symbol': 'BTCUSDT', 'time': start + i + 1} for i in range(count - 1)]
+    trades.append({'id': (day + 1) * count, 'symbol': 'BTCUSDT', 'time': (day + 1) * DAY_MS})
+    return trades
+
+
+class RollingDedupIndexTest(unittest.TestCase):
+
+    def test_day_windows(self):
+        seen = RollingDedupIndex()
+        total = 0
+        for day in range(30):
+            # 重叠的边界成交也出现在下一天的开头
+            batch = ([] if day == 0 else [day_trades(day - 1)[-1]]) + day_trades(day)
+            total += len(list(seen.filter(batch, 'fake')))
+            seen.next_window()
+            self.assertLessEqual(len(seen), 2 * 101)
+        self.assertEqual(total, 30 * 100)
+        self.assertEqual(seen.duplicates, 29)
+
+    def test_ordered_stream(self):
+        stream = []
+        for day in range(30):
+            stream.extend(day_trades(day))
+            if day < 29:
+                stream.append(day_trades(day)[-1])  # 下一天窗口重复返回的边界成交
+        stream.sort(key=lambda trade: trade['time'])
+        seen = RollingDedupIndex()
+        unique = list(seen.filter_ordered(stream, 'fake'))
+        self.assertEqual(len(unique), 30 * 100)
+        self.assertEqual(seen.duplicates, 29)
+        self.assertLessEqual(len(seen), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
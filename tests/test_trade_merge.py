@@ -0,0 +1,74 @@
+"""预取和多流归并的并发性：各个流的预取线程应在归并之前同时启动"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trade_merge import (day_window, flatten, iter_day_batches, iter_market_trades,  # noqa: E402
+                         merge_trade_streams, prefetch)
+
+DAY_SECONDS = 0.2
+DAYS = ('2024-01-01', '2024-01-04')
+STREAMS = 4
+
+
+class SlowExporter:
+    """每天的请求耗时 DAY_SECONDS，只有最后一天有成交（稀疏的数据）"""
+
+    EXCHANGE = 'fake'
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_trades_for_day(self, symbol, date_str, market='spot'):
+        time.sleep(DAY_SECONDS)
+        if date_str != DAYS[1]:
+            return []
+        start_ms, _ = day_window(date_str)
+        return [{'id': f'{self.name}-{market}', 'symbol': symbol, 'time': start_ms, 'market': market}]
+
+
+class PrefetchConcurrencyTest(unittest.TestCase):
+
+    def test_streams_are_fetched_concurrently(self):
+        started = time.monotonic()
+        streams = [flatten(prefetch(iter_day_batches(SlowExporter(i), 'BTCUSDT', *DAYS)))
+                   for i in range(STREAMS)]
+        trades = list(merge_trade_streams(streams))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(len(trades), STREAMS)
+        serial = STREAMS * 4 * DAY_SECONDS
+        # 串行需要 STREAMS 倍的时间，并发时接近单个流的耗时
+        self.assertLess(elapsed, serial / 2, f"{elapsed:.2f}s，串行约 {serial:.2f}s")
+
+    def test_markets_are_fetched_concurrently(self):
+        markets = ('spot', 'margin', 'usdm', 'coinm')
+        started = time.monotonic()
+        trades = list(iter_market_trades(SlowExporter('account'), 'BTCUSDT', *DAYS, markets))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(sorted(trade['market'] for trade in trades), sorted(markets))
+        serial = len(markets) * 4 * DAY_SECONDS
+        self.assertLess(elapsed, serial / 2, f"{elapsed:.2f}s，串行约 {serial:.2f}s")
+
+    def test_prefetch_starts_before_iteration(self):
+        fetched = []
+
+        def batches():
+            fetched.append(True)
+            yield [1]
+
+        stream = prefetch(batches())
+        deadline = time.monotonic() + 1
+        while not fetched and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(fetched, "生产线程应在第一次迭代之前启动")
+        self.assertEqual(list(stream), [[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
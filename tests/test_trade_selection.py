@@ -0,0 +1,95 @@
+"""选择表达式的求值和无效表达式的拒绝"""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trade_selection import MAX_NODES, SelectionError, TradeIndex, get_trade_index  # noqa: E402
+
+
+def make_trades():
+    trades = []
+    for i in range(10):
+        trades.append({
+            'id': 100 + i, 'time': 1704067200000 + i * 60000, 'isBuyer': i % 2 == 0, 'isMaker': i % 3 == 0,
+            'price': 100.0 + i, 'qty': 1.0, 'quoteQty': 100.0 + i, 'commission': 0.1,
+            'account_name': '主账户' if i < 5 else '子账户', 'exchange': 'binance',
+            'market': 'spot' if i < 8 else 'usdm',
+        })
+    return trades
+
+
+class TradeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TradeIndex(make_trades())
+
+    def test_predicates(self):
+        self.assertEqual(self.index.select({'all': True}), list(range(10)))
+        self.assertEqual(self.index.select({'side': 'buy', 'account': '主账户'}), [0, 2, 4])
+        self.assertEqual(self.index.select({'maker': True}), [0, 3, 6, 9])
+        self.assertEqual(self.index.select({'market': 'linear'}), [8, 9])
+        self.assertEqual(self.index.select({'price': {'min': 103, 'max': 105}}), [3, 4, 5])
+        self.assertEqual(self.index.select({'time': {'from': 1704067200000 + 120000}, 'not': {'side': 'buy'}}),
+                         [3, 5, 7, 9])
+        self.assertEqual(self.index.select({'or': [{'id': ['101']}, {'index': {'from': 8, 'to': 99}}]}),
+                         [1, 8, 9])
+
+    def test_non_finite_numbers_rejected(self):
+        # JSON 中的 NaN / Infinity 会被解析成 float，不能让 int() 抛出 OverflowError / ValueError
+        for expression in ({'index': {'from': float('inf')}}, {'index': {'to': float('nan')}},
+                           {'index': {'from': float('-inf')}}, {'price': {'min': float('nan')}},
+                           {'qty': {'max': float('inf')}}, {'time': {'from': float('inf')}},
+                           {'time': {'to': float('nan')}}, {'index': {'from': 10 ** 400}},
+                           json.loads('{"index": {"to": Infinity}}')):
+            with self.subTest(expression=expression):
+                with self.assertRaises(SelectionError):
+                    self.index.select(expression)
+
+    def test_invalid_expressions(self):
+        for expression in ([], {}, {'unknown': 1}, {'side': 'long'}, {'maker': 'true'}, {'maker': 1},
+                           {'index': [1.5]}, {'index': [True]}, {'price': {'min': 'abc'}},
+                           {'price': 5}, {'time': '2024-01-01'}, {'time': {'from': 'yesterday'}},
+                           {'time': {'from': True}}, {'and': []}, {'or': {}}):
+            with self.subTest(expression=expression):
+                with self.assertRaises(SelectionError):
+                    self.index.select(expression)
+
+    def test_node_budget(self):
+        expression = {'or': [{'side': 'buy'}] * (MAX_NODES + 1)}
+        with self.assertRaises(SelectionError):
+            self.index.select(expression)
+
+    def test_out_of_range_indices_ignored(self):
+        self.assertEqual(self.index.select({'index': [-1, 3, 10, 99]}), [3])
+        self.assertEqual(self.index.select({'index': {'from': -5, 'to': 1}}), [0, 1])
+
+    def test_empty_trades(self):
+        index = TradeIndex([])
+        self.assertEqual(index.select({'all': True}), [])
+        self.assertEqual(index.select({'price': {'min': 1}}), [])
+
+
+class TradeIndexCacheTest(unittest.TestCase):
+
+    def test_missing_result(self):
+        self.assertEqual(get_trade_index('missing-digest', lambda: None), (None, None))
+
+    def test_cached_by_digest(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return make_trades()
+
+        first = get_trade_index('digest-a', load)
+        second = get_trade_index('digest-a', load)
+        self.assertIs(first[1], second[1])
+        self.assertEqual(len(loads), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+服务器时间同步 - 按交易所主机共享的时钟偏差服务
+首次签名请求时才同步，之后在后台线程中定期刷新，创建导出器时不做任何网络请求
+"""
+
+import threading
+import time
+
+import requests
+
+from json_backend import response_json
+
+SYNC_INTERVAL = 600  # 偏差刷新间隔（秒）
+SYNC_TIMEOUT = 10  # 获取服务器时间的超时（秒）
+
+
+def _fetch_binance_time(session, base_url):
+    """Binance: GET /api/v3/time"""
+    response = session.get(f"{base_url}/time", timeout=SYNC_TIMEOUT)
+    response.raise_for_status()
+    return int(response_json(response)['serverTime'])
+
+
+def _fetch_okx_time(session, base_url):
+    """OKX: GET /api/v5/public/time"""
+    response = session.get(f"{base_url}/api/v5/public/time", timeout=SYNC_TIMEOUT)
+    response.raise_for_status()
+    return int(response_json(response)['data'][0]['ts'])
+
+
+def _fetch_bybit_time(session, base_url):
+    """Bybit: GET /v5/market/time"""
+    response = session.get(f"{base_url}/v5/market/time", timeout=SYNC_TIMEOUT)
+    response.raise_for_status()
+    result = response_json(response)
+    if result.get('retCode') != 0:
+        raise ValueError(result.get('retMsg', 'Unknown error'))
+    if result['result'].get('timeNano'):
+        return int(result['result']['timeNano']) // 1_000_000
+    return int(result['result']['timeSecond']) * 1000
+
+
+TIME_FETCHERS = {
+    'binance': _fetch_binance_time,
+    'okx': _fetch_okx_time,
+    'bybit': _fetch_bybit_time,
+}
+
+
+class ServerClock:
+    """单个交易所主机的服务器时间偏差"""
+
+    def __init__(self, exchange, base_url, sync_interval=SYNC_INTERVAL):
+        self.exchange = exchange
+        self.base_url = base_url
+        self.sync_interval = sync_interval
+        self.offset_ms = 0
+        self.last_sync = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def sync(self, session=None):
+        """立即同步一次服务器时间，成功返回 True"""
+        try:
+            local_before = time.time() * 1000
+            server_time = TIME_FETCHERS[self.exchange](session or requests, self.base_url)
+            local_after = time.time() * 1000
+        except Exception as e:
+            print(f"⚠️ {self.exchange} 时间同步失败: {e}，使用本地时间")
+            # 失败后同样记录时间，避免每个请求都重新同步
+            self.last_sync = time.time()
+            return False
+
+        # 以往返时间的中点估计本地时间
+        self.offset_ms = int(server_time - (local_before + local_after) / 2)
+        self.last_sync = time.time()
+        return True
+
+    def _refresh_in_background(self, session):
+        try:
+            self.sync(session)
+        finally:
+            self._refreshing = False
+
+    def now_ms(self, session=None):
+        """返回校正后的毫秒时间戳"""
+        if not self.last_sync:
+            # 首次使用时同步（同一主机只同步一次）
+            with self._lock:
+                if not self.last_sync:
+                    self.sync(session)
+        elif time.time() - self.last_sync > self.sync_interval and not self._refreshing:
+            # 偏差过期，后台刷新，当前请求继续使用旧偏差
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, args=(session,), daemon=True).start()
+        return int(time.time() * 1000) + self.offset_ms
+
+    def invalidate(self):
+        """时间戳被交易所拒绝时调用，下一次请求前重新同步"""
+        with self._lock:
+            self.last_sync = 0
+
+
+# 进程级时钟注册表: {(exchange, base_url): ServerClock}
+_clocks = {}
+_clocks_lock = threading.Lock()
+
+
+def get_server_clock(exchange, base_url):
+    """获取进程内共享的服务器时钟"""
+    key = (exchange, base_url)
+    clock = _clocks.get(key)
+    if clock is None:
+        with _clocks_lock:
+            clock = _clocks.get(key)
+            if clock is None:
+                clock = ServerClock(exchange, base_url)
+                _clocks[key] = clock
+    return clock
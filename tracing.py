@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+查询追踪 - 按查询记录 span 时间线（查询、账户、时间窗口、HTTP 请求、格式转换、分析）
+替代热路径里的 print，静默模式下日志只记录到当前 span，不输出到标准输出
+"""
+
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# 静默模式: 热路径的日志不打印（Web 服务默认开启，命令行默认关闭）
+_quiet = os.environ.get('TRADE_QUIET', '0') == '1'
+
+# 设置后每个追踪结束时保存为 {TRACE_DIR}/{trace_id}.json
+TRACE_DIR = os.environ.get('TRACE_DIR')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_span_ids = itertools.count(1)
+
+
+def set_quiet(quiet=True):
+    global _quiet
+    _quiet = quiet
+
+
+def is_quiet():
+    return _quiet
+
+
+class Span:
+    """一段计时区间"""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'attrs', 'events', 'thread', 'start', 'end')
+
+    def __init__(self, name, parent_id, attrs):
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.events = []
+        self.thread = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def event(self, message):
+        self.events.append((time.perf_counter(), message))
+
+
+class _NullSpan:
+    """没有活动追踪时使用，所有操作都是空操作"""
+
+    def set(self, **attrs):
+        pass
+
+    def event(self, message):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一次查询的完整时间线"""
+
+    def __init__(self, name, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def _add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def timeline(self):
+        """返回按开始时间排序的 span 列表（时间为相对查询开始的毫秒数）"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        timeline = []
+        for span in spans:
+            end = span.end if span.end is not None else time.perf_counter()
+            timeline.append({
+                'id': span.span_id,
+                'parent': span.parent_id,
+                'name': span.name,
+                'start_ms': round((span.start - self.origin) * 1000, 3),
+                'duration_ms': round((end - span.start) * 1000, 3),
+                'thread': span.thread,
+                'attrs': span.attrs,
+                'events': [{'at_ms': round((at - self.origin) * 1000, 3), 'message': message}
+                           for at, message in span.events]
+            })
+        return timeline
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'attrs': self.attrs,
+            'spans': self.timeline()
+        }
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.trace_id}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+        return path
+
+
+@contextmanager
+def start_trace(name, **attrs):
+    """开始一次追踪，作用域内的 span 都会记录到该追踪中"""
+    trace = Trace(name, **attrs)
+    trace_token = _current_trace.set(trace)
+    root = Span(name, None, dict(attrs))
+    trace._add(root)
+    span_token = _current_span.set(root)
+    try:
+        yield trace
+    finally:
+        root.end = time.perf_counter()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if TRACE_DIR:
+            try:
+                trace.save(TRACE_DIR)
+            except OSError as e:
+                print(f"⚠️ 保存追踪失败: {e}")
+
+
+@contextmanager
+def span(name, **attrs):
+    """在当前追踪中记录一个 span，没有活动追踪时几乎没有开销"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield NULL_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attrs)
+    trace._add(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.attrs['error'] = str(e)
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def current_span():
+    return _current_span.get() or NULL_SPAN
+
+
+def log(message):
+    """热路径日志：记录到当前 span，非静默模式下同时打印"""
+    current = _current_span.get()
+    if current is not None:
+        current.event(message)
+    if not _quiet:
+        print(message)
+
+
+def wrap_context(func):
+    """让线程池中的任务继承当前追踪上下文"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+按天缓存的成交 - 后台同步和交互查询共用，按 (凭证指纹, 交易对, 日期) 保存一天的全部成交，
+非现货市场的交易对列为 markets.market_symbol（BTCUSDT@usdm）
+
+    - 已经结束的日期（窗口结束 SETTLE_SECONDS 之后获取的）内容不再变化，永久有效
+    - 当天等尚未结束的日期在获取后 TRADE_SYNC_FRESH_SECONDS 内视为最新
+    - 只缓存完整获取的日期，翻页中途出错的部分结果不写入
+
+按凭证指纹而不是账户名区分，不同会话添加的同一个交易所账户共用缓存；不保存密钥本身
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import json_backend
+import tracing
+from instrument_cache import CACHE_DIR
+from markets import SPOT, market_symbol
+from trade_dedup import DedupIndex
+from trade_merge import day_window, iter_period_days, trade_time
+
+TRADE_CACHE_DB = os.environ.get('TRADE_TRADE_CACHE_DB', os.path.join(CACHE_DIR, 'trade_cache.sqlite3'))
+FRESH_SECONDS = int(os.environ.get('TRADE_SYNC_FRESH_SECONDS', '180'))
+SETTLE_SECONDS = 300  # 窗口结束后再等多久才认为当天的成交不再变化
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS day_trades (
+    fingerprint TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    day TEXT NOT NULL,
+    trades BLOB NOT NULL,
+    fetched_at REAL NOT NULL,
+    closed INTEGER NOT NULL,
+    PRIMARY KEY (fingerprint, symbol, day)
+);
+"""
+
+
+def is_closed(date_str, fetched_at):
+    """在 fetched_at 获取的这一天数据是否已经不会再变化"""
+    _, end_ms = day_window(date_str)
+    return fetched_at * 1000 >= end_ms + SETTLE_SECONDS * 1000
+
+
+def fetch_day(exporter, symbol, date_str, before_page=None, market=SPOT):
+    """
+    获取一天某个市场的成交（去重、按时间排序），返回 (成交, 是否完整)
+    before_page() 在实际请求每一页之前调用（用于后台同步的全局限频），没有下一页时不调用
+    """
+    trades = []
+    seen = DedupIndex()
+    pages = exporter.iter_trade_pages(symbol, date_str, market, before_request=before_page)
+    try:
+        for page in pages:
+            trades.extend(seen.filter(page, exporter.EXCHANGE))
+    except Exception as e:
+        tracing.log(f"  获取 {date_str} 数据时出错: {e}")
+        return sorted(trades, key=trade_time), False
+    finally:
+        pages.close()
+    trades.sort(key=trade_time)
+    return trades, True
+
+
+class TradeCache:
+    """SQLite 中按天保存的成交"""
+
+    def __init__(self, path=TRADE_CACHE_DB, fresh_seconds=FRESH_SECONDS):
+        self.path = path
+        self.fresh_seconds = fresh_seconds
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def get(self, fingerprint, symbol, date_str, now=None):
+        """返回仍然有效的一天成交，没有或已过期时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT trades, fetched_at, closed FROM day_trades WHERE fingerprint = ? AND symbol = ? AND day = ?",
+                (fingerprint, symbol, date_str)).fetchone()
+        if row is None:
+            return None
+        payload, fetched_at, closed = row
+        if not closed and (now or time.time()) - fetched_at >= self.fresh_seconds:
+            return None
+        return json_backend.loads(payload)
+
+    def is_fresh(self, fingerprint, symbol, date_str, now=None):
+        """缓存中的这一天是否仍然有效（不读取成交本身）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, closed FROM day_trades WHERE fingerprint = ? AND symbol = ? AND day = ?",
+                (fingerprint, symbol, date_str)).fetchone()
+        return row is not None and (row[1] or (now or time.time()) - row[0] < self.fresh_seconds)
+
+    def put(self, fingerprint, symbol, date_str, trades, fetched_at=None):
+        """保存完整获取的一天成交"""
+        fetched_at = fetched_at or time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO day_trades VALUES (?, ?, ?, ?, ?, ?)",
+                (fingerprint, symbol, date_str, json_backend.dumps_bytes(trades), fetched_at,
+                 int(is_closed(date_str, fetched_at))))
+            self._conn.commit()
+
+    def day_batches(self, exporter, fingerprint, symbol, start_date, end_date, stats=None, market=SPOT):
+        """
+        按天产出排序后的成交批次（同 trade_merge.iter_day_batches），优先使用缓存，
+        未命中的日期从交易所获取并在完整时写入缓存；stats 记录命中和获取的天数
+        """
+        stats = {} if stats is None else stats
+        stats.setdefault('cached_days', 0)
+        stats.setdefault('fetched_days', 0)
+        key = market_symbol(symbol, market)
+        for date_str in iter_period_days(start_date, end_date):
+            batch = self.get(fingerprint, key, date_str)
+            if batch is not None:
+                stats['cached_days'] += 1
+            else:
+                fetched_at = time.time()
+                batch, complete = fetch_day(exporter, symbol, date_str, market=market)
+                stats['fetched_days'] += 1
+                if complete:
+                    self.put(fingerprint, key, date_str, batch, fetched_at)
+            if batch:
+                yield batch
+
+
+# 进程级共享实例
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_trade_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TradeCache()
+    return _cache
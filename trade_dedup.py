@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+成交去重索引 - 按 (交易所, 账户, 交易对, 市场, 交易ID) 判断成交是否已经出现过
+
+相邻的日窗口首尾重叠（不再漏掉每天最后一秒的成交），重试和并行获取也可能重复返回同一笔成交，
+统一在这里过滤：
+
+    - DedupIndex: 精确的哈希集合，保存所有出现过的键，用于单天或单页范围内的去重
+    - RollingDedupIndex: 只保留最近两个窗口的键，用于跨多天的流（new_dedup_index 返回它）
+
+相邻日窗口只在边界的 1 毫秒重叠，跨天的重复成交只会出现在相邻两天之间；
+按时间有序的流中，同一笔成交的重复出现时间相同。因此长时间段的流不需要记住全部成交，
+内存只与单日（或单个时间点）的成交数有关
+"""
+
+
+def trade_key(trade, exchange=None, account=None):
+    """成交的去重键；exchange / account 为成交中没有对应字段时的默认值
+    现货和合约的交易 ID 各自编号，可能重复，键中包含市场（没有标记市场的成交视为现货）"""
+    return (trade.get('exchange', exchange or ''), trade.get('account_name', account or ''),
+            trade['symbol'], trade.get('market', 'spot'), str(trade['id']))
+
+
+class DedupIndex:
+    """精确去重：保存所有出现过的键"""
+
+    def __init__(self):
+        self._seen = set()
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, key):
+        """键第一次出现时返回 True"""
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        return True
+
+    def filter(self, trades, exchange=None, account=None):
+        """生成器：跳过已经出现过的成交"""
+        for trade in trades:
+            if self.add(trade_key(trade, exchange, account)):
+                yield trade
+
+
+class RollingDedupIndex(DedupIndex):
+    """
+    滚动去重：只保留当前窗口和上一个窗口的键
+    按天处理时每天结束后调用 next_window()；filter_ordered 用于按时间有序的流，时间前进时自动滚动
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._previous = set()
+
+    def __len__(self):
+        return len(self._seen) + len(self._previous)
+
+    def add(self, key):
+        if key in self._previous:
+            self.duplicates += 1
+            return False
+        return super().add(key)
+
+    def next_window(self):
+        """开始新的窗口，丢弃上上个窗口的键"""
+        self._previous = self._seen
+        self._seen = set()
+
+    def filter_ordered(self, trades, exchange=None, account=None):
+        """生成器：按时间有序的成交流去重，只记住最近两个时间点的键"""
+        last_time = None
+        for trade in trades:
+            time_ms = int(trade['time'])
+            if time_ms != last_time:
+                self.next_window()
+                last_time = time_ms
+            if self.add(trade_key(trade, exchange, account)):
+                yield trade
+
+
+def new_dedup_index():
+    """跨多天的流使用的去重索引"""
+    return RollingDedupIndex()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+成交导出 - 三个交易所导出器共用的 CSV / JSON 写入
+既接受列表，也接受 iter_trades 返回的生成器：
+
+    - 列表先按时间排序，再写入（与原来的导出结果一致）
+    - 生成器视为已按时间排序，边获取边写入，内存中只保留当前一页成交
+
+导出多年的历史时传入生成器即可在常量内存下完成
+"""
+
+import csv
+from datetime import datetime
+from itertools import chain
+
+import json_backend
+from markets import SPOT, market_label
+
+CSV_FIELDS = ['交易ID', '订单ID', '交易对', '市场', '交易时间', '买卖方向', '价格', '数量', '金额',
+              '手续费', '手续费资产', '是否maker', '原始时间戳']
+
+
+def format_trade_row(trade):
+    """把一条成交转换为 CSV 行（中文列名）"""
+    return {
+        '交易ID': trade['id'],
+        '订单ID': trade['orderId'],
+        '交易对': trade['symbol'],
+        '市场': market_label(trade.get('market', SPOT)),
+        '交易时间': datetime.fromtimestamp(int(trade['time']) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+        '买卖方向': '买入' if trade['isBuyer'] else '卖出',
+        '价格': float(trade['price']),
+        '数量': float(trade['qty']),
+        '金额': float(trade['quoteQty']),
+        '手续费': float(trade['commission']),
+        '手续费资产': trade['commissionAsset'],
+        '是否maker': '是' if trade['isMaker'] else '否',
+        '原始时间戳': trade['time']
+    }
+
+
+def ordered(trades):
+    """列表按时间排序后返回，迭代器原样返回（假定已有序）"""
+    if isinstance(trades, list):
+        return sorted(trades, key=lambda t: int(t['time']))
+    return trades
+
+
+def peek(trades):
+    """返回 (是否为空, 可从头迭代的成交)，用于在不物化生成器的情况下判断是否有数据"""
+    iterator = iter(trades)
+    for first in iterator:
+        return False, chain([first], iterator)
+    return True, iter(())
+
+
+def format_trades_for_csv(trades):
+    """把成交转换为 CSV 行列表，按时间排序"""
+    return [format_trade_row(trade) for trade in ordered(trades)]
+
+
+def write_csv_rows(rows, filename):
+    """逐行写入 CSV，rows 可以是生成器，返回写入的行数"""
+    count = 0
+    with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _json_element(trade):
+    """数组中的一个元素，缩进与 json.dump(indent=2) 的输出一致（JSON 字符串中不含原始换行符）"""
+    return '  ' + json_backend.dumps(trade, indent=True).replace('\n', '\n  ')
+
+
+def write_json_array(trades, filename):
+    """逐条写入 JSON 数组，格式与 json.dump(indent=2, ensure_ascii=False) 相同，返回写入的条数"""
+    count = 0
+    with open(filename, 'w', encoding='utf-8') as jsonfile:
+        jsonfile.write('[')
+        for trade in trades:
+            jsonfile.write(',\n' if count else '\n')
+            jsonfile.write(_json_element(trade))
+            count += 1
+        jsonfile.write('\n]' if count else ']')
+    return count
+
+
+def export_trades(trades, csv_filename=None, json_filename=None):
+    """一次遍历同时写入 CSV 和 JSON（任一文件名可为空），返回导出的成交数；没有成交时不创建文件"""
+    empty, trades = peek(ordered(trades))
+    if empty:
+        return 0
+
+    csv_file = json_file = None
+    count = 0
+    try:
+        if csv_filename:
+            csv_file = open(csv_filename, 'w', newline='', encoding='utf-8-sig')
+            writer = csv.DictWriter(csv_file, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+        if json_filename:
+            json_file = open(json_filename, 'w', encoding='utf-8')
+            json_file.write('[')
+        for trade in trades:
+            if csv_file:
+                writer.writerow(format_trade_row(trade))
+            if json_file:
+                json_file.write(',\n' if count else '\n')
+                json_file.write(_json_element(trade))
+            count += 1
+        if json_file:
+            json_file.write('\n]')
+    finally:
+        for f in (csv_file, json_file):
+            if f:
+                f.close()
+    return count
+
+
+def export_to_csv(trades, filename):
+    """导出交易记录到CSV文件"""
+    empty, trades = peek(ordered(trades))
+    if empty:
+        print("没有交易记录可导出")
+        return 0
+    count = write_csv_rows(map(format_trade_row, trades), filename)
+    print(f"✅ 交易记录已成功导出到: {filename}")
+    return count
+
+
+def export_to_json(trades, filename):
+    """导出交易记录到JSON文件（列表保持原有顺序）"""
+    empty, trades = peek(trades)
+    if empty:
+        print("没有交易记录可导出")
+        return 0
+    count = write_json_array(trades, filename)
+    print(f"✅ 交易记录已成功导出到: {filename}")
+    return count
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+多账户成交流合并 - 每个账户按天获取成交，后台线程预取，用堆做 k 路归并
+输出按时间全局有序的成交流，下游可以在所有账户获取完之前开始消费
+
+每个账户的流按天升序产出、每天内部按时间排序，因此各自有序；
+heapq.merge 只为每条成交计算一次排序键，内存中只保留各账户预取的若干天数据
+"""
+
+import heapq
+import queue
+import threading
+import weakref
+from datetime import datetime, timedelta
+
+import tracing
+from trade_dedup import new_dedup_index
+
+# 每个账户最多预取的天数（批次），控制内存并提供背压
+PREFETCH_BATCHES = 8
+
+
+def trade_time(trade):
+    return int(trade['time'])
+
+
+def iter_period_days(start_date, end_date):
+    """逐天产出 'YYYY-MM-DD'（包含首尾）"""
+    current_date = datetime.strptime(start_date, '%Y-%m-%d')
+    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+    while current_date <= end_date_obj:
+        yield current_date.strftime('%Y-%m-%d')
+        current_date += timedelta(days=1)
+
+
+def day_window(date_str):
+    """当天的查询窗口 (开始毫秒, 结束毫秒)，两端都包含
+
+    结束于次日 00:00:00.000，与下一天的窗口重叠 1 毫秒，保证每天最后一秒的成交不会漏掉；
+    重叠部分的重复成交由 trade_dedup 过滤
+    """
+    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+    start_ms = int(date_obj.timestamp() * 1000)
+    end_ms = int((date_obj + timedelta(days=1)).timestamp() * 1000)
+    return start_ms, end_ms
+
+
+def iter_day_batches(exporter, symbol, start_date, end_date, market='spot'):
+    """按天获取成交，每天的批次按时间排序后产出"""
+    for date_str in iter_period_days(start_date, end_date):
+        batch = exporter.get_trades_for_day(symbol, date_str, market)
+        if batch:
+            batch.sort(key=trade_time)
+            yield batch
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def prefetch(batches, max_batches=PREFETCH_BATCHES):
+    """
+    在后台线程中消费 batches，最多缓冲 max_batches 个批次，返回只负责读取缓冲区的生成器
+
+    生产线程在调用时立即启动，而不是等到第一次迭代：heapq.merge 逐个启动输入流，
+    若等到迭代时才启动，后一个流要等前一个流产出第一批（或结束）后才开始获取。
+    消费方提前结束或丢弃返回的生成器时，生产线程随之停止
+    """
+    buffer = queue.Queue(max_batches)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put(batch):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(_Failure(e))
+
+    # 生产线程继承当前追踪上下文，账户和时间窗口的 span 仍记录在本次查询中
+    thread = threading.Thread(target=tracing.wrap_context(produce), name='trade-prefetch', daemon=True)
+    thread.start()
+    consumer = _consume(buffer, stop)
+    # 从未迭代过的生成器关闭时不会执行 finally，被回收时同样通知生产线程停止
+    weakref.finalize(consumer, stop.set)
+    return consumer
+
+
+def _consume(buffer, stop):
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def flatten(batches):
+    for batch in batches:
+        yield from batch
+
+
+def merge_trade_streams(streams):
+    """k 路归并多个各自按时间有序的成交流，时间相同时保持流的先后顺序"""
+    return heapq.merge(*streams, key=trade_time)
+
+
+def iter_market_trades(exporter, symbol, start_date, end_date, markets):
+    """
+    同一账户多个市场的成交：每个市场在各自的预取线程中按天获取（使用该市场的客户端和限频器），
+    归并为一个按时间有序的流，跨天重叠的重复成交按 (交易所, 市场, 交易ID) 过滤
+    """
+    streams = [flatten(prefetch(iter_day_batches(exporter, symbol, start_date, end_date, market)))
+               for market in markets]
+    return new_dedup_index().filter_ordered(merge_trade_streams(streams), exporter.EXCHANGE)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+成交选择表达式 - /analyze_trades 用谓词描述要分析的成交，在服务端按列索引求值，
+不必由客户端逐条发送下标
+
+表达式是 JSON 对象，可以嵌套组合:
+
+    {"all": true}                                   全部成交
+    {"index": [0, 5, 9]}  /  {"index": {"from": 0, "to": 999}}     按下标（区间两端都包含）
+    {"id": ["123", "456"]}                          按交易 ID
+    {"time": {"from": "2024-01-01", "to": "2024-01-31 23:59:59"}}  时间区间，也可以是毫秒时间戳
+    {"side": "buy"}  /  {"side": "sell"}
+    {"account": "主账户"}  /  {"account": ["主账户", "子账户"]}
+    {"exchange": ["binance", "okx"]}
+    {"market": "usdm"}  /  {"market": ["spot", "margin"]}   市场，也接受 linear / inverse
+    {"maker": true}
+    {"price": {"min": 100, "max": 200}}              数值区间，字段: price / qty / amount / commission
+    {"and": [...]}  /  {"or": [...]}  /  {"not": {...}}
+
+同一个对象中写多个条件等价于 and。每个条件的结果是一个位图（Python 整数，第 i 位表示第 i 笔成交），
+类别列按值预先建好位图，数值列按值排序后二分查找，组合条件只是位运算
+"""
+
+import bisect
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from markets import MARKET_ALIASES, SPOT
+
+MAX_NODES = 1000  # 表达式最多的条件数
+INDEX_CACHE_SIZE = 4  # 每个进程缓存的成交索引数
+
+NUMERIC_FIELDS = {'price': 'price', 'qty': 'qty', 'amount': 'quoteQty', 'commission': 'commission'}
+SIDES = {'buy': True, 'sell': False, '买入': True, '卖出': False}
+
+
+class SelectionError(ValueError):
+    """选择表达式无效"""
+
+
+def _mask_from_indices(indices, size):
+    """下标集合 -> 位图"""
+    bits = bytearray((size + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _range_mask(start, stop):
+    """下标 [start, stop) 的位图"""
+    if stop <= start:
+        return 0
+    return ((1 << (stop - start)) - 1) << start
+
+
+def mask_indices(mask):
+    """位图 -> 升序下标列表"""
+    indices = []
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    indices.append(base + bit)
+    return indices
+
+
+# 时间格式及其精度（毫秒）：只写到日期或分钟的上界包含这一天 / 这一分钟的全部成交
+TIME_FORMATS = (('%Y-%m-%d %H:%M:%S', 1000), ('%Y-%m-%d %H:%M', 60000), ('%Y-%m-%d', 86400000))
+
+
+def _parse_time(value, upper=False):
+    """毫秒时间戳或 'YYYY-MM-DD[ HH:MM[:SS]]'（本地时间，与页面显示一致）"""
+    if isinstance(value, bool) or (isinstance(value, float) and not math.isfinite(value)):
+        raise SelectionError(f"无效的时间: {value}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    for fmt, precision in TIME_FORMATS:
+        try:
+            start = int(datetime.strptime(str(value), fmt).timestamp() * 1000)
+        except ValueError:
+            continue
+        return start + precision - 1 if upper else start
+    raise SelectionError(f"无效的时间: {value}")
+
+
+def _parse_number(value, name):
+    """有限的数字（NaN / Infinity 无法比较或转换成下标，同样拒绝）"""
+    if isinstance(value, bool):
+        raise SelectionError(f"{name} 必须是数字")
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise SelectionError(f"{name} 必须是数字") from None
+    if not math.isfinite(number):
+        raise SelectionError(f"{name} 必须是有限的数字")
+    return number
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+class _SortedColumn:
+    """数值列：按值排序的下标，区间查询用二分"""
+
+    def __init__(self, values):
+        self.size = len(values)
+        if all(values[i] <= values[i + 1] for i in range(len(values) - 1)):
+            self.order = None  # 已按值排序（例如时间），区间直接对应连续下标
+            self.sorted_values = values
+        else:
+            self.order = sorted(range(len(values)), key=values.__getitem__)
+            self.sorted_values = [values[i] for i in self.order]
+
+    def between(self, low=None, high=None):
+        lo = 0 if low is None else bisect.bisect_left(self.sorted_values, low)
+        hi = self.size if high is None else bisect.bisect_right(self.sorted_values, high)
+        if self.order is None:
+            return _range_mask(lo, hi)
+        return _mask_from_indices(self.order[lo:hi], self.size)
+
+
+class TradeIndex:
+    """一组成交的列索引"""
+
+    def __init__(self, trades):
+        self.size = len(trades)
+        self.all = _range_mask(0, self.size)
+        self._numeric = {}
+        self._trades = trades
+        self._time = _SortedColumn([int(trade['time']) for trade in trades])
+        self._categories = {}
+        for name, value_of in (('account', lambda t: t.get('account_name', '')),
+                               ('exchange', lambda t: t.get('exchange', 'unknown')),
+                               ('market', lambda t: t.get('market', SPOT)),
+                               ('side', lambda t: bool(t['isBuyer'])),
+                               ('maker', lambda t: bool(t.get('isMaker')))):
+            groups = {}
+            for i, trade in enumerate(trades):
+                groups.setdefault(value_of(trade), []).append(i)
+            self._categories[name] = {value: _mask_from_indices(indices, self.size)
+                                      for value, indices in groups.items()}
+        # 交易 ID 几乎各不相同，只保存下标，查询时再组成位图
+        self._ids = {}
+        for i, trade in enumerate(trades):
+            self._ids.setdefault(str(trade['id']), []).append(i)
+
+    def _numeric_column(self, name):
+        # 数值列在第一次使用时才建立
+        column = self._numeric.get(name)
+        if column is None:
+            field = NUMERIC_FIELDS[name]
+            column = self._numeric[name] = _SortedColumn([float(trade[field]) for trade in self._trades])
+        return column
+
+    def _category(self, name, values):
+        masks = self._categories[name]
+        mask = 0
+        for value in values:
+            mask |= masks.get(value, 0)
+        return mask
+
+    def evaluate(self, expression):
+        """求值选择表达式，返回位图"""
+        budget = [MAX_NODES]
+        return self._evaluate(expression, budget)
+
+    def select(self, expression):
+        """返回选中的成交下标（升序）"""
+        return mask_indices(self.evaluate(expression))
+
+    def _evaluate(self, node, budget):
+        if not isinstance(node, dict) or not node:
+            raise SelectionError("选择条件必须是非空的 JSON 对象")
+        mask = self.all
+        for key, value in node.items():
+            budget[0] -= 1
+            if budget[0] < 0:
+                raise SelectionError(f"选择表达式过于复杂（最多 {MAX_NODES} 个条件）")
+            handler = _OPERATORS.get(key)
+            if handler is None:
+                raise SelectionError(f"不支持的选择条件: {key}")
+            mask &= handler(self, value, budget)
+        return mask
+
+    def _and(self, value, budget):
+        mask = self.all
+        for child in self._children(value, 'and'):
+            mask &= self._evaluate(child, budget)
+        return mask
+
+    def _or(self, value, budget):
+        mask = 0
+        for child in self._children(value, 'or'):
+            mask |= self._evaluate(child, budget)
+        return mask
+
+    def _not(self, value, budget):
+        return self.all & ~self._evaluate(value, budget)
+
+    @staticmethod
+    def _children(value, name):
+        if not isinstance(value, list) or not value:
+            raise SelectionError(f"{name} 需要非空的条件列表")
+        return value
+
+    def _all(self, value, budget):
+        return self.all if value else 0
+
+    def _index(self, value, budget):
+        if isinstance(value, dict):
+            start = int(_parse_number(value.get('from', 0), 'index.from'))
+            stop = int(_parse_number(value.get('to', self.size - 1), 'index.to')) + 1
+            return _range_mask(max(0, start), min(self.size, stop))
+        indices = []
+        for i in _as_list(value):
+            if isinstance(i, bool) or not isinstance(i, int):
+                raise SelectionError("index 必须是整数列表或 {from, to} 区间")
+            if 0 <= i < self.size:
+                indices.append(i)
+        return _mask_from_indices(indices, self.size)
+
+    def _id(self, value, budget):
+        indices = []
+        for trade_id in _as_list(value):
+            indices.extend(self._ids.get(str(trade_id), ()))
+        return _mask_from_indices(indices, self.size)
+
+    def _time(self, value, budget):
+        if not isinstance(value, dict):
+            raise SelectionError("time 需要 {from, to} 区间")
+        low = _parse_time(value['from']) if value.get('from') is not None else None
+        high = _parse_time(value['to'], upper=True) if value.get('to') is not None else None
+        return self._time.between(low, high)
+
+    def _side(self, value, budget):
+        sides = []
+        for side in _as_list(value):
+            if side not in SIDES:
+                raise SelectionError(f"无效的买卖方向: {side}（buy / sell）")
+            sides.append(SIDES[side])
+        return self._category('side', sides)
+
+    def _account(self, value, budget):
+        return self._category('account', _as_list(value))
+
+    def _exchange(self, value, budget):
+        return self._category('exchange', _as_list(value))
+
+    def _market(self, value, budget):
+        return self._category('market', [MARKET_ALIASES.get(market, market) for market in _as_list(value)])
+
+    def _maker(self, value, budget):
+        if not isinstance(value, bool):
+            raise SelectionError("maker 必须是 true 或 false")
+        return self._category('maker', [value])
+
+
+def _numeric_range(name):
+    """数值列 {min, max} 条件的处理函数"""
+    def handler(index, value, budget):
+        if not isinstance(value, dict):
+            raise SelectionError(f"{name} 需要 {{min, max}} 区间")
+        low = _parse_number(value['min'], f'{name}.min') if value.get('min') is not None else None
+        high = _parse_number(value['max'], f'{name}.max') if value.get('max') is not None else None
+        return index._numeric_column(name).between(low, high)
+    return handler
+
+
+_OPERATORS = {
+    'and': TradeIndex._and,
+    'or': TradeIndex._or,
+    'not': TradeIndex._not,
+    'all': TradeIndex._all,
+    'index': TradeIndex._index,
+    'id': TradeIndex._id,
+    'time': TradeIndex._time,
+    'side': TradeIndex._side,
+    'account': TradeIndex._account,
+    'exchange': TradeIndex._exchange,
+    'market': TradeIndex._market,
+    'maker': TradeIndex._maker,
+}
+_OPERATORS.update({name: _numeric_range(name) for name in NUMERIC_FIELDS})
+
+
+# 按结果摘要缓存最近使用的成交和索引，同一结果上的多次分析不必重复解析和建索引
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_trade_index(digest, load_trades):
+    """返回 (成交列表, TradeIndex)；digest 为结果的内容摘要，未命中时调用 load_trades() 加载"""
+    with _index_cache_lock:
+        entry = _index_cache.get(digest)
+        if entry is not None:
+            _index_cache.move_to_end(digest)
+            return entry
+    trades = load_trades()
+    if trades is None:
+        return None, None
+    entry = (trades, TradeIndex(trades))
+    with _index_cache_lock:
+        _index_cache[digest] = entry
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return entry
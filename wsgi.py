@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+生产环境 WSGI 入口 - 多进程 + 多线程运行网站
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+    python wsgi.py                      # 等价于上面的命令
+
+进程数 / 线程数 / 监听地址由 gunicorn.conf.py 读取的 TRADE_WORKERS、TRADE_THREADS、TRADE_BIND 控制。
+每个 worker 有自己的分析器和连接池，账户注册和查询结果保存在共享存储（shared_store.py）中，
+同一浏览器会话的请求可以落在任意 worker 上。后台同步线程由 gunicorn.conf.py 的 post_worker_init
+在每个 worker 中启动；使用其他 WSGI 服务器时需在 worker 进程中调用 app.start_background_sync()
+
+必须设置 TRADE_SECRET_KEY（所有 worker 相同），否则拒绝启动
+"""
+
+import os
+
+if not os.environ.get('TRADE_SECRET_KEY'):
+    raise RuntimeError("❌ 未设置 TRADE_SECRET_KEY：多个 worker 需要相同的密钥来签名会话 cookie 和加密账户配置，"
+                       "请先设置，例如 export TRADE_SECRET_KEY=$(python -c \"import secrets; print(secrets.token_hex(32))\")")
+
+from app import app
+
+application = app
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+def main():
+    """用 gunicorn 启动（不经过 gunicorn 命令行）"""
+    from gunicorn.app.base import Application
+
+    class _Application(Application):
+        def init(self, parser, opts, args):
+            pass
+
+        def load_config(self):
+            self.load_config_from_file(CONFIG_FILE)
+
+        def load(self):
+            return application
+
+    _Application().run()
+
+
+if __name__ == '__main__':
+    main()